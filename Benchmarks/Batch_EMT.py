@@ -0,0 +1,77 @@
+""" A benchmark comparing the vectorized BatchEMT calculator against the per-point EMT loop used by SimulationPotential.
+
+Configurations are taken uniformly along the straight line joining the two Butane end points in Examples/Butane, and
+for each chunk size the energies and forces of a chunk are computed both ways. The time per configuration and the
+largest difference between the two results are reported.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Batch_EMT --chunks 1 4 13 52 208
+
+"""
+import argparse
+import time
+import os
+
+import numpy as np
+from ase.io import read
+from ase.calculators.emt import EMT, BatchEMT
+
+
+def per_point(molecule, positions):
+    """ Compute energies and forces one configuration at a time, as SimulationPotential did.
+
+    """
+    energies = np.empty(len(positions))
+    forces = np.empty(positions.shape)
+
+    # Discard the cached results, otherwise repeating a chunk of one configuration would not recompute anything.
+    molecule.get_calculator().results.clear()
+
+    for i in xrange(len(positions)):
+        molecule.set_positions(positions[i])
+        energies[i] = molecule.get_potential_energy()
+        forces[i] = molecule.get_forces()
+    return energies, forces
+
+
+def best_time(function, repeats):
+    """ Return the shortest of several timings of function, along with its result.
+
+    """
+    times = []
+    for i in xrange(repeats):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare BatchEMT against the per-point EMT loop on Butane.')
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1, 4, 13, 52, 208],
+                        help='numbers of configurations evaluated in one call')
+    parser.add_argument('--repeats', type=int, default=5)
+    arguments = parser.parse_args()
+
+    butane = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Examples', 'Butane')
+    molecule = read(os.path.join(butane, 'x0.xyz'))
+    end = read(os.path.join(butane, 'xN.xyz')).get_positions()
+    molecule.set_calculator(EMT())
+    batch = BatchEMT(molecule)
+
+    print '%8s %18s %18s %9s %12s' % ('chunk', 'loop (ms/point)', 'batch (ms/point)', 'speed-up', 'max error')
+    for chunk in arguments.chunks:
+        t = np.linspace(0.0, 1.0, chunk)[:, np.newaxis, np.newaxis]
+        positions = (1 - t) * molecule.get_positions() + t * end
+
+        loop_time, (loop_energies, loop_forces) = best_time(lambda: per_point(molecule, positions), arguments.repeats)
+        batch_time, (batch_energies, batch_forces) = best_time(lambda: batch.calculate(positions), arguments.repeats)
+
+        error = max(np.abs(loop_energies - batch_energies).max(), np.abs(loop_forces - batch_forces).max())
+        print '%8d %18.4f %18.4f %9.1f %12.2e' % (chunk, 1000 * loop_time / chunk, 1000 * batch_time / chunk,
+                                                  loop_time / batch_time, error)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+""" A benchmark comparing the strategies the Curve can use to decide the order in which its nodes are moved.
+
+The first table follows the convergence of the global geodesic for the Butane molecule in Examples/Butane. A number of
+SimulationClient instances are simulated: every task handed out is computed for real, in-process, with its end points
+taken from the curve at the time it is handed out, and its result is returned to the curve once a simulated clock has
+advanced by the time the computation took. The simulated wall time, the number of sweeps and tasks, and the movement of
+the curve in its last sweep are reported once the movement drops below the tolerance. The movement is averaged over the
+nodes, so curves with more nodes need a smaller tolerance to take more than a single sweep.
+
+The second table measures only the cost of choosing the next node, for curves with many nodes whose tasks finish
+instantly.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Curve_Scheduling --global-nodes 8 16 --tolerance 0.002 --clients 4
+
+"""
+import argparse
+import tempfile
+import random
+import heapq
+import shutil
+import time
+import os
+
+import numpy as np
+
+from SimulationUtilities.Curve import Curve
+from SimulationUtilities.Node_Scheduling import SCHEDULERS
+from SimulationClient.CustomBFGS import find_geodesic_midpoint
+from SimulationClient import LinearAlgebra as la
+from Benchmarks.Local_Geodesic import LocalMetric
+
+
+def write_configuration_file(directory, global_number_of_nodes, local_number_of_nodes, tolerance):
+    """ Write a configuration file for Butane.
+
+    Returns:
+      str: The location of the configuration file.
+
+    """
+    butane = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Examples', 'Butane')
+    configuration_file = os.path.join(directory, 'Butane_' + str(global_number_of_nodes) + '.bkhf')
+    with open(configuration_file, 'w') as f:
+        f.write('st = ' + os.path.join(butane, 'x0.xyz') + '\n')
+        f.write('en = ' + os.path.join(butane, 'xN.xyz') + '\n')
+        f.write('ln = ' + str(local_number_of_nodes) + '\n')
+        f.write('gn = ' + str(global_number_of_nodes) + '\n')
+        f.write('pa = 100\n')
+        f.write('to = ' + str(tolerance) + '\n')
+    return configuration_file
+
+
+def converge(metric, scheduler, number_of_clients, maximum_sweeps):
+    """ Run the global algorithm with simulated SimulationClient instances until the curve converges.
+
+    Returns:
+      tuple: The simulated wall time, the numbers of sweeps and tasks, the movement in the last sweep and the mean time
+      taken to choose a node.
+
+    """
+    configuration = metric.POTENTIAL.CONFIGURATION
+    curve = Curve(configuration['start_point'], configuration['end_point'], configuration['global_number_of_nodes'],
+                  configuration['global_number_of_nodes'] * (configuration['local_number_of_nodes'] - 1) + 1,
+                  scheduler)
+    mass_metric = la.DiagonalMassMetric(configuration['molecule'].get_masses(), configuration['dimension'])
+    number_of_inner_points = configuration['local_number_of_nodes']
+
+    def compute(node_number):
+        left_end_point = np.copy(curve.get_points()[node_number - 1])
+        right_end_point = np.copy(curve.get_points()[node_number + 1])
+        tangent_direction = (right_end_point - left_end_point) / float(number_of_inner_points + 1)
+        start = time.time()
+        result = find_geodesic_midpoint(left_end_point, right_end_point, number_of_inner_points,
+                                        la.HouseholderTangentBasis(tangent_direction), tangent_direction,
+                                        configuration['codimension'], metric, mass_metric)
+        return result, time.time() - start
+
+    clock = 0.0
+    idle_clients = number_of_clients
+    running = []
+    sweeps = tasks = selections = 0
+    selection_time = 0.0
+    movement = None
+
+    while sweeps < maximum_sweeps:
+        # Hand a task to every idle client, while there are nodes to move.
+        while idle_clients:
+            start = time.time()
+            node_number = curve.next_movable_node()
+            selection_time += time.time() - start
+            selections += 1
+            if node_number is None:
+                break
+            result, duration = compute(node_number)
+            heapq.heappush(running, (clock + duration, tasks, node_number, result))
+            tasks += 1
+            idle_clients -= 1
+
+        # Advance the clock to the next task to finish and return its result to the curve.
+        clock, task, node_number, result = heapq.heappop(running)
+        idle_clients += 1
+        curve.set_node_position(node_number, result)
+        if curve.all_nodes_moved():
+            sweeps += 1
+            movement = curve.movement
+            if movement < configuration['tolerance']:
+                break
+            curve.set_node_movable()
+
+    return clock, sweeps, tasks, movement, selection_time / selections
+
+
+def selection_cost(scheduler, number_of_nodes, number_of_clients, number_of_sweeps):
+    """ Measure the mean time taken to choose a node for a curve whose tasks finish instantly, in a random order.
+
+    """
+    curve = Curve(np.zeros(3), np.ones(3), number_of_nodes, number_of_nodes, scheduler)
+    generator = random.Random(0)
+    running = []
+    selections = 0
+    selection_time = 0.0
+    sweeps = 0
+    while sweeps < number_of_sweeps:
+        while len(running) < number_of_clients:
+            start = time.time()
+            node_number = curve.next_movable_node()
+            selection_time += time.time() - start
+            selections += 1
+            if node_number is None:
+                break
+            running.append(node_number)
+        node_number = running.pop(generator.randrange(len(running)))
+        curve.set_node_position(node_number, np.random.rand(3))
+        if curve.all_nodes_moved():
+            sweeps += 1
+            curve.set_node_movable()
+    return selection_time / selections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the node scheduling strategies of the Curve.')
+    parser.add_argument('--global-nodes', type=int, nargs='+', default=[8, 16])
+    parser.add_argument('--local-nodes', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--tolerance', type=float, default=0.002)
+    parser.add_argument('--maximum-sweeps', type=int, default=100)
+    parser.add_argument('--selection-nodes', type=int, nargs='+', default=[1000, 10000, 100000])
+    arguments = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        print '%6s %10s %16s %7s %7s %10s %18s' % ('nodes', 'scheduler', 'wall time (s)', 'sweeps', 'tasks', 'movement',
+                                                 'selection (us)')
+        for global_number_of_nodes in arguments.global_nodes:
+            metric = LocalMetric(write_configuration_file(directory, global_number_of_nodes, arguments.local_nodes,
+                                                          arguments.tolerance))
+            for scheduler in sorted(SCHEDULERS):
+                clock, sweeps, tasks, movement, selection = converge(metric, scheduler, arguments.clients,
+                                                                     arguments.maximum_sweeps)
+                print '%6d %10s %16.3f %7d %7d %10.4f %18.2f' % (global_number_of_nodes, scheduler, clock, sweeps,
+                                                                 tasks, movement, 1e6 * selection)
+    finally:
+        shutil.rmtree(directory)
+
+    print
+    print '%8s %10s %18s' % ('nodes', 'scheduler', 'selection (us)')
+    for number_of_nodes in arguments.selection_nodes:
+        for scheduler in sorted(SCHEDULERS):
+            print '%8d %10s %18.2f' % (number_of_nodes, scheduler,
+                                       1e6 * selection_cost(scheduler, number_of_nodes, arguments.clients, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+""" A benchmark comparing the line search that tries one step length at a time against the batched line search, which
+evaluates the metric along the curves for several step lengths in a single request.
+
+For each number of SimulationPotential instances, fresh instances are started on this host and a MetricServerPool is
+connected to them, as a SimulationClient would be. A local geodesic is then computed for every inner node of the
+straight line joining the end points of the Butane molecule in Examples/Butane, once with each line search. The mean
+wall-clock time and number of curves along which the metric was evaluated per local geodesic are reported, along with
+the largest distance between the midpoints found by the two line searches. For the batched line search the number of
+searches in which one of the batched step lengths was taken, rather than falling back to dcsrch, is reported too.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Line_Search --servers 2 4 8 --local-nodes 5 --steps 4
+
+"""
+import multiprocessing
+import argparse
+import logging
+import tempfile
+import shutil
+import time
+import os
+
+import numpy as np
+
+from SimulationUtilities.Curve import Curve
+from SimulationUtilities.Configuration_Processing import read_configuration_file
+from SimulationPotential.SimulationPotential import SimulationPotential
+from SimulationClient.CustomBFGS import find_geodesic_midpoint
+from SimulationClient.MetricValues import MetricServerPool, shutdown_metric
+from SimulationClient import LinearAlgebra as la
+from Benchmarks.Curve_Scheduling import write_configuration_file
+
+AUTHKEY = 'password'
+
+
+def start_potential(configuration_file, port):
+    """ A function to create and start a SimulationPotential instance that only logs warnings.
+
+    """
+    potential = SimulationPotential(configuration_file, os.devnull, logging.WARNING, 'localhost', port, AUTHKEY)
+    potential.run_potential_server()
+
+
+def compute_local_geodesics(configuration, addresses, line_search, line_search_steps):
+    """ Compute a local geodesic for every inner node of the straight line, using the SimulationPotential instances on
+    addresses.
+
+    Returns:
+      tuple: The midpoints, the total time taken, the number of curves along which the metric was evaluated and the
+      statistics of the batched line searches.
+
+    """
+    curve = Curve(configuration['start_point'], configuration['end_point'], configuration['global_number_of_nodes'],
+                  configuration['global_number_of_nodes'] * (configuration['local_number_of_nodes'] - 1) + 1)
+    mass_metric = la.DiagonalMassMetric(configuration['molecule'].get_masses(), configuration['dimension'])
+    number_of_inner_points = configuration['local_number_of_nodes']
+    pool = MetricServerPool(addresses, AUTHKEY)
+
+    midpoints = []
+    statistics = {}
+    start = time.time()
+    for node_number in xrange(1, curve.number_of_nodes - 1):
+        left_end_point = np.copy(curve.get_points()[node_number - 1])
+        right_end_point = np.copy(curve.get_points()[node_number + 1])
+        tangent_direction = (right_end_point - left_end_point) / float(number_of_inner_points + 1)
+        midpoints.append(find_geodesic_midpoint(left_end_point, right_end_point, number_of_inner_points,
+                                                la.HouseholderTangentBasis(tangent_direction), tangent_direction,
+                                                configuration['codimension'], pool, mass_metric,
+                                                line_search=line_search, line_search_steps=line_search_steps,
+                                                statistics=statistics))
+    elapsed = time.time() - start
+    pool.close()
+
+    return midpoints, elapsed, pool.curves_evaluated, statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the dcsrch and batched line searches.')
+    parser.add_argument('--servers', type=int, nargs='+', default=[2, 4, 8],
+                        help='numbers of SimulationPotential instances')
+    parser.add_argument('--global-nodes', type=int, default=8)
+    parser.add_argument('--local-nodes', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=4, help='step lengths tried at once by the batched line search')
+    parser.add_argument('--port', type=int, default=5950)
+    arguments = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    port = arguments.port
+    try:
+        configuration_file = write_configuration_file(directory, arguments.global_nodes, arguments.local_nodes, 0.01)
+        configuration = read_configuration_file(configuration_file)
+        number_of_tasks = configuration['global_number_of_nodes'] - 2
+
+        print '%8s %12s %20s %16s %18s %18s' % ('servers', 'line search', 'time per task (ms)', 'curves per task',
+                                                'midpoint distance', 'batched taken')
+        for number_of_servers in arguments.servers:
+            midpoints = {}
+            for line_search in ['dcsrch', 'batched']:
+                # Start fresh SimulationPotential instances, so that neither line search benefits from their caches.
+                addresses = []
+                potentials = []
+                for server in xrange(number_of_servers):
+                    port += 1
+                    addresses.append(('localhost', port))
+                    potentials.append(multiprocessing.Process(target=start_potential,
+                                                              args=(configuration_file, port)))
+                    potentials[-1].start()
+                time.sleep(1.0)
+
+                try:
+                    midpoints[line_search], elapsed, curves_evaluated, statistics = \
+                        compute_local_geodesics(configuration, addresses, line_search, arguments.steps)
+                finally:
+                    shutdown_metric(addresses, AUTHKEY)
+                    for potential in potentials:
+                        potential.join()
+
+                distance = np.amax(np.abs(np.subtract(midpoints[line_search], midpoints['dcsrch'])))
+                taken = '-'
+                if statistics:
+                    taken = '%d / %d' % (statistics['batched_steps_taken'], statistics['batched_searches'])
+                print '%8d %12s %20.1f %16.1f %18.2e %18s' % (number_of_servers, line_search,
+                                                              1e3 * elapsed / number_of_tasks,
+                                                              curves_evaluated / float(number_of_tasks), distance,
+                                                              taken)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+""" A benchmark comparing the dense BFGS and limited-memory BFGS methods used to compute a single local geodesic.
+
+For each molecule a local geodesic is computed between a configuration and a randomly perturbed copy of it, with the
+metric evaluated in-process by the same code a SimulationPotential runs, so that no servers are needed. Every run takes
+place in a fresh process, and the time taken, the number of metric evaluations, the peak resident memory of the process
+and the size of the optimiser state are reported. The molecules are Butane, from Examples/Butane, and cubes of copper
+atoms with roughly the requested numbers of atoms.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Local_Geodesic --atoms 32 108 256 --local-nodes 5
+
+"""
+import multiprocessing
+import resource
+import argparse
+import tempfile
+import shutil
+import time
+import os
+
+from ase.io import read, write
+from ase.lattice import bulk
+from ase.calculators.emt import BatchEMT
+
+from SimulationPotential.SimulationPotential import SimulationPotential
+from SimulationClient.CustomBFGS import find_geodesic_midpoint
+from SimulationClient import LinearAlgebra as la
+
+
+class LocalMetric:
+    """ Stands in for a MetricServerPool, computing the metric values in-process and counting the evaluations.
+
+    """
+    def __init__(self, configuration_file):
+        self.POTENTIAL = SimulationPotential(configuration_file)
+        self.molecule = self.POTENTIAL.CONFIGURATION['molecule']
+        self.batch_calculator = BatchEMT(self.molecule)
+        self.evaluations = 0
+
+    def get_metric(self, curve, number_of_inner_points):
+        values = self.POTENTIAL.compute_values(self.molecule, [[curve[i], i] for i in xrange(len(curve))], 1e-12,
+                                               self.batch_calculator)
+        self.evaluations += len(values)
+        metric = [[]] * (number_of_inner_points + 2)
+        for value in values:
+            metric[value[1]] = value[0]
+        return metric
+
+    def get_metrics(self, curves, number_of_inner_points):
+        return [self.get_metric(curve, number_of_inner_points) for curve in curves]
+
+
+def write_molecule(directory, name, start, end, local_number_of_nodes, energy):
+    """ Write the end points of a local geodesic, and a configuration file describing it, into directory.
+
+    Returns:
+      str: The location of the configuration file.
+
+    """
+    write(os.path.join(directory, name + '_x0.xyz'), start)
+    write(os.path.join(directory, name + '_xN.xyz'), end)
+    configuration_file = os.path.join(directory, name + '.bkhf')
+    with open(configuration_file, 'w') as f:
+        f.write('st = ' + os.path.join(directory, name + '_x0.xyz') + '\n')
+        f.write('en = ' + os.path.join(directory, name + '_xN.xyz') + '\n')
+        f.write('ln = ' + str(local_number_of_nodes) + '\n')
+        f.write('gn = 3\n')
+        f.write('pa = ' + str(energy) + '\n')
+        f.write('to = 0.01\n')
+    return configuration_file
+
+
+def run(configuration_file, optimiser, lbfgs_memory, queue):
+    """ Compute one local geodesic and put the measurements on queue. This runs in its own process.
+
+    """
+    metric = LocalMetric(configuration_file)
+    configuration = metric.POTENTIAL.CONFIGURATION
+    start_point = configuration['start_point']
+    end_point = configuration['end_point']
+    number_of_inner_points = configuration['local_number_of_nodes']
+    mass_metric = la.DiagonalMassMetric(configuration['molecule'].get_masses(), configuration['dimension'])
+    tangent_direction = (end_point - start_point) / float(number_of_inner_points + 1)
+    tangent_basis = la.HouseholderTangentBasis(tangent_direction)
+
+    start = time.time()
+    find_geodesic_midpoint(start_point, end_point, number_of_inner_points, tangent_basis, tangent_direction,
+                           configuration['codimension'], metric, mass_metric, optimiser=optimiser,
+                           lbfgs_memory=lbfgs_memory)
+    elapsed = time.time() - start
+
+    queue.put((elapsed, metric.evaluations, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare dense and limited-memory BFGS on single local geodesics.')
+    parser.add_argument('--atoms', type=int, nargs='+', default=[32, 108, 256],
+                        help='approximate numbers of atoms in the copper cubes')
+    parser.add_argument('--local-nodes', type=int, default=5)
+    parser.add_argument('--lbfgs-memory', type=int, default=10)
+    arguments = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    butane = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Examples', 'Butane')
+    molecules = [('Butane', write_molecule(directory, 'Butane', read(os.path.join(butane, 'x0.xyz')),
+                                           read(os.path.join(butane, 'xN.xyz')), arguments.local_nodes, 100))]
+    for number_of_atoms in arguments.atoms:
+        repeats = max(1, int(round((number_of_atoms / 4.0) ** (1 / 3.0))))
+        start = bulk('Cu', 'fcc', a=3.6, cubic=True) * (repeats, repeats, repeats)
+        start.set_pbc(False)
+        end = start.copy()
+        end.rattle(0.1, seed=42)
+        name = 'Cu' + str(len(start))
+        molecules.append((name, write_molecule(directory, name, start, end, arguments.local_nodes, 100)))
+
+    print '%8s %10s %7s %10s %12s %14s %16s' % ('molecule', 'variables', 'method', 'time (s)', 'evaluations',
+                                               'peak RSS (MB)', 'state size (MB)')
+    try:
+        for name, configuration_file in molecules:
+            configuration = SimulationPotential(configuration_file).CONFIGURATION
+            number_of_variables = arguments.local_nodes * configuration['codimension']
+            for optimiser in ['bfgs', 'lbfgs']:
+                queue = multiprocessing.Queue()
+                process = multiprocessing.Process(target=run, args=(configuration_file, optimiser,
+                                                                    arguments.lbfgs_memory, queue))
+                process.start()
+                elapsed, evaluations, peak = queue.get()
+                process.join()
+
+                # The dense method stores the inverse Hessian, and the limited-memory method two vectors per update.
+                if optimiser == 'bfgs':
+                    state = 8.0 * number_of_variables ** 2
+                else:
+                    state = 8.0 * 2 * arguments.lbfgs_memory * number_of_variables
+                print '%8s %10d %7s %10.3f %12d %14.1f %16.2f' % (name, number_of_variables, optimiser, elapsed,
+                                                                  evaluations, peak, state / 2 ** 20)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
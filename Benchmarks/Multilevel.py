@@ -0,0 +1,118 @@
+""" A benchmark comparing the global algorithm run at full resolution from the straight line against the multilevel
+scheme, in which coarse curves are converged first and interpolated onto finer ones.
+
+The Butane molecule in Examples/Butane is simulated by a single SimulationClient, with the metric evaluated in-process.
+The levels are read from a configuration file in the same way as the SimulationServer reads them, and each level is
+converged, then interpolated onto the next, in the same way. For each level the number of sweeps and the number of
+evaluations of the potential are reported, along with the totals to reach the final tolerance and the largest distance
+between the final curves of the two runs.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Multilevel --global-nodes 8 --local-nodes 3 --tolerance 0.01 --levels 4,3,0.02
+
+"""
+import argparse
+import tempfile
+import shutil
+
+import numpy as np
+
+from SimulationUtilities.Curve import Curve
+from SimulationUtilities.Configuration_Processing import read_configuration_file
+from SimulationClient.CustomBFGS import find_geodesic_midpoint
+from SimulationClient import LinearAlgebra as la
+from Benchmarks.Local_Geodesic import LocalMetric
+from Benchmarks.Curve_Scheduling import write_configuration_file
+
+
+def converge_level(metric, curve, local_number_of_nodes, tolerance, maximum_sweeps):
+    """ Move the nodes of curve, one at a time, until its movement in a sweep drops below tolerance.
+
+    Returns:
+      int: The number of sweeps.
+
+    """
+    configuration = metric.POTENTIAL.CONFIGURATION
+    mass_metric = la.DiagonalMassMetric(configuration['molecule'].get_masses(), configuration['dimension'])
+    sweeps = 0
+    while sweeps < maximum_sweeps:
+        node_number = curve.next_movable_node()
+        left_end_point = np.copy(curve.get_points()[node_number - 1])
+        right_end_point = np.copy(curve.get_points()[node_number + 1])
+        tangent_direction = (right_end_point - left_end_point) / float(local_number_of_nodes + 1)
+        curve.set_node_position(node_number,
+                                find_geodesic_midpoint(left_end_point, right_end_point, local_number_of_nodes,
+                                                       la.HouseholderTangentBasis(tangent_direction),
+                                                       tangent_direction, configuration['codimension'], metric,
+                                                       mass_metric))
+        if curve.all_nodes_moved():
+            sweeps += 1
+            if curve.movement < tolerance:
+                break
+            curve.set_node_movable()
+    return sweeps
+
+
+def converge(metric, levels, maximum_sweeps):
+    """ Converge each level in turn, starting from the straight line and interpolating each curve onto the next level.
+
+    Returns:
+      tuple: The final curve, and the number of sweeps and evaluations of the potential for each level.
+
+    """
+    configuration = metric.POTENTIAL.CONFIGURATION
+    curve = None
+    statistics = []
+    for global_number_of_nodes, local_number_of_nodes, tolerance in levels:
+        total_number_of_nodes = global_number_of_nodes * (local_number_of_nodes - 1) + 1
+        if curve is None:
+            curve = Curve(configuration['start_point'], configuration['end_point'], global_number_of_nodes,
+                          total_number_of_nodes)
+        else:
+            curve = curve.interpolate(global_number_of_nodes, total_number_of_nodes)
+        evaluations = metric.evaluations
+        sweeps = converge_level(metric, curve, local_number_of_nodes, tolerance, maximum_sweeps)
+        statistics.append((sweeps, metric.evaluations - evaluations))
+    return curve, statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare single level and multilevel convergence of the curve.')
+    parser.add_argument('--global-nodes', type=int, default=8)
+    parser.add_argument('--local-nodes', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--levels', nargs='+', default=['4,3,0.02'],
+                        help='coarse levels, each given as gn,ln,to as in the configuration file')
+    parser.add_argument('--maximum-sweeps', type=int, default=100)
+    arguments = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        configuration_file = write_configuration_file(directory, arguments.global_nodes, arguments.local_nodes,
+                                                      arguments.tolerance)
+        with open(configuration_file, 'a') as f:
+            for level in arguments.levels:
+                f.write('ml = ' + level + '\n')
+        configuration = read_configuration_file(configuration_file)
+        final_level = (configuration['global_number_of_nodes'], configuration['local_number_of_nodes'],
+                       configuration['tolerance'])
+        metric = LocalMetric(configuration_file)
+
+        print '%12s %6s %4s %4s %10s %7s %13s' % ('run', 'level', 'gn', 'ln', 'tolerance', 'sweeps', 'evaluations')
+        curves = []
+        for name, levels in [('single', [final_level]), ('multilevel', configuration['coarse_levels'] + [final_level])]:
+            curve, statistics = converge(metric, levels, arguments.maximum_sweeps)
+            curves.append(curve.get_points())
+            for level in xrange(len(levels)):
+                print '%12s %6d %4d %4d %10g %7d %13d' % ((name, level) + levels[level] + statistics[level])
+            print '%12s %6s %4s %4s %10s %7d %13d' % (name, 'total', '', '', '', sum(s[0] for s in statistics),
+                                                      sum(s[1] for s in statistics))
+        print
+        print 'Largest distance between the final curves: %.4f' % np.amax(np.abs(curves[0] - curves[1]))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+""" A scaling benchmark comparing the two ways NeighborList can build its list.
+
+Periodic FCC copper supercells of increasing size, slightly sheared so that the cell is not orthogonal and with the
+atoms randomly displaced, are given the neighbor list used by EMT. For each size the time taken to build the list
+using the original loop over periodic images (method='images') and using the cell list (method='cells') is reported,
+along with the number of pairs found. The loop over images is only timed up to --images-limit atoms, as it scales
+quadratically, and where both are timed the pairs they find are checked to be the same.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Neighbor_List --atoms 100 1000 10000 100000
+
+"""
+import argparse
+import time
+
+import numpy as np
+from ase.lattice import bulk
+from ase.calculators.neighborlist import NeighborList
+from ase.calculators.emt import EMT
+
+
+def supercell(number_of_atoms):
+    """ Return a sheared, randomly perturbed periodic copper supercell with roughly number_of_atoms atoms.
+
+    """
+    repeats = max(1, int(round((number_of_atoms / 4.0) ** (1 / 3.0))))
+    atoms = bulk('Cu', 'fcc', a=3.6, cubic=True) * (repeats, repeats, repeats)
+    cell = atoms.get_cell()
+    cell[2] += 0.2 * cell[0]
+    atoms.set_cell(cell, scale_atoms=True)
+    atoms.rattle(0.05, seed=42)
+    return atoms
+
+
+def pairs(nl, atoms):
+    """ Return the sorted (i, j, offset) rows of the neighbor list, so that two lists can be compared.
+
+    """
+    rows = []
+    for a in xrange(len(atoms)):
+        indices, offsets = nl.get_neighbors(a)
+        rows.append(np.column_stack((np.repeat(a, len(indices)), indices, offsets)))
+    rows = np.concatenate(rows)
+    return rows[np.lexsort(rows.T[::-1])]
+
+
+def build_time(atoms, cutoff, method, repeats):
+    """ Return the shortest of several timings of building the neighbor list, along with the last list built.
+
+    """
+    times = []
+    for i in xrange(repeats):
+        nl = NeighborList([cutoff] * len(atoms), self_interaction=False, sorted=True, method=method)
+        start = time.time()
+        nl.update(atoms)
+        times.append(time.time() - start)
+    return min(times), nl
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the NeighborList build methods on copper supercells.')
+    parser.add_argument('--atoms', type=int, nargs='+', default=[100, 300, 1000, 3000, 10000, 30000, 100000],
+                        help='approximate numbers of atoms in the supercells')
+    parser.add_argument('--images-limit', type=int, default=5000,
+                        help='largest supercell the loop over images is timed on')
+    parser.add_argument('--repeats', type=int, default=3)
+    arguments = parser.parse_args()
+
+    # Use the same cutoff as EMT, excluding the skin.
+    emt = EMT()
+    emt.initialize(bulk('Cu'))
+    cutoff = 0.5 * emt.rc + 0.25
+
+    print '%8s %10s %14s %14s %9s' % ('atoms', 'pairs', 'images (s)', 'cells (s)', 'speed-up')
+    for number_of_atoms in arguments.atoms:
+        atoms = supercell(number_of_atoms)
+        cells_time, cells = build_time(atoms, cutoff, 'cells', arguments.repeats)
+
+        if len(atoms) <= arguments.images_limit:
+            images_time, images = build_time(atoms, cutoff, 'images', arguments.repeats)
+            assert (pairs(images, atoms) == pairs(cells, atoms)).all()
+            print '%8d %10d %14.4f %14.4f %9.1f' % (len(atoms), cells.nneighbors, images_time, cells_time,
+                                                    images_time / cells_time)
+        else:
+            print '%8d %10d %14s %14.4f %9s' % (len(atoms), cells.nneighbors, '-', cells_time, '-')
+
+
+if __name__ == '__main__':
+    main()
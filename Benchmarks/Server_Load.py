@@ -0,0 +1,215 @@
+""" A load benchmark for the SimulationServer.
+
+A SimulationServer is started in its own process and a number of fake SimulationClient instances, spread over several
+processes with one thread per client, request tasks from it as quickly as they can. A fake client does no geometry at
+all, it immediately returns the midpoint of the end points it was given, so the benchmark measures only the
+communication and scheduling overhead of the server. When the benchmark finishes the number of tasks completed per
+second and the distribution of round-trip latencies are reported.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Server_Load --clients 200 --duration 10
+    python -m Benchmarks.Server_Load --clients 200 --duration 10 --per-message
+
+"""
+from multiprocessing.connection import Client
+import multiprocessing
+import threading
+import argparse
+import logging
+import tempfile
+import socket
+import time
+import os
+
+import numpy as np
+
+from SimulationServer.SimulationServer import SimulationServer
+from SimulationUtilities.Communication_Codes import comm_code
+
+
+def write_configuration_file(global_number_of_nodes, local_number_of_nodes=5):
+    """ Write a configuration file for the Experiment molecule with a tolerance that can never be met, so that the
+    SimulationServer keeps issuing tasks until it is terminated.
+
+    Args:
+      global_number_of_nodes (int): The number of global nodes in the curve.
+      local_number_of_nodes (int, optional): The number of local nodes in the curve.
+
+    Returns:
+      str: The location of the configuration file.
+
+    """
+    experiment = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Experiment')
+    handle, configuration_file = tempfile.mkstemp(suffix='.bkhf')
+    with os.fdopen(handle, 'w') as f:
+        f.write('st = ' + os.path.join(experiment, 'x0.xyz') + '\n')
+        f.write('en = ' + os.path.join(experiment, 'xN.xyz') + '\n')
+        f.write('ln = ' + str(local_number_of_nodes) + '\n')
+        f.write('gn = ' + str(global_number_of_nodes) + '\n')
+        f.write('pa = 100\n')
+        f.write('to = -1\n')
+    return configuration_file
+
+
+def start_server(configuration_file, port, authkey):
+    """ A function to create and start a SimulationServer instance that only logs warnings.
+
+    """
+    server = SimulationServer(configuration_file, os.devnull, os.devnull, 'localhost', port, authkey, logging.WARNING)
+    server.run_simulation()
+
+
+def fake_client(client_name, address, authkey, persistent_session, start_time, end_time, callback_delay, results):
+    """ Behave as a SimulationClient that solves every local geodesic instantly, recording the latency of every
+    exchange with the SimulationServer.
+
+    Args:
+      client_name (str): The unique identifier of the fake client.
+      address (str, int): The address of the SimulationServer.
+      authkey (str): The password used to communicate with the SimulationServer.
+      persistent_session (bool): Whether to hold one connection open or connect afresh for every message.
+      start_time (float): The time at which latencies start being recorded, after every client has connected.
+      end_time (float): The time at which the fake client stops.
+      callback_delay (float): The length of time to wait when the SimulationServer has no task available.
+      results (list): A list the number of tasks completed and the latencies are appended to.
+
+    """
+    session = [None]
+
+    def exchange(client_response):
+        if session[0] is None:
+            session[0] = Client(address, authkey=authkey)
+        session[0].send(client_response)
+        server_response = session[0].recv()
+        if not persistent_session:
+            session[0].close()
+            session[0] = None
+        return server_response
+
+    latencies = []
+    tasks = 0
+    server_response = exchange({'status_code': comm_code('CLIENT_FIRST_CONTACT'), 'client_name': client_name})
+
+    while time.time() < end_time:
+        if server_response['status_code'] == comm_code('SERVER_GIVES_NEW_TASK'):
+            client_response = {'status_code': comm_code('CLIENT_HAS_MIDPOINT_DATA'),
+                               'lease_id': server_response.get('lease_id'),
+                               'node_number': server_response['node_number'],
+                               'new_node_position': 0.5 * (server_response['left_end_point'] +
+                                                           server_response['right_end_point']),
+                               'client_name': client_name}
+        else:
+            time.sleep(callback_delay)
+            client_response = {'status_code': comm_code('CLIENT_HAS_NO_TASK'), 'client_name': client_name}
+
+        sent = time.time()
+        try:
+            server_response = exchange(client_response)
+        except (socket.error, EOFError):
+            break
+        if sent >= start_time:
+            latencies.append(time.time() - sent)
+            if client_response['status_code'] == comm_code('CLIENT_HAS_MIDPOINT_DATA'):
+                tasks += 1
+
+    if session[0] is not None:
+        session[0].close()
+    results.append((tasks, latencies))
+
+
+def run_fake_clients(client_names, address, authkey, persistent_session, start_time, end_time, callback_delay,
+                     queue):
+    """ Run a group of fake clients on threads within a single process and put their results on queue.
+
+    """
+    results = []
+    threads = [threading.Thread(target=fake_client, args=(client_name, address, authkey, persistent_session,
+                                                          start_time, end_time, callback_delay, results))
+               for client_name in client_names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+
+def wait_for_server(address, authkey, timeout=30.0):
+    """ Block until the SimulationServer at address accepts connections.
+
+    """
+    give_up = time.time() + timeout
+    while True:
+        try:
+            Client(address, authkey=authkey).close()
+            return
+        except socket.error:
+            if time.time() > give_up:
+                raise
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput and latency of a SimulationServer.')
+    parser.add_argument('--clients', type=int, default=100, help='number of fake clients')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of processes the fake clients are spread across')
+    parser.add_argument('--nodes', type=int, default=None,
+                        help='number of global nodes, by default enough to keep every client busy')
+    parser.add_argument('--duration', type=float, default=10.0, help='length of the measurement in seconds')
+    parser.add_argument('--warm-up', type=float, default=2.0, help='time allowed for the clients to connect')
+    parser.add_argument('--callback-delay', type=float, default=0.001,
+                        help='time a client waits when no task is available')
+    parser.add_argument('--per-message', action='store_true', help='connect afresh for every message')
+    parser.add_argument('--port', type=int, default=5900)
+    arguments = parser.parse_args()
+
+    address = ('localhost', arguments.port)
+    authkey = 'password'
+    global_number_of_nodes = arguments.nodes or 2 * arguments.clients + 3
+    configuration_file = write_configuration_file(global_number_of_nodes)
+
+    server = multiprocessing.Process(target=start_server, args=(configuration_file, arguments.port, authkey))
+    server.start()
+    wait_for_server(address, authkey)
+
+    start_time = time.time() + arguments.warm_up
+    end_time = start_time + arguments.duration
+    queue = multiprocessing.Queue()
+    processes = []
+    for i in xrange(arguments.processes):
+        client_names = ['Client_' + str(j) for j in xrange(i, arguments.clients, arguments.processes)]
+        process = multiprocessing.Process(target=run_fake_clients,
+                                          args=(client_names, address, authkey, not arguments.per_message, start_time,
+                                                end_time, arguments.callback_delay, queue))
+        process.start()
+        processes.append(process)
+
+    tasks = 0
+    latencies = []
+    for process in processes:
+        for client_tasks, client_latencies in queue.get():
+            tasks += client_tasks
+            latencies.extend(client_latencies)
+    for process in processes:
+        process.join()
+
+    server.terminate()
+    server.join()
+    os.remove(configuration_file)
+
+    latencies = 1000 * np.asarray(latencies)
+    print 'Clients:             %d (%s)' % (arguments.clients, 'per-message connections' if arguments.per_message
+                                            else 'persistent sessions')
+    print 'Global nodes:        %d' % global_number_of_nodes
+    print 'Tasks per second:    %.1f' % (tasks / arguments.duration)
+    print 'Messages per second: %.1f' % (len(latencies) / arguments.duration)
+    if len(latencies) > 0:
+        print 'Latency (ms):        p50 %.3f  p90 %.3f  p99 %.3f  max %.3f' % (np.percentile(latencies, 50),
+                                                                             np.percentile(latencies, 90),
+                                                                             np.percentile(latencies, 99),
+                                                                             latencies.max())
+
+
+if __name__ == '__main__':
+    main()
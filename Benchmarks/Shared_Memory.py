@@ -0,0 +1,141 @@
+""" A benchmark comparing the latency of exchanging points and metric values through a shared memory buffer against
+sending them pickled over a multiprocessing.connection session.
+
+A stand-in SimulationPotential, listening with the same SessionListener and answering the same messages, runs in a
+separate process but evaluates nothing: it returns the negated points as the forces, so that only the cost of moving
+the points and values between the processes is measured. For each molecule size and chunk size the mean time taken for
+a request to be answered, and its values to be unpacked by the client, is reported.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Shared_Memory --atoms 14 108 500 2048 --chunks 1 8 32
+
+"""
+import multiprocessing
+import argparse
+import time
+
+import numpy as np
+from multiprocessing.connection import Client
+
+from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities.Session_Handling import SessionListener
+from SimulationUtilities.Shared_Memory import SharedMetricBuffer
+
+AUTHKEY = 'password'
+
+
+def serve(address):
+    """ Answer requests for metric values, without evaluating anything, until told to shut down.
+
+    """
+    server = SessionListener(address, authkey=AUTHKEY)
+    buffers = {}
+    running = True
+    while running:
+        for client, message in server.poll():
+            if message['status_code'] == comm_code('CLIENT_OFFERS_SHARED_MEMORY'):
+                if client in buffers:
+                    buffers[client].close()
+                buffers[client] = SharedMetricBuffer(message['path'], message['number_of_points'],
+                                                     message['dimension'])
+                server.send(client, {'status_code': comm_code('SERVER_ACCEPTS_SHARED_MEMORY'), 'accepted': True})
+            elif message['status_code'] == comm_code('CLIENT_PROVIDES_POINT') and 'indices' in message:
+                buffer = buffers[client]
+                for i in message['indices']:
+                    buffer.metric[i] = buffer.points[i, 0]
+                    buffer.forces[i] = -buffer.points[i]
+                server.send(client, {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                     'request_id': message['request_id'], 'indices': message['indices']})
+            elif message['status_code'] == comm_code('CLIENT_PROVIDES_POINT'):
+                server.send(client, {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                     'request_id': message['request_id'],
+                                     'values': [[[float(point[0][0]), -point[0]], point[1]]
+                                                for point in message['points']]})
+            elif message['status_code'] == comm_code('KILL'):
+                running = False
+                break
+    for buffer in buffers.values():
+        buffer.close()
+    server.close()
+
+
+def round_trip_connection(connection, points, request_id):
+    """ Send pickled points and unpack the pickled values, as MetricServerPool does without shared memory.
+
+    """
+    connection.send({'status_code': comm_code('CLIENT_PROVIDES_POINT'), 'request_id': request_id,
+                     'points': [[points[i], i] for i in xrange(len(points))]})
+    return [value[0] for value in connection.recv()['values']]
+
+
+def round_trip_shared(connection, buffer, points, request_id):
+    """ Write the points to the shared buffer and copy the values out of it, as MetricServerPool does with shared
+    memory.
+
+    """
+    for i in xrange(len(points)):
+        buffer.points[i] = points[i]
+    connection.send({'status_code': comm_code('CLIENT_PROVIDES_POINT'), 'request_id': request_id,
+                     'indices': range(len(points))})
+    return [[float(buffer.metric[i]), buffer.forces[i].copy()] for i in connection.recv()['indices']]
+
+
+def mean_time(function, repeats):
+    """ Return the mean time taken by function, after calling it once to warm up.
+
+    """
+    function()
+    start = time.time()
+    for i in xrange(repeats):
+        function()
+    return (time.time() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare shared memory against pickled messages between processes.')
+    parser.add_argument('--atoms', type=int, nargs='+', default=[14, 108, 500, 2048],
+                        help='numbers of atoms in the molecules')
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1, 8, 32],
+                        help='numbers of points sent in one request')
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5900)
+    arguments = parser.parse_args()
+
+    address = ('localhost', arguments.port)
+    server = multiprocessing.Process(target=serve, args=(address,))
+    server.start()
+    time.sleep(0.5)
+    connection = Client(address, authkey=AUTHKEY)
+
+    print '%8s %8s %18s %18s %9s' % ('atoms', 'chunk', 'connection (us)', 'shared (us)', 'speed-up')
+    try:
+        for number_of_atoms in arguments.atoms:
+            dimension = 3 * number_of_atoms
+            buffer = SharedMetricBuffer.create(max(arguments.chunks), dimension)
+            offer = buffer.description()
+            offer['status_code'] = comm_code('CLIENT_OFFERS_SHARED_MEMORY')
+            connection.send(offer)
+            connection.recv()
+
+            for chunk in arguments.chunks:
+                points = np.random.RandomState(0).rand(chunk, dimension)
+
+                # Check both transports return the same values before timing them.
+                expected = round_trip_connection(connection, points, 0)
+                found = round_trip_shared(connection, buffer, points, 0)
+                assert all(e[0] == f[0] and (e[1] == f[1]).all() for e, f in zip(expected, found))
+
+                connection_time = mean_time(lambda: round_trip_connection(connection, points, 0), arguments.repeats)
+                shared_time = mean_time(lambda: round_trip_shared(connection, buffer, points, 0), arguments.repeats)
+                print '%8d %8d %18.1f %18.1f %9.1f' % (number_of_atoms, chunk, 1e6 * connection_time, 1e6 * shared_time,
+                                                       connection_time / shared_time)
+            buffer.close()
+    finally:
+        connection.send({'status_code': comm_code('KILL')})
+        connection.close()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
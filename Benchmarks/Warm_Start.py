@@ -0,0 +1,103 @@
+""" A benchmark comparing local geodesics started from the straight line against local geodesics started from the
+previous local geodesic computed for the same node.
+
+The global algorithm is run on the Butane molecule in Examples/Butane by a single simulated SimulationClient, with the
+metric evaluated in-process, until the movement of the curve drops below the tolerance. For each optimiser and each
+kind of start the number of sweeps and the number of curves along which the metric was evaluated are reported, both
+in total and per local geodesic, for the first sweep and for the later sweeps. In the first sweep there is no previous
+local geodesic to start from, so both kinds of start take the same number of evaluations. Later, a node whose end points
+have moved by more than the tolerance since its previous local geodesic is started from the straight line too.
+Tests.test_CustomBFGS checks that warm starts take no more sweeps than cold starts with the numbers of nodes used by
+Local_Simulation.
+
+Example, run from the root of the repository::
+
+    python -m Benchmarks.Warm_Start --global-nodes 8 --tolerance 0.01
+
+"""
+import argparse
+import tempfile
+import shutil
+
+import numpy as np
+
+from SimulationUtilities.Curve import Curve
+from SimulationClient.CustomBFGS import find_geodesic_midpoint
+from SimulationClient import LinearAlgebra as la
+from Benchmarks.Local_Geodesic import LocalMetric
+from Benchmarks.Curve_Scheduling import write_configuration_file
+
+
+def converge(metric, optimiser, warm, maximum_sweeps):
+    """ Run the global algorithm with a single SimulationClient until the curve converges.
+
+    Returns:
+      tuple: The number of sweeps, the number of curves evaluated in each sweep and the number of tasks in each sweep.
+
+    """
+    configuration = metric.POTENTIAL.CONFIGURATION
+    curve = Curve(configuration['start_point'], configuration['end_point'], configuration['global_number_of_nodes'],
+                  configuration['global_number_of_nodes'] * (configuration['local_number_of_nodes'] - 1) + 1)
+    mass_metric = la.DiagonalMassMetric(configuration['molecule'].get_masses(), configuration['dimension'])
+    number_of_inner_points = configuration['local_number_of_nodes']
+    warm_starts = {}
+
+    sweeps = 0
+    curves_evaluated = [0]
+    tasks = [0]
+    while sweeps < maximum_sweeps:
+        node_number = curve.next_movable_node()
+        left_end_point = np.copy(curve.get_points()[node_number - 1])
+        right_end_point = np.copy(curve.get_points()[node_number + 1])
+        tangent_direction = (right_end_point - left_end_point) / float(number_of_inner_points + 1)
+        evaluations = metric.evaluations
+        result = find_geodesic_midpoint(left_end_point, right_end_point, number_of_inner_points,
+                                        la.HouseholderTangentBasis(tangent_direction), tangent_direction,
+                                        configuration['codimension'], metric, mass_metric, optimiser=optimiser,
+                                        lbfgs_memory=configuration['lbfgs_memory'],
+                                        warm_start=warm_starts.setdefault(node_number, {}) if warm else None,
+                                        warm_start_tolerance=configuration['tolerance'])
+
+        # LocalMetric counts points, of which there are number_of_inner_points + 2 on every curve.
+        curves_evaluated[-1] += (metric.evaluations - evaluations) / (number_of_inner_points + 2)
+        tasks[-1] += 1
+
+        curve.set_node_position(node_number, result)
+        if curve.all_nodes_moved():
+            sweeps += 1
+            if curve.movement < configuration['tolerance']:
+                break
+            curve.set_node_movable()
+            curves_evaluated.append(0)
+            tasks.append(0)
+
+    return sweeps, curves_evaluated, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare cold and warm started local geodesics.')
+    parser.add_argument('--global-nodes', type=int, default=8)
+    parser.add_argument('--local-nodes', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--maximum-sweeps', type=int, default=100)
+    arguments = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        metric = LocalMetric(write_configuration_file(directory, arguments.global_nodes, arguments.local_nodes,
+                                                      arguments.tolerance))
+        print '%7s %6s %7s %16s %16s %16s' % ('method', 'start', 'sweeps', 'curves (total)', 'per task (first)',
+                                              'per task (later)')
+        for optimiser in ['bfgs', 'lbfgs']:
+            for warm in [False, True]:
+                sweeps, curves_evaluated, tasks = converge(metric, optimiser, warm, arguments.maximum_sweeps)
+                later = sum(curves_evaluated[1:]) / float(max(sum(tasks[1:]), 1))
+                print '%7s %6s %7d %16d %16.1f %16.1f' % (optimiser, 'warm' if warm else 'cold', sweeps,
+                                                          sum(curves_evaluated),
+                                                          curves_evaluated[0] / float(tasks[0]), later)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
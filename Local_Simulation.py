@@ -6,29 +6,33 @@ from SimulationClient.SimulationClient import SimulationClient
 from SimulationPotential.SimulationPotential import SimulationPotential
 
 
-def startMdServer(configuration_file, output_filename, logfile, hostname, port, authkey, loglevel):
+def startMdServer(configuration_file, output_filename, logfile, hostname, port, authkey, loglevel,
+                  scheduling='callback', speculative=False):
     """ A function to create and start a SimulationServer instance.
 
     """
-    md_server = SimulationServer(configuration_file, output_filename, logfile, hostname, port, authkey, loglevel)
+    md_server = SimulationServer(configuration_file, output_filename, logfile, hostname, port, authkey, loglevel,
+                                 scheduling=scheduling, speculative=speculative)
     md_server.run_simulation()
     md_server.save_simulation()
 
 
-def startMetServer(configuration_file, log_file, log_level, hostname, port, authkey):
+def startMetServer(configuration_file, log_file, log_level, hostname, port, authkey, workers=1):
     """ A function to create and start a SimulationPotential instance.
 
     """
-    met_server = SimulationPotential(configuration_file, log_file, log_level, hostname, port, authkey)
+    met_server = SimulationPotential(configuration_file, log_file, log_level, hostname, port, authkey, workers=workers)
     met_server.run_potential_server()
 
 
-def startMdClient(client_id, server_host, server_port, authkey, metric_server_addresses, configuration_file, logfile):
+def startMdClient(client_id, server_host, server_port, authkey, metric_server_addresses, configuration_file, logfile,
+                  warm_start=None, concurrent_tasks=1):
     """ A function to create and start a SimulationServer instance.
 
     """
     md_client = SimulationClient(client_id, server_host, server_port, authkey, metric_server_addresses,
-                                 configuration_file, logfile)
+                                 configuration_file, logfile, warm_start=warm_start,
+                                 concurrent_tasks=concurrent_tasks)
     md_client.start_client()
 
 if __name__ == '__main__':
@@ -36,6 +40,7 @@ if __name__ == '__main__':
     # Configure distributed system for head machine
     NUMBER_OF_METRIC_SERVERS_PER_CLIENT = 2
     NUMBER_OF_CLIENTS = 2
+    NUMBER_OF_WORKERS_PER_METRIC_SERVER = 1  # None starts one worker process per core
     IP_ADDRESS = 'localhost'
     SERVER_PORT = 5000
     BASE_PORT = 5000  # Typically same value as server port
@@ -61,7 +66,8 @@ if __name__ == '__main__':
             BASE_PORT += 1
             metric_server_addresses.append(('localhost', BASE_PORT))
             m = multiprocessing.Process(target=startMetServer, args=(CONFIG_FILE, None,
-                                                                     logging.INFO, IP_ADDRESS, BASE_PORT, AUTHKEY, ))
+                                                                     logging.INFO, IP_ADDRESS, BASE_PORT, AUTHKEY,
+                                                                     NUMBER_OF_WORKERS_PER_METRIC_SERVER))
             m.start()
 
         # Start a SimulationClient process in a separate thread.
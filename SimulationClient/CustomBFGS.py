@@ -1,18 +1,169 @@
+from collections import deque
+
 import numpy as np
 from scipy.optimize import minpack2
 
 import LinearAlgebra as la
 from Geometric import Length, GradLength
-from MetricValues import get_metric
 
 
-def find_geodesic_midpoint(start_point, end_point, number_of_inner_points, basis_rotation_matrix,
-                           tangent_direction, codimension, metric_server_addresses, mass_matrix, authkey,
-                           gtol=1e-5):
+def lbfgs_direction(gfk, history, initial_scale=1.0):
+    """ Compute the search direction of the limited-memory BFGS method using the two-loop recursion.
+
+    Note:
+      The initial inverse Hessian approximation is a multiple of the identity, by default the identity as in the dense
+      method, so that when history holds every update made so far the direction is identical to the one the dense
+      method would produce.
+
+    Args:
+      gfk (numpy.array) :
+          The gradient at the current iterate.
+      history (deque) :
+          The most recent (sk, yk, rhok) updates, oldest first.
+      initial_scale (optional float) :
+          The multiple of the identity used as the initial inverse Hessian approximation.
+
+    Returns:
+      numpy.array: The search direction -Hk * gfk.
+
+    """
+    q = np.array(gfk, dtype='float64')
+    alpha = []
+
+    # Work backwards through the updates, newest first...
+    for sk, yk, rhok in reversed(history):
+        alpha.append(rhok * np.dot(sk, q))
+        q -= alpha[-1] * yk
+
+    # ...then apply the initial approximation...
+    q *= initial_scale
+
+    # ...and then forwards again, oldest first.
+    for (sk, yk, rhok), alpha_k in zip(history, reversed(alpha)):
+        q += (alpha_k - rhok * np.dot(yk, q)) * sk
+
+    return -q
+
+
+def bfgs_update(Hk, sk, yk, rhok):
+    """ Apply one update of the dense BFGS method to the approximate inverse Hessian.
+
+    Args:
+      Hk (numpy.array) :
+          The approximate inverse Hessian.
+      sk (numpy.array) :
+          The step taken.
+      yk (numpy.array) :
+          The change in the gradient over the step.
+      rhok (float) :
+          The value of 1 / <yk, sk>.
+
+    Returns:
+      numpy.array: The updated approximate inverse Hessian.
+
+    """
+    I = np.eye(len(sk), dtype=int)
+    return np.dot(I - sk[:, np.newaxis] * yk[np.newaxis, :] *
+                  rhok, np.dot(Hk, I - yk[:, np.newaxis] * sk[np.newaxis, :] * rhok)) + (rhok * sk[:, np.newaxis] *
+                                                                                         sk[np.newaxis, :])
+
+
+def warm_start_is_usable(warm_start, start_point, end_point, number_of_inner_points, dimension, tolerance):
+    """ Decide whether the local geodesic previously computed for a node is a better initial guess than the straight
+    line for the next one.
+
+    Note:
+      A state computed with a different number of local nodes, or for a different molecule, can't be used. Nor can one
+      whose end points have since moved by more than tolerance in the L^{\infty} norm, which is the norm used to measure
+      the movement of the global curve.
+
+    Args:
+      warm_start (dict) :
+          The state stored by find_geodesic_midpoint, which may be empty or None.
+      start_point (numpy.array) :
+          The first end point of the new curve.
+      end_point (numpy.array) :
+          The last end point of the new curve.
+      number_of_inner_points (int) :
+          The number of nodes along the curve, less the end points.
+      dimension (int) :
+          The dimension of the problem.
+      tolerance (float) :
+          The furthest either end point may have moved for the state to be used.
+
+    Returns:
+      bool: True if the local geodesic should start from the state.
+
+    """
+    if not warm_start or np.shape(warm_start.get('shifts')) != (number_of_inner_points, dimension):
+        return False
+
+    for point, previous_point in [(start_point, warm_start.get('left_end_point')),
+                                  (end_point, warm_start.get('right_end_point'))]:
+        if previous_point is None or np.amax(np.abs(np.subtract(point, previous_point))) > tolerance:
+            return False
+
+    return True
+
+
+def warm_start_iterate(warm_start, tangent_basis):
+    """ Convert the local geodesic previously computed for a node into an initial guess for the next one.
+
+    Note:
+      Only the shifts of the inner points are carried over. The steps and changes in the gradient of the previous
+      computation were measured on a curve with other end points, and applying them to the approximate inverse Hessian
+      of the new one made the method take longer than starting from the identity. The shifts are stored as vectors in
+      the full space, as the tangent direction will have moved since, and are projected onto the shifts from the new
+      tangent direction.
+
+    Args:
+      warm_start (dict) :
+          The state stored by find_geodesic_midpoint, for which warm_start_is_usable is True.
+      tangent_basis (HouseholderTangentBasis) :
+          The orthonormal basis whose first vector is parallel to the new tangent direction.
+
+    Returns:
+      numpy.array: The initial shifts.
+
+    """
+    return la.vectors_to_shifts(warm_start['shifts'], tangent_basis)
+
+
+def find_geodesic_midpoint(start_point, end_point, number_of_inner_points, tangent_basis,
+                           tangent_direction, codimension, metric_servers, mass_metric, gtol=1e-5,
+                           optimiser='bfgs', lbfgs_memory=10, warm_start=None, warm_start_tolerance=np.inf,
+                           line_search='dcsrch', line_search_steps=4, statistics=None):
     """ This function computes the local geodesic curve joining start_point to end_point using a modified BFGS method.
     The modification arises from taking the implementation of BFGS and re-writing it to minimise the number
     of times the metric function is called.
 
+    Note:
+      With optimiser='bfgs' a dense approximation to the inverse Hessian is stored, whose size is the square of the
+      number of variables. With optimiser='lbfgs' only the last lbfgs_memory updates are stored and the search direction
+      is computed from them, so the memory and time per iteration are linear in the number of variables. Both use the
+      same line search and so make the same number of metric evaluations per iteration.
+
+      When the same node of the global curve is moved again its end points have usually moved only slightly, so the
+      previous local geodesic is a better initial guess than the straight line. If warm_start holds the state left by
+      the previous computation, and neither end point has moved by more than warm_start_tolerance since, then the
+      method starts from its shifts. The approximate inverse Hessian still starts from the identity, but is rescaled by
+      <yk, sk> / <yk, yk> before the first update, as the unit step along the gradient is rarely the right length close
+      to a minimum. On return warm_start holds the state of this computation: the shifts of the inner points as
+      'shifts', as vectors in the full space, and the end points as 'left_end_point' and 'right_end_point'.
+
+      With line_search='dcsrch' the line search tries one step length at a time, so each trial waits for the metric
+      values along a single curve. With line_search='batched' the metric is evaluated along the curves for
+      line_search_steps step lengths, spaced by factors of two around the step length taken in the previous iteration,
+      or the unit step in the first, in a single request to metric_servers. The step giving the shortest curve of those
+      satisfying the sufficient decrease condition is taken. If none does the next line_search_steps smaller step
+      lengths are tried, down to the smallest step length dcsrch tries, and only then is the step found by dcsrch.
+
+      Unlike dcsrch the batched line search doesn't require the curvature condition. GradLength takes the forces at the
+      nodes as the gradient of the metric coefficient a = sqrt(E - V), which is the forces divided by 2a, so the
+      derivative along the search direction overstates the change in length and the condition was almost never met by
+      any of the batched step lengths. An update to the approximate inverse Hessian that would make it indefinite is
+      skipped instead.
+
     Args:
       start_point (numpy.array) :
           The first end point of the curve.
@@ -20,22 +171,35 @@ def find_geodesic_midpoint(start_point, end_point, number_of_inner_points, basis
           The last end point of the curve.
       number_of_inner_points (int) :
           The number of nodes along the curve, less the end points.
-      basis_rotation_matrix (numpy.array) :
-          The matrix computed as a result of the orthogonal_tangent_basis function.
+      tangent_basis (HouseholderTangentBasis) :
+          The orthonormal basis whose first vector is parallel to the tangent direction.
       tangent_direction (numpy.array) :
           The tangent direction as computed by the SimulationClient.
       codimension (int) :
           The dimension of the problem minus 1. Computed from the atomistic simulation environment.
-      metric_server_addresses :
-          A list of tuples of the form (str, int) containing the hostnames and port numbers of the SimulationPotential
-          instances.
-      mass_matrix (numpy.array) :
-          A diagonal NumPy array containing the masses of the molecular system as computed in the SimulationClient
-          object.
-      authkey (str) :
-          The password used in order to communicate with the SimulationPotential instances.
+      metric_servers (MetricServerPool) :
+          The pool of connections to the SimulationPotential instances used to compute the metric values.
+      mass_metric (DiagonalMassMetric) :
+          The mass matrix of the molecular system as computed in the SimulationClient object.
       gtol (optional float) :
           The tolerance threshold for the BGFS method.
+      optimiser (optional str) :
+          Either 'bfgs' for the dense BFGS method or 'lbfgs' for the limited-memory BFGS method.
+      lbfgs_memory (optional int) :
+          The number of updates the limited-memory BFGS method remembers.
+      warm_start (optional dict) :
+          The state of the previous computation for the same node, or an empty dict if there is none. It is replaced
+          by the state of this computation, unless the metric couldn't be computed. If None no state is kept.
+      warm_start_tolerance (optional float) :
+          The furthest, in the L^{\infty} norm, either end point may have moved since the previous computation for its
+          state to be used.
+      line_search (optional str) :
+          Either 'dcsrch' to try one step length at a time or 'batched' to try line_search_steps at once.
+      line_search_steps (optional int) :
+          The number of step lengths tried at once by the batched line search.
+      statistics (optional dict) :
+          If given, the number of batched line searches and the number of those in which a batched step length was
+          taken are added to its 'batched_searches' and 'batched_steps_taken' entries.
 
     Returns:
       numpy.array: The midpoint along the local geodesic curve.
@@ -49,29 +213,47 @@ def find_geodesic_midpoint(start_point, end_point, number_of_inner_points, basis
     # start_point to end_point is the initial guess
     x0 = np.zeros(number_of_variables)
 
+    # Unless the previous local geodesic for this node is known, and its end points are close to these, in which case
+    # start from it instead.
+    warm = warm_start_is_usable(warm_start, start_point, end_point, number_of_inner_points, codimension + 1,
+                                warm_start_tolerance)
+    if warm:
+        x0 = warm_start_iterate(warm_start, tangent_basis)
+
     # Allocate memory for the kth iterate
     xk = x0
 
     # Convert the description of the curve as shifts in the orthonormal hyperspace along the initial line to points in
     # the full space. See LinearAlgebra.shifts_to_curve for more details.
     curve = la.shifts_to_curve(start_point, end_point, xk, number_of_inner_points,
-                            basis_rotation_matrix, tangent_direction, codimension)
+                            tangent_basis, tangent_direction, codimension)
 
     # Get the initial metric values along the starting curve.
-    metric = get_metric(curve, number_of_inner_points, metric_server_addresses, authkey)
+    metric = metric_servers.get_metric(curve, number_of_inner_points)
 
     # If the SimulationPotential couldn't be contacted then return None to close the SimulationClient
     if metric is None:
         return None
 
     # Obtain the initial gradient of the length functional along the curve
-    gfk = GradLength(curve, metric, number_of_inner_points, mass_matrix, basis_rotation_matrix)
+    gfk = GradLength(curve, metric, number_of_inner_points, mass_metric, tangent_basis)
+
+    # Initialise the memory to store the most recent updates to the approximate Hessian matrix.
+    history = deque(maxlen=lbfgs_memory)
 
-    # Create an identity matrix object
-    I = np.eye(number_of_variables, dtype=int)
+    # The multiple of the identity the approximate inverse Hessian starts from, which is only rescaled when starting
+    # from the previous local geodesic.
+    initial_scale = 1.0
+    rescale = warm
 
-    # Initialise the memory to store the approximate Hessian matrix
-    Hk = I
+    if optimiser != 'lbfgs':
+        # Initialise the memory to store the approximate Hessian matrix
+        Hk = np.eye(number_of_variables, dtype=int)
+
+    # The factors applied to the step length last taken to give the step lengths tried by the batched line search, which
+    # start from the unit step.
+    factors = 2.0 ** (np.arange(line_search_steps) - line_search_steps / 2)
+    steps = factors
 
     # Compute the norm of the gradient in the L^{\infty} norm
     gnorm = np.amax(np.abs(gfk))
@@ -81,47 +263,84 @@ def find_geodesic_midpoint(start_point, end_point, number_of_inner_points, basis
     while gnorm > gtol:
 
         alpha1 = 1.0
-        pk = -np.dot(Hk, gfk)
+        if optimiser == 'lbfgs':
+            pk = lbfgs_direction(gfk, history, initial_scale)
+        else:
+            pk = -np.dot(Hk, gfk)
 
-        phi0 = Length(curve, metric, number_of_inner_points, mass_matrix)
+        phi0 = Length(curve, metric, number_of_inner_points, mass_metric)
         phi1 = phi0
         derphi0 = np.dot(gfk, pk)
         derphi1 = derphi0
 
-        isave = np.zeros((2,), np.intc)
-        dsave = np.zeros((13,), float)
-        task = b'START'
-
-        # Perform the linesearch
-        for i in xrange(30):
-            stp, phi1, derphi1, task = minpack2.dcsrch(alpha1, phi1, derphi1, 1e-4, 0.9, 1e-14, task, 1e-8, 50,
-                                                       isave, dsave)
-            if task[:2] == b'FG':
-                alpha1 = stp
-                # Convert the description of the curve as shifts in the orthonormal hyperspace along the initial line
-                # to points in the full space. See LinearAlgebra.shifts_to_curve for more details.
-                curve = la.shifts_to_curve(start_point, end_point, xk + stp*pk, number_of_inner_points,
-                                        basis_rotation_matrix, tangent_direction, codimension)
-
-                # Get the initial metric values along the current trial.
-                metric = get_metric(curve, number_of_inner_points, metric_server_addresses, authkey)
+        # Try several step lengths at once, keeping the one giving the shortest curve that satisfies the sufficient
+        # decrease condition with the same constant as dcsrch. If none does, try the next smaller step lengths, down to
+        # the smallest step length dcsrch would try.
+        accepted = False
+        if line_search == 'batched' and derphi0 < 0:
+            trial_steps = steps
+            while not accepted and trial_steps[-1] >= 1e-8:
+                trial_curves = [la.shifts_to_curve(start_point, end_point, xk + step*pk, number_of_inner_points,
+                                                   tangent_basis, tangent_direction, codimension)
+                                for step in trial_steps]
+                trial_metrics = metric_servers.get_metrics(trial_curves, number_of_inner_points)
 
                 # If the SimulationPotential couldn't be reached then return None to close SimulationClient
-                if metric is None:
+                if trial_metrics is None:
                     return None
 
-                phi1 = Length(curve, metric, number_of_inner_points, mass_matrix)
-                gfkp1 = GradLength(curve, metric, number_of_inner_points, mass_matrix, basis_rotation_matrix)
-                derphi1 = np.dot(gfkp1, pk)
+                for step, trial_curve, trial_metric in zip(trial_steps, trial_curves, trial_metrics):
+                    trial_phi = Length(trial_curve, trial_metric, number_of_inner_points, mass_metric)
+                    if trial_phi <= phi0 + 1e-4 * step * derphi0 and (not accepted or trial_phi < phi1):
+                        accepted = True
+                        stp, curve, metric, phi1 = step, trial_curve, trial_metric, trial_phi
+
+                trial_steps = trial_steps * 2.0 ** -line_search_steps
+
+            # Only the gradient along the curve taken is needed.
+            if accepted:
+                gfkp1 = GradLength(curve, metric, number_of_inner_points, mass_metric, tangent_basis)
+
+            if statistics is not None:
+                statistics['batched_searches'] = statistics.get('batched_searches', 0) + 1
+                statistics['batched_steps_taken'] = statistics.get('batched_steps_taken', 0) + accepted
+
+        # Otherwise perform the linesearch one step length at a time.
+        if not accepted:
+            isave = np.zeros((2,), np.intc)
+            dsave = np.zeros((13,), float)
+            task = b'START'
+
+            for i in xrange(30):
+                stp, phi1, derphi1, task = minpack2.dcsrch(alpha1, phi1, derphi1, 1e-4, 0.9, 1e-14, task, 1e-8, 50,
+                                                           isave, dsave)
+                if task[:2] == b'FG':
+                    alpha1 = stp
+                    # Convert the description of the curve as shifts in the orthonormal hyperspace along the initial
+                    # line to points in the full space. See LinearAlgebra.shifts_to_curve for more details.
+                    curve = la.shifts_to_curve(start_point, end_point, xk + stp*pk, number_of_inner_points,
+                                               tangent_basis, tangent_direction, codimension)
+
+                    # Get the initial metric values along the current trial.
+                    metric = metric_servers.get_metric(curve, number_of_inner_points)
+
+                    # If the SimulationPotential couldn't be reached then return None to close SimulationClient
+                    if metric is None:
+                        return None
+
+                    phi1 = Length(curve, metric, number_of_inner_points, mass_metric)
+                    gfkp1 = GradLength(curve, metric, number_of_inner_points, mass_metric, tangent_basis)
+                    derphi1 = np.dot(gfkp1, pk)
+                else:
+                    break
             else:
                 break
-        else:
-            break
 
-        if task[:5] == b'ERROR' or task[:4] == b'WARN':
-            break
+            if task[:5] == b'ERROR' or task[:4] == b'WARN':
+                break
 
         alpha_k = stp
+        steps = stp * factors
         xkp1 = xk + alpha_k * pk
         sk = xkp1 - xk
         xk = xkp1
@@ -131,12 +350,34 @@ def find_geodesic_midpoint(start_point, end_point, number_of_inner_points, basis
         if gnorm <= gtol:
             break
 
+        # A step taken by the batched line search may not satisfy the curvature condition, in which case the update
+        # is skipped so that the approximate inverse Hessian stays positive definite.
+        if accepted and np.dot(yk, sk) <= 0:
+            continue
+
         rhok = 1.0 / (np.dot(yk, sk))
         if np.isinf(rhok): rhok = 1000.0  # this is patch for numpy
 
-        Hk = np.dot(I - sk[:, np.newaxis] * yk[np.newaxis, :] *
-                    rhok, np.dot(Hk, I - yk[:, np.newaxis] * sk[np.newaxis, :] * rhok)) + (rhok * sk[:, np.newaxis]
-                                                                                           * sk[np.newaxis, :])
+        # Rescale the initial approximation before the first update when starting close to a minimum.
+        if rescale:
+            rescale = False
+            if np.dot(yk, sk) > 0:
+                initial_scale = np.dot(yk, sk) / np.dot(yk, yk)
+                if optimiser != 'lbfgs':
+                    Hk = initial_scale * Hk
+
+        history.append((sk, yk, rhok))
+        if optimiser != 'lbfgs':
+            Hk = bfgs_update(Hk, sk, yk, rhok)
+
+    # Store the state of this computation for the next one, as vectors in the full space. The shifts are taken from
+    # the curve itself so that they match the midpoint returned.
+    if warm_start is not None:
+        straight_line = la.shifts_to_curve(start_point, end_point, np.zeros(number_of_variables),
+                                           number_of_inner_points, tangent_basis, tangent_direction, codimension)
+        warm_start['shifts'] = np.subtract(curve[1:-1], straight_line[1:-1])
+        warm_start['left_end_point'] = np.array(start_point, dtype='float64')
+        warm_start['right_end_point'] = np.array(end_point, dtype='float64')
 
     # Return the midpoint
     return curve[(number_of_inner_points + 1) / 2]
\ No newline at end of file
@@ -1,6 +1,8 @@
 import numpy as np
 import math
 
+from LinearAlgebra import as_mass_metric
+
 def norm(x, matrix):
     """ Computes the value of sqrt(<x, matrix*x>).
 
@@ -8,7 +10,8 @@ def norm(x, matrix):
       x (numpy.array) :
           A vector, stored as a NumPy array, to compute the norm for.
       matrix (numpy.array) :
-          A matrix, stored as a NumPy array, used in the computation of <x, matrix*x>.
+          A matrix, stored as a NumPy array, or a DiagonalMassMetric or DenseMassMetric, used in the computation of
+          <x, matrix*x>.
 
 
     Returns:
@@ -17,7 +20,7 @@ def norm(x, matrix):
 
     """
 
-    return math.sqrt(np.inner(x, matrix.dot(x)))
+    return as_mass_metric(matrix).norm(x)
 
 
 def norm_gradient(x, matrix):
@@ -27,7 +30,8 @@ def norm_gradient(x, matrix):
       x (numpy.array) :
           A vector, stored as a NumPy array, to compute the norm for.
       matrix (numpy.array) :
-          A matrix, stored as a NumPy array, used in the computation of <x, matrix*x>.
+          A matrix, stored as a NumPy array, or a DiagonalMassMetric or DenseMassMetric, used in the computation of
+          <x, matrix*x>.
 
 
     Returns:
@@ -36,96 +40,67 @@ def norm_gradient(x, matrix):
 
     """
 
-    a = (matrix + matrix.transpose())
-
-    return a.dot(x) / (2 * norm(x, matrix))
+    return as_mass_metric(matrix).norm_gradient(x)
 
 
-def Length(curve, metric, number_of_inner_nodes, mass_matrix):
+def Length(curve, metric, number_of_inner_nodes, mass_metric):
     """ This function computes the length of a curve object in the isotropic Riemannian length functional with metric
     coefficient metric.
 
     Args:
-      curve (Curve): The curve for which the length is to be computed.
+      curve (numpy.array): An (n_points, dim) array, or a list of NumPy arrays, containing the points of the curve.
       metric: A list of float values representing the values of the metric along the curve. We have that metric[i] = a(curve[i]) where a is the metric coefficient.
       number_of_inner_nodes (int): The number of nodes in the curve object, less the end points.
-      mass_vector (numpy.array): A NumPy array containing the masses of the molecular system as computed in the SimulationClient object.
+      mass_metric (DiagonalMassMetric): The mass matrix of the molecular system as computed in the SimulationClient
+        object, or a DenseMassMetric or dense NumPy array holding the mass matrix.
 
     Returns:
       float: The length of the curve with metric values in metric.
 
     """
 
-    # Convert the shifts x into points in the full dimensional space
-    points = curve
-
-    # Pre-compute the metric values to minimise repeated metric evaluations
-    a = metric
-
-    # Compute quantities used to determine the length and gradient
-    n = np.subtract(points[1], points[0])
-    b = norm(n, mass_matrix)
-    u = (a[1][0]+a[0][0])
-
-    # Initialise the length with the trapezoidal approximation of the first line segments length
-    l = u * b
-
-    for i in xrange(1, len(points)-1):
-
-        # Compute the quantities needed for the next trapezoidal rule approximation.
-        n = np.subtract(points[i+1], points[i])
-        v = (a[i+1][0]+a[i][0])
-
-        # Add length of line segment to total length
-        l += v * norm(n, mass_matrix)
+    # Compute the mass norm of every line segment of the curve at once.
+    segment_norms = as_mass_metric(mass_metric).norms(np.diff(curve, axis=0))
 
-    return 0.5 * l
+    # Sum the trapezoidal approximations of the length of each line segment.
+    a = np.array([value[0] for value in metric])
+    return 0.5 * np.dot(a[1:] + a[:-1], segment_norms)
 
 
-def GradLength(curve, metric, number_of_inner_nodes, mass_matrix, basis_rotation_matrix):
+def GradLength(curve, metric, number_of_inner_nodes, mass_metric, tangent_basis):
     """ This function computes the gradient of the length of a curve object in the isotropic Riemannian length
     functional with metric coefficient metric.
 
     Args:
-      curve (Curve): The curve for which the length is to be computed.
+      curve (numpy.array): An (n_points, dim) array, or a list of NumPy arrays, containing the points of the curve.
       metric: A list of float values representing the values of the metric along the curve. We have that metric[i] = a(curve[i]) where a is the metric coefficient.
       number_of_inner_nodes (int): The number of nodes in the curve object, less the end points.
-      mass_vector (numpy.array): A NumPy array containing the masses of the molecular system as computed in the SimulationClient object.
+      mass_metric (DiagonalMassMetric): The mass matrix of the molecular system as computed in the SimulationClient
+        object, or a DenseMassMetric or dense NumPy array holding the mass matrix.
+      tangent_basis (HouseholderTangentBasis): The orthonormal basis whose first vector is parallel to the tangent direction.
 
     Returns:
       numpy.array: The gradient of the length functional on the curve with metric values in metric.
 
     """
 
-    # Convert the shifts x into points in the full dimensional space
-    points = curve
-
-    # Pre-compute the metric values to minimise repeated metric evaluations
-    a = metric
-
-    # Compute quantities used to determine the length and gradient
-    n = np.subtract(points[1], points[0])
-    b = norm(n, mass_matrix)
-    c = norm_gradient(n, mass_matrix)
-    u = (a[1][0]+a[0][0])
-
-    # Initialise a list to store the gradient
-    g = []
-
-    for i in xrange(1, len(points)-1):
-
-        # Compute the quantities needed for the next trapezoidal rule approximation.
-        n = np.subtract(points[i+1], points[i])
-        d = norm(n, mass_matrix)
-        e = norm_gradient(n, mass_matrix)
-        v = (a[i+1][0]+a[i][0])
-
-        # Compute next gradient component and update gradient
-        g.append(basis_rotation_matrix.transpose().dot(a[i][1] * (b + d) + u * c - v * e)[1:])
-
-        # Pass back calculated values for efficiency
-        b = d
-        c = e
-        u = v
-
-    return 0.5 * np.asarray(g).flatten()
\ No newline at end of file
+    # Compute the mass norm of every line segment of the curve, and its gradient, at once.
+    mass_metric = as_mass_metric(mass_metric)
+    segments = np.diff(curve, axis=0)
+    segment_norms = mass_metric.norms(segments)
+    segment_gradients = mass_metric.norm_gradients(segments, segment_norms)
+
+    # Compute the sum of the metric values at the ends of each line segment, and gather the metric gradients at the
+    # inner nodes.
+    a = np.array([value[0] for value in metric])
+    u = a[1:] + a[:-1]
+    metric_gradients = np.array([value[1] for value in metric[1:-1]])
+
+    # Each inner node i contributes the derivative of the trapezoidal approximations of the line segments either side
+    # of it.
+    g = (metric_gradients * (segment_norms[:-1] + segment_norms[1:])[:, np.newaxis] +
+         u[:-1, np.newaxis] * segment_gradients[:-1] - u[1:, np.newaxis] * segment_gradients[1:])
+
+    # Rotate every gradient component back into the basis along the tangent direction at once, and discard the
+    # component along the tangent.
+    return 0.5 * tangent_basis.rotate_back(g)[:, 1:].flatten()
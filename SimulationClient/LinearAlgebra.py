@@ -1,70 +1,264 @@
 import math
 
 import numpy as np
-from scipy.linalg import orth
 
-def mass_norm(vector, mass_matrix):
-    """ This function computes the inner product of vector with mass_matrix times vector.
 
-    Args:
-      vector (numpy.array): The curve for which the length is to be computed.
-      mass_matrix (numpy.array): A diagonal NumPy array containing the masses of the molecular system as computed in the SimulationClient object.
+class DiagonalMassMetric:
+    """
 
-    Returns:
-      float: The value of <vector, mass_matrix * vector>
+    The purpose of this object is to represent the mass matrix of a molecular system, which is diagonal, by the vector
+    of its diagonal entries. Norms and their gradients with respect to the mass matrix then cost time proportional to
+    the dimension of the problem, rather than its square, and no dimension by dimension matrix is ever stored.
+
+    Attributes:
+      MASSES (numpy.array) :
+          The diagonal of the mass matrix, that is the mass of the atom each co-ordinate belongs to.
 
     """
-    return math.sqrt(np.inner(vector, mass_matrix.dot(vector)))
+    def __init__(self, masses, dimension):
+        """The constructor for the DiagonalMassMetric class.
+
+        Args:
+          masses (numpy.array) :
+              The masses of the atoms of the molecular system, as given by the Atomistic Simulation Environment.
+          dimension (int) :
+              The dimension of the problem. Computed from the atomistic simulation environment.
+
+        """
+        self.MASSES = np.repeat(np.asarray(masses, dtype='float64'), dimension / len(masses))
+
+    def norm(self, vector):
+        """ Compute sqrt(<vector, mass_matrix * vector>).
+
+        Args:
+          vector (numpy.array): The vector to compute the norm of.
+
+        Returns:
+          float: The mass norm of vector.
+
+        """
+        return math.sqrt(np.dot(vector ** 2, self.MASSES))
+
+    def norm_gradient(self, vector):
+        """ Compute the gradient of sqrt(<vector, mass_matrix * vector>).
+
+        Args:
+          vector (numpy.array): The vector at which to compute the gradient.
+
+        Returns:
+          numpy.array: The gradient of the mass norm at vector.
+
+        """
+        return self.MASSES * vector / self.norm(vector)
+
+    def norms(self, vectors):
+        """ Compute the mass norm of each row of an array at once.
+
+        Args:
+          vectors (numpy.array): An (n, dim) array of vectors.
+
+        Returns:
+          numpy.array: The n mass norms.
+
+        """
+        return np.sqrt(np.dot(vectors ** 2, self.MASSES))
+
+    def norm_gradients(self, vectors, norms=None):
+        """ Compute the gradient of the mass norm at each row of an array at once.
+
+        Args:
+          vectors (numpy.array): An (n, dim) array of vectors.
+          norms (numpy.array, optional): The mass norms of the vectors, if they have already been computed.
+
+        Returns:
+          numpy.array: An (n, dim) array of gradients.
+
+        """
+        if norms is None:
+            norms = self.norms(vectors)
+        return vectors * self.MASSES / norms[:, np.newaxis]
+
+
+class DenseMassMetric:
+    """
+
+    The purpose of this object is to give a mass matrix stored as a dense NumPy array the interface of a
+    DiagonalMassMetric, so that the functions computing norms and lengths accept either. The matrix need not be
+    diagonal or symmetric, but each norm costs time proportional to the square of the dimension of the problem.
+
+    Attributes:
+      MATRIX (numpy.array) :
+          The mass matrix, as a dimension by dimension array.
+
+    """
+    def __init__(self, matrix):
+        """The constructor for the DenseMassMetric class.
+
+        Args:
+          matrix (numpy.array) :
+              The mass matrix, as a dimension by dimension array.
+
+        """
+        self.MATRIX = np.asarray(matrix, dtype='float64')
+
+    def norm(self, vector):
+        """ Compute sqrt(<vector, mass_matrix * vector>).
+
+        Args:
+          vector (numpy.array): The vector to compute the norm of.
+
+        Returns:
+          float: The mass norm of vector.
+
+        """
+        return math.sqrt(np.inner(vector, self.MATRIX.dot(vector)))
+
+    def norm_gradient(self, vector):
+        """ Compute the gradient of sqrt(<vector, mass_matrix * vector>).
+
+        Args:
+          vector (numpy.array): The vector at which to compute the gradient.
+
+        Returns:
+          numpy.array: The gradient of the mass norm at vector.
+
+        """
+        return (self.MATRIX + self.MATRIX.transpose()).dot(vector) / (2 * self.norm(vector))
+
+    def norms(self, vectors):
+        """ Compute the mass norm of each row of an array at once.
+
+        Args:
+          vectors (numpy.array): An (n, dim) array of vectors.
+
+        Returns:
+          numpy.array: The n mass norms.
 
+        """
+        return np.sqrt(np.einsum('ij,ij->i', vectors, vectors.dot(self.MATRIX.transpose())))
 
-def orthonormal_tangent_basis(tangent, dimension):
-    """ This function computes the inner product of vector with mass_matrix times vector.
+    def norm_gradients(self, vectors, norms=None):
+        """ Compute the gradient of the mass norm at each row of an array at once.
+
+        Args:
+          vectors (numpy.array): An (n, dim) array of vectors.
+          norms (numpy.array, optional): The mass norms of the vectors, if they have already been computed.
+
+        Returns:
+          numpy.array: An (n, dim) array of gradients.
+
+        """
+        if norms is None:
+            norms = self.norms(vectors)
+        return vectors.dot(self.MATRIX + self.MATRIX.transpose()) / (2 * norms[:, np.newaxis])
+
+
+def as_mass_metric(mass_metric):
+    """ Return mass_metric unchanged if it is a DiagonalMassMetric or DenseMassMetric, and otherwise wrap it, as a dense
+    mass matrix, in a DenseMassMetric.
 
     Args:
-      tangent (numpy.array): The tangent direction along the local geodesic.
-      dimension (int): The dimension of the problem. Computed from the atomistic simulation environment.
+      mass_metric (DiagonalMassMetric, DenseMassMetric or numpy.array): The mass matrix of the molecular system.
 
     Returns:
-      numpy.array: An orthonomal matrix with the first column parallel to tangent.
+      DiagonalMassMetric or DenseMassMetric: An object providing norm, norm_gradient, norms and norm_gradients.
 
     """
+    if isinstance(mass_metric, (DiagonalMassMetric, DenseMassMetric)):
+        return mass_metric
+
+    return DenseMassMetric(mass_metric)
+
+
+class HouseholderTangentBasis:
+    """
+
+    The purpose of this object is to represent an orthonormal basis whose first vector is parallel to a tangent
+    direction, without ever forming the basis as a matrix. The basis is a single Householder reflection, possibly
+    combined with a change of sign of the first co-ordinate, so it is described by one vector. Constructing it, and
+    applying it or its transpose to a vector, costs time proportional to the dimension of the problem.
+
+    Attributes:
+      VECTOR (numpy.array) :
+          The vector v describing the Householder reflection I - 2 v v^T / <v, v>.
+      SIGN (float) :
+          Either 1.0 or -1.0, the sign the first co-ordinate is multiplied by before reflecting.
+      SCALE (float) :
+          The value of 2 / <v, v>.
+
+    """
+    def __init__(self, tangent):
+        """The constructor for the HouseholderTangentBasis class.
+
+        Args:
+          tangent (numpy.array) :
+              The tangent direction along the local geodesic, which need not be normalised but must be non-zero.
+
+        """
+        unit_tangent = np.asarray(tangent, dtype='float64') / np.linalg.norm(tangent)
+
+        # Reflect the first basis vector onto whichever of the unit tangent and its negative is further from it, which
+        # keeps the reflection numerically stable, and correct the sign of the first co-ordinate afterwards.
+        if unit_tangent[0] >= 0:
+            self.SIGN = -1.0
+        else:
+            self.SIGN = 1.0
+        self.VECTOR = -self.SIGN * unit_tangent
+        self.VECTOR[0] += 1.0
+        self.SCALE = 2.0 / np.dot(self.VECTOR, self.VECTOR)
+
+    def reflect(self, vectors):
+        """ Apply the Householder reflection, which is its own inverse, to a vector or to every row of an array.
+
+        """
+        return vectors - np.multiply.outer(self.SCALE * np.dot(vectors, self.VECTOR), self.VECTOR)
+
+    def rotate(self, vectors):
+        """ Convert vectors from co-ordinates in the basis to co-ordinates in the standard basis.
+
+        Args:
+          vectors (numpy.array): A vector, or an (n, dim) array with one vector in each row.
+
+        Returns:
+          numpy.array: The converted vectors, in the same shape. The first basis vector is mapped to the unit tangent.
 
-    # Set the first column of our output matrix as tangent
-    mx = tangent
+        """
+        vectors = np.array(vectors, dtype='float64')
+        vectors[..., 0] *= self.SIGN
+        return self.reflect(vectors)
 
-    # Find the first non-zero entry of the tangent vector (exists as start and endpoints are different)
-    j = np.nonzero(mx)[0][0]
+    def rotate_back(self, vectors):
+        """ Convert vectors from co-ordinates in the standard basis to co-ordinates in the basis. This is the inverse,
+        and transpose, of rotate.
 
-    # For the remaining dim - 1 columns choose unit basis vectors of the form (0,...,0,1,0,...,0) with the nonzero entry
-    # not in position j.
-    for i in xrange(1, dimension):
-        if j != i:
-            e = np.zeros(dimension)
-            e[i] = 1
-            mx = np.vstack((mx, e))
+        Args:
+          vectors (numpy.array): A vector, or an (n, dim) array with one vector in each row.
 
-    mx = mx.transpose()
+        Returns:
+          numpy.array: The converted vectors, in the same shape.
 
-    # With the resulting matrix, perform the Gram-Schmidt orthonormalisation procedure on the transpose of the matrix
-    # and return it.
-    m, n = np.shape(mx)
-    Q = np.zeros([m, n])
-    R = np.zeros([n, n])
-    v = np.zeros(m)
+        """
+        vectors = self.reflect(vectors)
+        vectors[..., 0] *= self.SIGN
+        return vectors
 
-    for j in range(n):
 
-        v[:] = mx[:,j]
-        for i in range(j):
-            r = np.dot(Q[:,i], mx[:,j]); R[i,j] = r
-            v[:] = v[:] - r*Q[:,i]
-        r = np.linalg.norm(v); R[j,j]= r
-        Q[:,j] = v[:]/r
+def mass_norm(vector, mass_metric):
+    """ This function computes the square root of the inner product of vector with the mass matrix times vector.
 
-    return Q
+    Args:
+      vector (numpy.array): The curve for which the length is to be computed.
+      mass_metric (DiagonalMassMetric, DenseMassMetric or numpy.array): The mass matrix of the molecular system as
+        computed in the SimulationClient object, or a dense NumPy array holding the mass matrix.
+
+    Returns:
+      float: The value of sqrt(<vector, mass_metric * vector>)
+
+    """
+    return as_mass_metric(mass_metric).norm(vector)
 
 
-def shifts_to_curve(start_point, end_point, shift_points, number_of_inner_points, basis_rotation_matrix,
+def shifts_to_curve(start_point, end_point, shift_points, number_of_inner_points, tangent_basis,
                     tangent_direction, codimension):
 
     """ This function produces a curve in N-dimensional space when it is initially described as a graph over the first co-ordinate direction.
@@ -74,35 +268,62 @@ def shifts_to_curve(start_point, end_point, shift_points, number_of_inner_points
       end_point (numpy.array): The last end point of the curve.
       shift_points (numpy.array): Given a point x_N along the curve, the value shift_points[i] is x_N - <x_N, tangent_direction>tangent_direction. That is the orthogonal component of x_N when projected against the tangent_direction.
       number_of_inner_points (int): The number of nodes along the curve, less the end points.
-      basis_rotation_matrix (numpy.array): The matrix computed as a result of the orthogonal_tangent_basis function.
+      tangent_basis (HouseholderTangentBasis): The orthonormal basis whose first vector is parallel to the tangent direction.
       tangent_direction (numpy.array): The tangent direction as computed by the SimulationClient.
       codimension (int): The dimension of the problem minus 1. Computed from the atomistic simulation environment.
 
     Returns:
-      list: A list of NumPy arrays describing the position of the curve.
+      numpy.array: An (number_of_inner_points + 2, dimension) array whose rows are the points of the curve.
 
     """
 
     # Compute tangent direction of line joining start and end points
     tangent = np.subtract(end_point, start_point)/(number_of_inner_points+1)
 
-    # Initialise list to store points
-    points = []
+    # Generate points that are uniformly distributed along the initial line, one in each row of the curve array
+    curve = start_point + np.arange(number_of_inner_points+2, dtype='float64')[:, np.newaxis] * tangent
 
-    # Generate points that are uniformly distributed along the initial line
-    for i in xrange(number_of_inner_points+2):
-        points.append(np.add(start_point, float(i)*tangent))
+    # Embed the shifts of all of the inner points into co_dimension + 1 dimensional space at once, each as a row with a
+    # zero first co-ordinate
+    unrotated_shifts = np.zeros((number_of_inner_points, codimension+1))
+    unrotated_shifts[:, 1:] = np.reshape(shift_points, (number_of_inner_points, codimension))
 
-    # Shift the points as encoded in x
-    for i in xrange(0, len(shift_points)/codimension):
+    # Convert every shift, by rotation, from a shift from the e_1 basis direction to a shift from the tangent direction
+    # and shift the inner points
+    curve[1:-1] += tangent_basis.rotate(unrotated_shifts)
 
-        # Embed vector i into co_dimension + 1 dimensional space
-        unrotated_shift = np.hstack((np.zeros(1), shift_points[i*codimension:(i+1)*codimension]))
+    return curve
 
-        # Convert vector, by rotation, from shift from e_1 basis direction to shift from tangent direction
-        shift = basis_rotation_matrix.dot(unrotated_shift)
 
-        # Append point to list
-        points[i+1] = np.add(points[i+1], shift)
+def shifts_to_vectors(shift_points, number_of_inner_points, tangent_basis, codimension):
+    """ This function converts shifts, or changes in shifts, of the inner points of a curve into vectors in the full
+    space, so that they no longer depend on the tangent direction they were described against.
 
-    return points
+    Args:
+      shift_points (numpy.array): The shifts of the inner points, as used by shifts_to_curve.
+      number_of_inner_points (int): The number of nodes along the curve, less the end points.
+      tangent_basis (HouseholderTangentBasis): The orthonormal basis whose first vector is parallel to the tangent.
+      codimension (int): The dimension of the problem minus 1. Computed from the atomistic simulation environment.
+
+    Returns:
+      numpy.array: An (number_of_inner_points, dimension) array whose rows are the shifts in the full space.
+
+    """
+    unrotated_shifts = np.zeros((number_of_inner_points, codimension+1))
+    unrotated_shifts[:, 1:] = np.reshape(shift_points, (number_of_inner_points, codimension))
+    return tangent_basis.rotate(unrotated_shifts)
+
+
+def vectors_to_shifts(vectors, tangent_basis):
+    """ This function is the inverse of shifts_to_vectors. Any component of the vectors along the tangent direction is
+    dropped, so vectors produced against a different tangent direction are projected onto the shifts from this one.
+
+    Args:
+      vectors (numpy.array): An (number_of_inner_points, dimension) array whose rows are shifts in the full space.
+      tangent_basis (HouseholderTangentBasis): The orthonormal basis whose first vector is parallel to the tangent.
+
+    Returns:
+      numpy.array: The shifts of the inner points, as used by shifts_to_curve.
+
+    """
+    return np.ravel(tangent_basis.rotate_back(vectors)[:, 1:])
@@ -1,115 +1,457 @@
+from collections import deque
 import math
+import time
 import socket
+import select
 import logging
 from multiprocessing.connection import Client
 
-from SimulationUtilities.Communication_Codes import comm_code
+import numpy as np
 
+from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities.Metric_Cache import MetricCache
+from SimulationUtilities.Shared_Memory import SharedMetricBuffer
+from SimulationUtilities import Wire_Format
 
-def get_metric(curve, number_of_inner_points, metric_server_addresses, authkey):
-    """ This function distributes the task of computing the metric values along the curve using the SimulationPotential instances.
 
-    Args:
-      curve (numpy.array): A list of NumPy arrays representing a local geodesic.
-      number_of_inner_points (int): The number of points along the curve, less two.
-      metric_server_addresses: A list of tuples of the form (str, int) containing the hostnames and port numbers of the SimulationPotential instances.
-      authkey (str): The password used in order to communicate with the SimulationPotential instances.
+class MetricServerPool:
+    """
 
-    Returns:
-      list: A list of float values called metric where metric[i] = a(curve[i]).
+    The purpose of this object is to hold a single persistent, authenticated connection to each of the
+    SimulationPotential instances assigned to a SimulationClient, and to use them to compute metric values along a
+    curve. Every request carries a request ID which the SimulationPotential echoes back with its values, so that the
+    requests to all of the SimulationPotential instances are in flight at once and the results are collected in
+    whatever order they finish. The points are handed out in chunks to whichever instance is idle, with the throughput
+    of each instance tracked so that a heterogeneous pool finishes in time proportional to its total capacity.
+
+    The values at recently visited points are remembered in a MetricCache, and only the points that miss it are sent.
+    Where a SimulationPotential instance runs on the same host the points and values are exchanged through a
+    SharedMetricBuffer rather than pickled, and only the indices of the points are sent over the connection.
+
+    Attributes:
+      METRIC_SERVERS :
+          A list containing tuples of addresses for SimulationPotential instances.
+      AUTHKEY (str) :
+          A string containing the authorisation key for the SimulationPotential instances.
+      CHUNK_SIZE (int) :
+          The smallest number of points sent to a SimulationPotential instance in a single request.
+      PIPELINE_DEPTH (int) :
+          The number of requests each SimulationPotential instance is kept ahead by.
+      THROUGHPUT_WEIGHT (float) :
+          The weight given to the most recent measurement in the running throughput estimates.
+      throughput (list) :
+          The running estimate, in points per second, of the throughput of each SimulationPotential instance. None
+          until the first measurement.
+      points_evaluated (list) :
+          The total number of points evaluated by each SimulationPotential instance.
+      curves_evaluated (int) :
+          The total number of curves along which the metric has been requested.
+      waiting_time (float) :
+          The total length of time in seconds spent blocked waiting for values from the SimulationPotential instances.
+      cache (MetricCache) :
+          The metric values and forces at recently visited points.
+      SHARED_MEMORY (bool) :
+          Whether shared memory buffers are offered to the SimulationPotential instances.
+      buffers (list) :
+          The SharedMetricBuffer used with each SimulationPotential instance, or None where memory isn't shared.
+      WIRE_FORMAT (bool) :
+          Whether the binary message format is offered to the SimulationPotential instances.
 
     """
+    def __init__(self, metric_server_addresses, authkey, chunk_size=1, pipeline_depth=2, throughput_weight=0.3,
+                 cache_size=1024, cache_quantum=1e-9, shared_memory=True,
+                 wire_format=True):
+        """The constructor for the MetricServerPool class.
+
+        Note:
+          Connections are made the first time they are needed, not when the object is constructed.
+
+        Args:
+          metric_server_addresses :
+              A list of tuples of the form (str, int) containing the hostnames and port numbers of the
+              SimulationPotential instances.
+          authkey (str) :
+              The password used in order to communicate with the SimulationPotential instances.
+          chunk_size (int, optional) :
+              The smallest number of points sent to a SimulationPotential instance in a single request.
+          pipeline_depth (int, optional) :
+              The number of requests each SimulationPotential instance is kept ahead by, to hide network latency.
+          throughput_weight (float, optional) :
+              The weight given to the most recent measurement in the running throughput estimates.
+          cache_size (int, optional) :
+              The largest number of points whose values are remembered. Zero disables the cache.
+          cache_quantum (float, optional) :
+              The precision to which points are compared when looking them up in the cache.
+          shared_memory (bool, optional) :
+              If True then a shared memory buffer is offered to each SimulationPotential instance, which accepts it if
+              it runs on the same host.
+          wire_format (bool, optional) :
+              If True then the binary message format is offered to each SimulationPotential instance when connecting.
+
+        """
+        self.METRIC_SERVERS = metric_server_addresses
+        self.AUTHKEY = authkey
+        self.CHUNK_SIZE = chunk_size
+        self.PIPELINE_DEPTH = pipeline_depth
+        self.THROUGHPUT_WEIGHT = throughput_weight
+
+        # Initialise the throughput measurements, which persist between metric evaluations.
+        self.throughput = [None] * len(metric_server_addresses)
+        self.points_evaluated = [0] * len(metric_server_addresses)
+        self.curves_evaluated = 0
+        self.waiting_time = 0.0
+
+        # Initialise the cache of values at recently visited points, which also persists between metric evaluations.
+        self.cache = MetricCache(cache_size, cache_quantum)
+
+        # Initialise the shared memory buffers, which are offered the first time they are needed. Once an instance has
+        # declined a buffer it isn't offered another.
+        self.SHARED_MEMORY = shared_memory
+        self.buffers = [None] * len(metric_server_addresses)
+        self.declined = [not shared_memory] * len(metric_server_addresses)
+
+        self.WIRE_FORMAT = wire_format
+
+        # Initialise the memory for the open connections and the counter used to label requests.
+        self.connections = [None] * len(metric_server_addresses)
+        self.request_id = 0
+
+    def connection(self, server):
+        """ Return the open connection to a SimulationPotential instance, connecting to it if necessary.
+
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
+
+        Returns:
+          WireConnection: The connection to the SimulationPotential instance.
+
+        """
+        if self.connections[server] is None:
+            self.connections[server] = Wire_Format.connect(self.METRIC_SERVERS[server], self.AUTHKEY,
+                                                           Wire_Format.SUPPORTED_VERSIONS if self.WIRE_FORMAT else ())
+        return self.connections[server]
+
+    def request(self, server, points):
+        """ Ask a SimulationPotential instance to compute the metric values at a collection of points.
+
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
+          points :
+              A list of [numpy.array, int] pairs containing the points, along with their indices along the curve.
+
+        Returns:
+          int: The request ID the SimulationPotential will return with its values.
+
+        """
+        self.request_id += 1
+        self.connection(server).send({'status_code': comm_code('CLIENT_PROVIDES_POINT'),
+                                      'request_id': self.request_id,
+                                      'points': points})
+        return self.request_id
+
+    def request_shared(self, server, indices):
+        """ Ask a SimulationPotential instance to compute the metric values at points already written to its shared
+        memory buffer.
+
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
+          indices (list) :
+              The indices, along the curve and in the buffer, of the points.
+
+        Returns:
+          int: The request ID the SimulationPotential will return once the values are in the buffer.
+
+        """
+        self.request_id += 1
+        self.connection(server).send({'status_code': comm_code('CLIENT_PROVIDES_POINT'),
+                                      'request_id': self.request_id,
+                                      'indices': indices})
+        return self.request_id
+
+    def shared_buffer(self, server, number_of_points, dimension):
+        """ Return the shared memory buffer used with a SimulationPotential instance, offering it a new one if there
+        isn't one large enough.
+
+        Note:
+          This waits for the reply to the offer, so must not be called while requests to the instance are outstanding.
+
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
+          number_of_points (int) :
+              The number of points along the curve.
+          dimension (int) :
+              The dimension of the configuration space.
+
+        Returns:
+          SharedMetricBuffer: The buffer, or None if the instance doesn't share memory with this process.
+
+        """
+        if self.declined[server]:
+            return None
+        buffer = self.buffers[server]
+        if buffer is not None and buffer.NUMBER_OF_POINTS >= number_of_points and buffer.DIMENSION == dimension:
+            return buffer
+
+        # Create a new buffer and offer it to the SimulationPotential, which can only map it if it is on this host.
+        new_buffer = SharedMetricBuffer.create(number_of_points, dimension)
+        if new_buffer is None:
+            accepted = False
+        else:
+            offer = new_buffer.description()
+            offer['status_code'] = comm_code('CLIENT_OFFERS_SHARED_MEMORY')
+            try:
+                self.connection(server).send(offer)
+                accepted = self.connection(server).recv().get('accepted', False)
+            except (socket.error, EOFError, IOError):
+                # Remove the file of a buffer that was never handed over.
+                new_buffer.close()
+                raise
+
+        # The SimulationPotential releases any previous buffer when it receives an offer.
+        if buffer is not None:
+            buffer.close()
+        if accepted:
+            self.buffers[server] = new_buffer
+        else:
+            logging.info('SimulationPotential at %s does not share memory, sending points over the connection.',
+                         str(self.METRIC_SERVERS[server]))
+            if new_buffer is not None:
+                new_buffer.close()
+            self.buffers[server] = None
+            self.declined[server] = True
+        return self.buffers[server]
+
+    def get_metric(self, curve, number_of_inner_points):
+        """ This function distributes the task of computing the metric values along the curve using the
+        SimulationPotential instances.
+
+        Note:
+          Rather than splitting the curve evenly between the SimulationPotential instances up front, the points are
+          handed out in chunks to whichever instance has just finished one. Each instance is kept PIPELINE_DEPTH chunks
+          ahead so that it never waits on the network, and once the throughput of every instance has been measured the
+          chunk sizes shrink as the work runs out and are weighted by throughput. A slow SimulationPotential therefore
+          receives less work rather than holding up the whole evaluation.
+
+        Args:
+          curve (numpy.array): An (n_points, dim) array, or a list of NumPy arrays, representing a local geodesic.
+          number_of_inner_points (int): The number of points along the curve, less two.
+
+        Returns:
+          list: A list of float values called metric where metric[i] = a(curve[i]). If one of the SimulationPotential
+          instances couldn't be contacted then None is returned.
+
+        """
+
+        # Initialise the memory for the metric values
+        metric = [[]] * (number_of_inner_points + 2)
+        self.curves_evaluated += 1
+
+        # Compute how many SimulationPotential instances are available to the SimulationClient
+        number_of_metric_servers = len(self.METRIC_SERVERS)
+
+        # Take the values at any points visited recently from the cache, and create a queue of the other points along
+        # the curve that are yet to be handed out.
+        remaining = deque()
+        for i in xrange(number_of_inner_points + 2):
+            cached = self.cache.get(curve[i]) if self.cache.CAPACITY > 0 else None
+            if cached is None:
+                remaining.append(i)
+            else:
+                metric[i] = cached
+
+        # Record, for each SimulationPotential instance, the request ID, number of points and time sent of each chunk
+        # it is working on, along with the time it last finished a chunk.
+        outstanding = [deque() for server in xrange(number_of_metric_servers)]
+        last_finished = [None] * number_of_metric_servers
+
+        def issue(server):
+            indices = [remaining.popleft() for i in xrange(min(self.chunk_size(server, len(remaining)),
+                                                                 len(remaining)))]
+            if buffers[server] is not None:
+                for i in indices:
+                    buffers[server].points[i] = curve[i]
+                request_id = self.request_shared(server, indices)
+            else:
+                request_id = self.request(server, [[curve[i], i] for i in indices])
+            outstanding[server].append((request_id, len(indices), time.time()))
+
+        # Make sure each SimulationPotential instance on this host has a shared memory buffer with room for the curve.
+        buffers = [None] * number_of_metric_servers
+        if remaining:
+            for server in xrange(number_of_metric_servers):
+                try:
+                    buffers[server] = self.shared_buffer(server, number_of_inner_points + 2, len(curve[0]))
+                except (socket.error, EOFError, IOError):
+                    return self.connection_failed(server)
+
+        # Fill the pipeline of every SimulationPotential instance, or hand out every point if there are fewer.
+        for depth in xrange(self.PIPELINE_DEPTH):
+            for server in xrange(number_of_metric_servers):
+                if remaining:
+                    try:
+                        issue(server)
+                    except (socket.error, EOFError, IOError):
+                        return self.connection_failed(server)
+
+        # Collect the values from each SimulationPotential instance as soon as a chunk has finished, and hand that
+        # instance the next chunk.
+        while any(outstanding):
+            busy = [server for server in xrange(number_of_metric_servers) if outstanding[server]]
+            waiting = time.time()
+            ready = select.select([self.connections[server] for server in busy], [], [])[0]
+            self.waiting_time += time.time() - waiting
+            for server in busy:
+                if self.connections[server] not in ready:
+                    continue
+                try:
+                    metric_server_response = self.connections[server].recv()
+                except (socket.error, EOFError, IOError):
+                    return self.connection_failed(server)
+
+                # Ignore values belonging to an earlier request.
+                request_id, number_of_points, time_sent = outstanding[server][0]
+                if metric_server_response.get('request_id') != request_id:
+                    continue
+                outstanding[server].popleft()
+
+                # A request the SimulationPotential couldn't answer leaves the curve incomplete.
+                if 'error' in metric_server_response:
+                    logging.warning('SimulationPotential at %s refused a request: %s', str(self.METRIC_SERVERS[server]),
+                                    metric_server_response['error'])
+                    return self.connection_failed(server)
+
+                # A chunk only starts being computed once the previous chunk sent to the same instance has finished.
+                time_finished = time.time()
+                self.record_throughput(server, number_of_points,
+                                       time_finished - max(time_sent, last_finished[server] or time_sent))
+                last_finished[server] = time_finished
+
+                # Values left in the shared memory buffer are copied out, since the buffer is reused.
+                if 'indices' in metric_server_response:
+                    values = [[[float(buffers[server].metric[i]), buffers[server].forces[i].copy()], i]
+                              for i in metric_server_response['indices']]
+                else:
+                    values = metric_server_response['values']
+
+                # Process the received values into the metric list, remembering them in the cache.
+                for value in values:
+                    metric[value[1]] = value[0]
+                    self.cache.put(curve[value[1]], value[0])
+
+                if remaining:
+                    try:
+                        issue(server)
+                    except (socket.error, EOFError, IOError):
+                        return self.connection_failed(server)
+
+        logging.debug('SimulationPotential throughput (points per second): %s', str(self.throughput))
+        logging.debug('Metric cache: %s', self.cache.statistics())
+
+        # If None hasn't been returned then return the metric values
+        return metric
+
+    def get_metrics(self, curves, number_of_inner_points):
+        """ Compute the metric values along several curves with a single request, so that their points are spread over
+        all of the SimulationPotential instances at once.
+
+        Args:
+          curves (list): A list of (n_points, dim) arrays, each representing a local geodesic.
+          number_of_inner_points (int): The number of points along each curve, less two.
+
+        Returns:
+          list: A list holding the metric values along each curve, in the form returned by get_metric. If one of the
+          SimulationPotential instances couldn't be contacted then None is returned.
+
+        """
+        number_of_points = number_of_inner_points + 2
+        metric = self.get_metric(np.concatenate(curves), len(curves) * number_of_points - 2)
+        self.curves_evaluated += len(curves) - 1
+
+        if metric is None:
+            return None
+        return [metric[i * number_of_points:(i + 1) * number_of_points] for i in xrange(len(curves))]
 
-    # Initialise the memory for the metric values
-    metric = [[]] * (number_of_inner_points + 2)
+    def chunk_size(self, server, number_of_remaining_points):
+        """ Decide how many points to hand to a SimulationPotential instance that is ready for more work.
 
-    # Compute how many SimulationPotential instances are available to the SimulationClient
-    number_of_metric_servers = len(metric_server_addresses)
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
+          number_of_remaining_points (int) :
+              The number of points along the curve yet to be handed out.
 
-    # Estimate how many tasks per SimulationPotential is a uniform distribution
-    tasks_per_server = int(math.floor((number_of_inner_points + 2) / number_of_metric_servers))
+        Returns:
+          int: The number of points to send.
 
-    # Compute how many tasks are left over if I give each SimulationPotential tasks_per_server points to evaluate.
-    remainder_tasks = number_of_inner_points + 2 - tasks_per_server * number_of_metric_servers
+        """
 
-    # Create a flag to indicate which point along the curve is currently being issued
-    current_point = 0
+        # Until the throughput of every instance is known hand out the smallest chunks.
+        if None in self.throughput:
+            return self.CHUNK_SIZE
 
-    # Indicate whether the current PotentialServer instance needs an extra task to ensure all the nodes are computed
-    extra_jobs = 1
+        # Otherwise give the instance half of its fair share of the remaining points, so that chunks get smaller as the
+        # work runs out and every instance finishes at about the same time.
+        share = self.throughput[server] / sum(self.throughput)
+        return max(self.CHUNK_SIZE, int(math.ceil(0.5 * share * number_of_remaining_points)))
 
-    # For each SimulationPotential instance...
-    for address in xrange(number_of_metric_servers):
+    def record_throughput(self, server, number_of_points, elapsed_time):
+        """ Update the running estimate of the throughput of a SimulationPotential instance.
 
-        # If all of the surplus tasks have been issued then indicate no extra tasks are needed
-        if address >= remainder_tasks:
-            extra_jobs = 0
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
+          number_of_points (int) :
+              The number of points in the chunk that has just finished.
+          elapsed_time (float) :
+              The length of time in seconds taken to compute the chunk.
 
-        # Initialise a list to contain the points to be computed for the current SimulationPotential instance
-        points = []
+        """
+        self.points_evaluated[server] += number_of_points
+        throughput = number_of_points / max(elapsed_time, 1e-6)
+        if self.throughput[server] is None:
+            self.throughput[server] = throughput
+        else:
+            self.throughput[server] += self.THROUGHPUT_WEIGHT * (throughput - self.throughput[server])
 
-        # Get the points between and including curve[current_point] to curve[current_point+tasks_per_server+extra_jobs]
-        # and prepare them to send to the current SimulationPotential instance
-        for i in xrange(current_point, current_point + tasks_per_server + extra_jobs):
-            points.append([curve[i], i])
+    def connection_failed(self, server):
+        """ Handle a SimulationPotential instance that couldn't be contacted by closing every connection.
 
-        # Increase current_point so the same points are not sent again
-        current_point += tasks_per_server + extra_jobs
+        Args:
+          server (int) :
+              The index in METRIC_SERVERS of the SimulationPotential instance.
 
-        # Attempt to contact the SimulationPotential instance
-        try:
-            # Create connection with the SimulationPotential instance
-            metric_server = Client(metric_server_addresses[address], authkey=authkey)
+        Returns:
+          None: Returned to indicate that the SimulationClient should shut down.
 
-            # Prepare a response containing the points to evaluate the metric on
-            metric_server.send({'status_code': comm_code('CLIENT_PROVIDES_POINT'),
-                                'points': points})
+        """
 
-            # Close the connection
-            metric_server.close()
+        # Write a warning to the log explaining which SimulationPotential couldn't be contacted.
+        logging.warning('Failed to Make Connection to SimulationPotential at ' + str(self.METRIC_SERVERS[server]) + '.')
+        self.close()
+        return None
 
-        # If the SimulationPotential instance couldn't be contacted then return None to shut down the SimulationClient
-        except socket.error:
-            # Write a warning to the log explaining which SimulationPotential couldn't be contacted.
-            logging.warning('Failed to Make Connection to SimulationPotential at '
-                          + str(metric_server_addresses[address]) + '.')
+    def close(self):
+        """ Close every open connection to the SimulationPotential instances, along with the shared memory buffers.
 
-            # Return a None value
-            return None
+        """
+        for server in xrange(len(self.connections)):
+            if self.connections[server] is not None:
+                self.connections[server].close()
+                self.connections[server] = None
+            if self.buffers[server] is not None:
+                self.buffers[server].close()
+                self.buffers[server] = None
 
-    # Now the code attempts to collect the computed values.
+    def shutdown(self):
+        """ Close every connection and tell all of the SimulationPotential instances to shutdown.
 
-    # For each SimulationPotential instance...
-    for address in xrange(number_of_metric_servers):
-        # Attempt to contact the SimulationPotential instance
-        try:
-            # Create connection with the SimulationPotential instance
-            metric_server = Client(metric_server_addresses[address], authkey=authkey)
-
-            # Prepare a response indicating the SimulationClient is ready for the answer
-            metric_server.send({'status_code': comm_code('CLIENT_ASKS_FOR_VALUES')})
-
-            # Receive the metric values at the given points
-            metric_server_response = metric_server.recv()
-
-            # Process the received values into the metric list
-            for value in metric_server_response['values']:
-                metric[value[1]] = value[0]
-
-            # Close the connection
-            metric_server.close()
-
-        # If the SimulationPotential instance couldn't be contacted then return None to shut down the SimulationClient
-        except socket.error:
-            # Write a warning to the log explaining which SimulationPotential couldn't be contacted.
-            logging.warning('Failed to Make Connection to SimulationPotential at '
-                          + str(metric_server_addresses[address]) + '.')
-
-            # Return a None value
-            return None
-
-    # If None hasn't been returned then return the metric values
-    return metric
+        """
+        self.close()
+        shutdown_metric(self.METRIC_SERVERS, self.AUTHKEY)
 
 
 def shutdown_metric(metric_server_addresses, authkey):
@@ -142,4 +484,4 @@ def shutdown_metric(metric_server_addresses, authkey):
         except socket.error:
             # Make a note in the log which SimulationPotential couldn't be contacted.
             logging.warning('Failed to Make Connection to SimulationPotential at '
-                          + str(metric_server_addresses[address]) + '.')
\ No newline at end of file
+                          + str(metric_server_addresses[address]) + '.')
@@ -1,5 +1,7 @@
-from multiprocessing.connection import Client
+import threading
+import copy
 import time
+import os
 import logging
 import socket
 
@@ -7,9 +9,10 @@ import numpy as np
 
 from SimulationUtilities import Configuration_Processing
 from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities import Wire_Format
 import LinearAlgebra as la
-from CustomBFGS import find_geodesic_midpoint
-from MetricValues import shutdown_metric
+from CustomBFGS import find_geodesic_midpoint, warm_start_is_usable
+from MetricValues import MetricServerPool
 
 
 class SimulationClient:
@@ -32,15 +35,55 @@ class SimulationClient:
           contact the SimulationServer again.
       METRIC_SERVERS :
           A list containing tuples of addresses for SimulationPotential instances.
+      METRIC_POOL (MetricServerPool) :
+          The persistent connections to the SimulationPotential instances used to compute metric values.
       ID (str) :
           A string that uniquely identifies the client amongst all other clients in the computation.
-      MASS_MATRIX (numpy.array) :
-          A NumPy matrix containing the mass matrix of the molecular system. Produced automatically from the Atomistic
+      MASS_METRIC (DiagonalMassMetric) :
+          The mass matrix of the molecular system, stored as its diagonal. Produced automatically from the Atomistic
           Simulation Environment.
+      PERSISTENT_SESSION (bool) :
+          Whether the SimulationClient keeps a single connection to the SimulationServer open for its whole lifetime,
+          rather than connecting afresh for every message.
+      WIRE_FORMAT (bool) :
+          Whether the binary message format is offered to the SimulationServer and SimulationPotential instances when
+          connecting to them.
+      WARM_START (str) :
+          Where the state of the last local geodesic computed for each node is kept, so that the next local geodesic
+          for the node starts from it. Either 'local' to keep it in warm_starts, 'server' to also send it to the
+          SimulationServer, which ships it with the node's next task to whichever client is given it, or None to start
+          every local geodesic from the straight line.
+      warm_starts (dict) :
+          The state of the last local geodesic this client computed for each node, indexed by the level of the
+          multilevel scheme, which is zero for a single level, and the node number.
+      task_statistics (dict) :
+          The number of local geodesics computed, and the total number of curves along which the metric was evaluated
+          for them, for those started from the straight line ('cold') and from a previous local geodesic ('warm').
+      HEARTBEAT_INTERVAL (float) :
+          The length of time in seconds between the CLIENT_HEARTBEAT messages sent to renew the lease on the node being
+          computed, or None if no heartbeats are sent.
+      heartbeat (Thread) :
+          The thread sending heartbeats for the task being computed, or None if there is no such task.
+      heartbeat_stopped (Event) :
+          Set to tell the heartbeat thread to stop.
+      CONCURRENT_TASKS (int) :
+          The number of tasks the SimulationClient holds from the SimulationServer at once. Each is computed on its own
+          thread by a task slot, a copy of the SimulationClient with its own session and MetricServerPool, so that
+          while one waits for metric values another keeps the processor, and the SimulationPotential instances, busy.
+      idle_time (float) :
+          The total length of time in seconds spent waiting for the SimulationServer, including any callback delays,
+          averaged over the task slots.
+      waiting_time (float) :
+          The total length of time in seconds spent waiting for metric values, averaged over the task slots.
+      cpu_time (float) :
+          The processor time in seconds used by the SimulationClient while running.
+      running_time (float) :
+          The total length of time in seconds the SimulationClient has been running.
 
     """
     def __init__(self, simulation_client_id, server_host, server_port, authkey, metric_server_addresses,
-                 configuration_file, logfile=None, log_level=logging.INFO, callback_delay=1.0):
+                 configuration_file, logfile=None, log_level=logging.INFO, callback_delay=1.0, persistent_session=True,
+                 wire_format=True, warm_start=None, heartbeat_interval=10.0, concurrent_tasks=1):
         """The constructor for the SimulationClient class.
 
         Note:
@@ -69,6 +112,22 @@ class SimulationClient:
           callback_delay (float) :
               The length of time the SimulationClient should wait if there is no new available jobs, before attempting
                to contact the SimulationServer again.
+          persistent_session (bool, optional) :
+              If True then a single authenticated connection to the SimulationServer is held open for the lifetime of
+              the SimulationClient, otherwise a new connection is made for every message.
+          wire_format (bool, optional) :
+              If True then the binary message format is offered on each persistent connection, and used if it is
+              accepted. Otherwise, or if it is declined, messages are pickled.
+          warm_start (str, optional) :
+              Either 'local', 'server' or None, as described in the WARM_START attribute. Shipping the state through
+              the server lets every client benefit from it, at the cost of sending it with each task and result.
+          heartbeat_interval (float, optional) :
+              The length of time in seconds between heartbeats while a task is computed. This should be several times
+              shorter than the timeout of the SimulationServer. If None then no heartbeats are sent.
+          concurrent_tasks (int, optional) :
+              The number of tasks computed at once, as described in the CONCURRENT_TASKS attribute. The task slots
+              share the processor through Python threads, so this pays off when they spend much of their time waiting
+              on the SimulationPotential instances.
 
         """
         # Set the SimulationClient log output to write to logfile at prescribed log level if specified. Otherwise write
@@ -88,26 +147,243 @@ class SimulationClient:
         # Set the callback delay as described in the attributes.
         self.DELAY = callback_delay
 
+        # Set the session mode and initialise the memory for the open connection to the SimulationServer.
+        self.PERSISTENT_SESSION = persistent_session
+        self.session = None
+
         # Store the ADDRESS and AUTHKEY attributes for Client objects in the start_client method used to compute the
         # metric values.
         self.METRIC_SERVERS = metric_server_addresses
+        self.WIRE_FORMAT = wire_format
+        self.METRIC_POOL = MetricServerPool(metric_server_addresses, authkey, wire_format=wire_format)
+
+        # Initialise the memory for the state of the local geodesics computed, and the record of how many metric
+        # evaluations they took.
+        if warm_start not in ('local', 'server', None):
+            raise ValueError('Unknown warm start mode ' + str(warm_start) + '.')
+        self.WARM_START = warm_start
+        self.warm_starts = {}
+        self.task_statistics = {'cold': [0, 0], 'warm': [0, 0]}
+
+        # Set the interval between heartbeats, which are sent from a separate thread while a task is computed.
+        self.HEARTBEAT_INTERVAL = heartbeat_interval
+        self.heartbeat = None
+        self.heartbeat_stopped = threading.Event()
 
         # Set the client's unique identifier.
         self.ID = simulation_client_id
 
+        # Set the number of tasks computed at once.
+        if concurrent_tasks < 1:
+            raise ValueError('The number of concurrent tasks must be at least one.')
+        self.CONCURRENT_TASKS = int(concurrent_tasks)
+
+        # Initialise the record of how long the SimulationClient has spent waiting for work and for metric values.
+        self.idle_time = 0.0
+        self.waiting_time = 0.0
+        self.cpu_time = 0.0
+        self.running_time = 0.0
+
         # Compute the mass matrix for the molecular system.
-        self.MASS_MATRIX = np.diag(np.dstack((self.CONFIGURATION['molecule'].get_masses(),) *
-                                             (self.CONFIGURATION['dimension'] /
-                                              len(self.CONFIGURATION['molecule'].get_masses()))).flatten())
+        self.MASS_METRIC = la.DiagonalMassMetric(self.CONFIGURATION['molecule'].get_masses(),
+                                                 self.CONFIGURATION['dimension'])
+
+    def exchange(self, client_response):
+        """Send a message to the SimulationServer and wait for its response.
+
+        Note:
+          In persistent session mode the connection is only created on the first call, and the authentication handshake
+          is not repeated for subsequent messages.
+
+        Args:
+          client_response (dict) :
+              The message to send to the SimulationServer.
+
+        Returns:
+          dict: The response from the SimulationServer.
+
+        """
+
+        # Time spent waiting for the response is idle time, as the SimulationClient has nothing else to do.
+        start = time.time()
+
+        # Create a connection to the listener on CURVE_ADDRESS using password AUTHKEY, unless a session is already open.
+        # The binary message format is only worth agreeing for a session that is kept open.
+        if self.session is None:
+            if self.WIRE_FORMAT and self.PERSISTENT_SESSION:
+                self.session = Wire_Format.connect(self.CURVE_ADDRESS, self.AUTHKEY)
+            else:
+                self.session = Wire_Format.connect(self.CURVE_ADDRESS, self.AUTHKEY, versions=())
+
+        # When a connection is made send the client message, the server responds along the same connection.
+        self.session.send(client_response)
+        server_response = self.session.recv()
+
+        # If not in persistent session mode then close the connection to allow other clients to communicate with the
+        # SimulationServer.
+        if not self.PERSISTENT_SESSION:
+            self.close_session()
 
+        self.idle_time += time.time() - start
+        return server_response
+
+    def start_heartbeat(self, lease_id):
+        """Start sending heartbeats to renew the lease on the task about to be computed.
+
+        Args:
+          lease_id (int) :
+              The lease ID sent with the task.
+
+        """
+        if self.HEARTBEAT_INTERVAL is None or lease_id is None:
+            return
+        self.heartbeat_stopped.clear()
+        self.heartbeat = threading.Thread(target=self.send_heartbeats, args=(lease_id,))
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+
+    def stop_heartbeat(self):
+        """Stop sending heartbeats, waiting for any heartbeat being sent to finish so that the session is free.
+
+        """
+        if self.heartbeat is not None:
+            self.heartbeat_stopped.set()
+            self.heartbeat.join()
+            self.heartbeat = None
+
+    def send_heartbeats(self, lease_id):
+        """Send a heartbeat every HEARTBEAT_INTERVAL seconds until told to stop. This runs on a background thread.
+
+        Note:
+          In persistent session mode the heartbeats are sent along the open session, which the main thread doesn't use
+          while a task is computed. The SimulationServer doesn't reply to heartbeats.
+
+        Args:
+          lease_id (int) :
+              The lease ID sent with the task being computed.
+
+        """
+        heartbeat = {'status_code': comm_code('CLIENT_HEARTBEAT'), 'client_name': self.ID, 'lease_id': lease_id}
+        while not self.heartbeat_stopped.wait(self.HEARTBEAT_INTERVAL):
+            try:
+                if self.PERSISTENT_SESSION and self.session is not None:
+                    self.session.send(heartbeat)
+                else:
+                    connection = Wire_Format.connect(self.CURVE_ADDRESS, self.AUTHKEY, versions=())
+                    connection.send(heartbeat)
+                    connection.close()
+
+            # If the SimulationServer can't be reached then the main thread will find out when it returns the result.
+            except (socket.error, EOFError, IOError):
+                logging.warning('Failed to send heartbeat to SimulationServer.')
+                return
+
+    def close_session(self):
+        """Close the connection to the SimulationServer, if one is open.
+
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def task_slot(self, slot_number):
+        """Create a task slot, a copy of the SimulationClient that computes tasks on its own thread.
+
+        Note:
+          The slot shares the configuration and the warm start states with the SimulationClient, but has its own
+          session with the SimulationServer, its own connections to the SimulationPotential instances and its own
+          statistics, so that no connection is used by two threads at once.
+
+        Args:
+          slot_number (int) :
+              The number of the slot, which is appended to the ID of the SimulationClient to identify the slot to the
+              SimulationServer.
+
+        Returns:
+          SimulationClient: The task slot.
+
+        """
+        slot = copy.copy(self)
+        slot.ID = '%s-%d' % (self.ID, slot_number)
+        slot.session = None
+        slot.METRIC_POOL = MetricServerPool(self.METRIC_SERVERS, self.AUTHKEY, wire_format=self.WIRE_FORMAT)
+        slot.task_statistics = {'cold': [0, 0], 'warm': [0, 0]}
+        slot.heartbeat = None
+        slot.heartbeat_stopped = threading.Event()
+        slot.idle_time = 0.0
+        return slot
 
     def start_client(self):
         """Start the instance of SimulationClient and begin computing local geodesics.
 
+        """
+        start = time.time()
+        cpu_start = sum(os.times()[:2])
+
+        # Compute the tasks in this thread, or run a task slot for each of the tasks held at once on its own thread.
+        if self.CONCURRENT_TASKS == 1:
+            slots = [self]
+            server_lost = self.run_tasks()
+        else:
+            slots = [self.task_slot(slot_number) for slot_number in xrange(self.CONCURRENT_TASKS)]
+            results = [False] * len(slots)
+
+            def run_slot(slot_number):
+                results[slot_number] = slots[slot_number].run_tasks()
+
+            threads = [threading.Thread(target=run_slot, args=(slot_number,)) for slot_number in xrange(len(slots))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            server_lost = any(results)
+
+        # Once the SimulationServer can't be reached send a signal to the running instances of SimulationPotential
+        # that the SimulationClient would have used indicating that they should also shutdown. This is only done once
+        # every task slot has stopped using them.
+        if server_lost:
+            self.METRIC_POOL.shutdown()
+
+        self.running_time = time.time() - start
+        self.cpu_time = sum(os.times()[:2]) - cpu_start
+
+        # Report how many evaluations of the potential the metric cache saved.
+        for slot in slots:
+            logging.info('Metric cache of %s: %s', slot.ID, slot.METRIC_POOL.cache.statistics())
+
+        # Report how many evaluations each local geodesic took, over all of the task slots.
+        for start_type in ('cold', 'warm'):
+            tasks = sum(slot.task_statistics[start_type][0] for slot in slots)
+            curves_evaluated = sum(slot.task_statistics[start_type][1] for slot in slots)
+            if tasks:
+                logging.info('%d local geodesics from a %s start, %.1f curve evaluations each on average.', tasks,
+                             start_type, curves_evaluated / float(tasks))
+
+        # Report the utilisation of the SimulationClient: how long its task slots spent waiting for work and for metric
+        # values on average, and how much of the processor it used.
+        self.idle_time = sum(slot.idle_time for slot in slots) / len(slots)
+        self.waiting_time = sum(slot.METRIC_POOL.waiting_time for slot in slots) / len(slots)
+        running_time = max(self.running_time, 1e-12)
+        logging.info('Client %s idle for %.2f s of %.2f s (%.1f%%).', self.ID, self.idle_time, self.running_time,
+                     100.0 * self.idle_time / running_time)
+        logging.info('Client %s waiting for metric values for %.2f s of %.2f s (%.1f%%) with %d task slots.', self.ID,
+                     self.waiting_time, self.running_time, 100.0 * self.waiting_time / running_time, len(slots))
+        logging.info('Client %s used %.2f s of processor time in %.2f s (%.1f%%).', self.ID, self.cpu_time,
+                     self.running_time, 100.0 * self.cpu_time / running_time)
+
+    def run_tasks(self):
+        """Request and compute local geodesics until the SimulationServer or the SimulationPotential instances can no
+        longer be reached.
+
+        Returns:
+          bool: True if the SimulationServer could not be reached, so that the SimulationPotential instances should be
+          shut down, or False if the SimulationPotential instances could not be reached.
+
         """
 
         # Define a flag to indicate if contact with the SimulationServer instance is possible.
         connection_made = False
+        server_lost = False
 
         # Create a response to send to the SimulationServer indicating that this is the first time this SimulationClient
         # has attempted to get a task.
@@ -116,34 +392,24 @@ class SimulationClient:
 
         # Attempt to connect to the SimulationServer instance.
         try:
-            # Create a Client object that communicates with the listener on CURVE_ADDRESS using password AUTHKEY.
-            server = Client(self.CURVE_ADDRESS, authkey=self.AUTHKEY)
-
-            # When a connection is made send the client message.
-            server.send(client_response)
-
             # The client assumes the server will respond with a message, either a local geodesic to compute or a message
             # asking the client to try again after DELAY seconds.
-            server_response = server.recv()
+            server_response = self.exchange(client_response)
 
             # Interpret the servers response by first extracting the status_code variable from the response.
             server_response_code = server_response['status_code']
 
-            # Close the connection to the server at this point to allow other clients to communicate with the
-            # SimulationServer.
-            server.close()
-
             # Store in the connection_made flag that it was possible to create a connection.
             connection_made = True
 
         # If it isn't possible to connect to the server than a socket.error exception is raised.
-        except socket.error:
+        except (socket.error, EOFError):
             # Write an error to the log for this client indicating that the connection couldn't be made.
             logging.warning('Failed to Make Connection to SimulationServer. Shutting down client.')
 
-            # Send a signal to the running instances of SimulationPotential that the SimulationClient would have used
-            # indicating that they should also shutdown.
-            shutdown_metric(self.METRIC_SERVERS, self.AUTHKEY)
+            # Note that the running instances of SimulationPotential that the SimulationClient would have used should
+            # also shutdown.
+            server_lost = True
 
         # This is the main loop of the SimulationClient - the program stops running when it is no longer possible to
         # communicate with the SimulationServer. This is decided by the connection_made flag.
@@ -155,21 +421,50 @@ class SimulationClient:
             # If the server has indicated it is giving the SimulationClient a new geodesic to compute then...
             if server_response_code == comm_code('SERVER_GIVES_NEW_TASK'):
 
+                # Tasks at the coarse levels of a multilevel simulation say how many local nodes to use, and the
+                # tolerance of their level.
+                local_number_of_nodes = server_response.get('local_number_of_nodes',
+                                                            self.CONFIGURATION['local_number_of_nodes'])
+                tolerance = server_response.get('tolerance', self.CONFIGURATION['tolerance'])
+
                 # Compute the rescaled tangent direction of the curve as store as a NumPy array.
-                tangent_direction = (1 / float(self.CONFIGURATION['local_number_of_nodes'] + 1)) * \
+                tangent_direction = (1 / float(local_number_of_nodes + 1)) * \
                     np.subtract(server_response['right_end_point'], server_response['left_end_point'], dtype='float64')
 
+                # Start from the state of the last local geodesic for the node, preferring the one shipped by the
+                # server as it is the most recent whichever client computed it, unless its end points have since moved
+                # by more than the tolerance.
+                node_number = server_response['node_number']
+                node = (server_response.get('level', 0), node_number)
+                warm_start = None
+                if self.WARM_START is not None:
+                    warm_start = dict(server_response.get('warm_start') or self.warm_starts.get(node, {}))
+                start_type = 'cold'
+                if warm_start_is_usable(warm_start, server_response['left_end_point'],
+                                        server_response['right_end_point'], local_number_of_nodes,
+                                        self.CONFIGURATION['codimension'] + 1, tolerance):
+                    start_type = 'warm'
+                curves_evaluated = self.METRIC_POOL.curves_evaluated
+
+                # Renew the lease on the node with heartbeats while it is computed.
+                self.start_heartbeat(server_response.get('lease_id'))
+
                 # Compute the local geodesic using the BFGS method and store the NumPy array in result
                 result = \
                     find_geodesic_midpoint(server_response['left_end_point'],
                                                 server_response['right_end_point'],
-                                                self.CONFIGURATION['local_number_of_nodes'],
-                                                la.orthonormal_tangent_basis(tangent_direction,
-                                                                          self.CONFIGURATION['dimension']),
+                                                local_number_of_nodes,
+                                                la.HouseholderTangentBasis(tangent_direction),
                                                 tangent_direction, self.CONFIGURATION['codimension'],
-                                                self.METRIC_SERVERS,
-                                                self.MASS_MATRIX,
-                                                self.AUTHKEY)
+                                                self.METRIC_POOL,
+                                                self.MASS_METRIC,
+                                                optimiser=self.CONFIGURATION['optimiser'],
+                                                lbfgs_memory=self.CONFIGURATION['lbfgs_memory'],
+                                                warm_start=warm_start,
+                                                warm_start_tolerance=tolerance,
+                                                line_search=self.CONFIGURATION['line_search'],
+                                                line_search_steps=self.CONFIGURATION['line_search_steps'])
+                self.stop_heartbeat()
 
                 # If the function find_geodesic_midpoint returned a None object then it couldn't contact it's
                 # SimulationPotential instances and should be restarted.
@@ -180,49 +475,61 @@ class SimulationClient:
                     # Exit the main loop of the SimulationClient.
                     break
 
+                # Record how many times the metric was evaluated along a curve to compute the local geodesic.
+                curves_evaluated = self.METRIC_POOL.curves_evaluated - curves_evaluated
+                self.task_statistics[start_type][0] += 1
+                self.task_statistics[start_type][1] += curves_evaluated
+                logging.debug('Node %d computed from a %s start with %d curve evaluations.', node_number, start_type,
+                              curves_evaluated)
+
                 # If there is a midpoint then construct a client response to tell the server which node has which new
                 # position.
                 client_response = {'status_code': comm_code('CLIENT_HAS_MIDPOINT_DATA'),
-                                   'node_number': server_response['node_number'],
+                                   'lease_id': server_response.get('lease_id'),
+                                   'node_number': node_number,
                                    'new_node_position': result,
                                    'client_name': self.ID
                                    }
 
+                # Keep the state of the local geodesic for the next time the node is computed.
+                if self.WARM_START is not None:
+                    self.warm_starts[node] = warm_start
+                    if self.WARM_START == 'server':
+                        client_response['warm_start'] = warm_start
+
             # Otherwise if the server has asked the SimulationClient to try again later...
             elif server_response_code == comm_code('SERVER_REQUEST_CALLBACK'):
                 # Make the SimulationClient wait for DELAY seconds
                 time.sleep(self.DELAY)
+                self.idle_time += self.DELAY
 
                 # Create a response to tell the SimulationServer that the SimulationClient would like a new job.
                 client_response = {'status_code': comm_code('CLIENT_HAS_NO_TASK'), 'client_name': self.ID}
 
-            # Attempt to connect to the SimulationServer instance.
+            # Attempt to communicate with the SimulationServer instance.
             try:
-                # Create a Client object that communicates with the listener on CURVE_ADDRESS using password AUTHKEY.
-                server = Client(self.CURVE_ADDRESS, authkey=self.AUTHKEY)
-
-                # When a connection is made send the client message.
-                server.send(client_response)
-
                 # The client assumes the server will respond with a message, either a local geodesic to compute or a
                 # message asking the client to try again after DELAY seconds.
-                server_response = server.recv()
+                server_response = self.exchange(client_response)
 
                 # Interpret the servers response by first extracting the status_code variable from the response.
                 server_response_code = server_response['status_code']
 
-                # Close the connection to the server at this point to allow other clients to communicate with the
-                # SimulationServer.
-                server.close()
-
-            # If it isn't possible to connect to the server than a socket.error exception is raised.
+            # If it isn't possible to connect to the server, or the server closes the session, then a socket.error or
+            # EOFError exception is raised.
             except (socket.error, EOFError):
                 # Write an error to the log for this client indicating that the connection couldn't be made.
                 logging.warning('Failed to Make Connection to SimulationServer. Shutting down client.')
 
-                # Send a signal to the running instances of SimulationPotential that the SimulationClient would have
-                # used indicating that they should also shutdown.
-                shutdown_metric(self.METRIC_SERVERS, self.AUTHKEY)
+                # Note that the running instances of SimulationPotential that the SimulationClient would have used
+                # should also shutdown.
+                server_lost = True
 
                 # Exit the main loop of the SimulationClient.
-                break
\ No newline at end of file
+                break
+
+        # Release the session with the SimulationServer and the connections to the SimulationPotential instances.
+        self.close_session()
+        self.METRIC_POOL.close()
+
+        return server_lost
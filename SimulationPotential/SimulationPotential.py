@@ -1,20 +1,30 @@
-from multiprocessing.connection import Listener
+import multiprocessing
+import signal
 import math
+import time
 import logging
+import os
 
-from ase.calculators.emt import EMT
+import numpy as np
+from ase.calculators.emt import VectorizedEMT, BatchEMT
 
 from SimulationUtilities import Configuration_Processing
 from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities.Session_Handling import SessionListener
+from SimulationUtilities.Metric_Cache import MetricCache
+from SimulationUtilities.Shared_Memory import SharedMetricBuffer
 
 
 class SimulationPotential:
     """
 
     The purpose of this object is to provide an independent service that computes the forces and potential energy for
-    the system. The object listens for a TCP connection containing a molecular configuration. The forces and potential
-    energy are then sent using TCP via the Listener object provided by the multiprocessing package. If a kill code is
-    received then the server shuts down.
+    the system. The object listens for messages containing molecular configurations on the sessions held open by its
+    SimulationClient. The forces and potential energy are then sent back along the same session. If a kill code is
+    received then the server shuts down. On a multi-core host the points received can be shared between a pool of
+    worker processes, each holding its own calculator and neighbour list, so that a single SimulationPotential uses
+    every core. A SimulationClient on the same host may instead exchange the points and values through a shared memory
+    buffer, in which case only the indices of the points are sent over the session.
 
     Attributes:
       CONFIGURATION (dict) :
@@ -23,11 +33,26 @@ class SimulationPotential:
           A tuple containing a string representing the hostname/IP and an integer for the service port.
       AUTHKEY (str) :
           A string containing the authorisation key for the listener method.
-
+      BATCH (bool) :
+          Whether each chunk of points is evaluated in a single call to the vectorized BatchEMT calculator.
+      cache (MetricCache) :
+          The metric values and forces at recently visited points, shared by every SimulationClient using this
+          instance. Only used if constructed with a positive cache_size.
+      WORKERS (int) :
+          The number of worker processes the points received are shared between. If one then the points are evaluated
+          in the SimulationPotential process itself.
+      pool (multiprocessing.Pool) :
+          The pool of worker processes, or None when not running or if WORKERS is one.
+      buffers (dict) :
+          The SharedMetricBuffer mapped for each session whose SimulationClient offered one.
+      scratch (SharedMetricBuffer) :
+          A buffer created by this instance to hand points received in messages to the worker processes, or None if
+          there are no workers, no points have been shared between them yet or shared memory is unavailable.
 
     """
     def __init__(self, configuration_file, logfile=None, log_level=logging.INFO,
-                 hostname='localhost', port=5001, authkey='password'):
+                 hostname='localhost', port=5001, authkey='password', batch=True,
+                 cache_size=0, cache_quantum=1e-9, workers=1):
         """The constructor for the SimulationPotential class.
 
         Note:
@@ -49,6 +74,17 @@ class SimulationPotential:
           authkey (str, optional) :
               Authentication key used to secure process communications. Default to None for local computations to
               increase speed.
+          batch (bool, optional) :
+              If True then each chunk of points received is evaluated in a single vectorized call to BatchEMT, otherwise
+              the points are evaluated one at a time. Periodic systems are always evaluated one at a time.
+          cache_size (int, optional) :
+              The largest number of points whose values are remembered. The SimulationClient keeps its own cache, so
+              the default of zero disables this one.
+          cache_quantum (float, optional) :
+              The precision to which points are compared when looking them up in the cache.
+          workers (int, optional) :
+              The number of worker processes to share the points received between. If None then one worker is started
+              for each core of the host.
 
         """
 
@@ -65,6 +101,14 @@ class SimulationPotential:
         # Set ADDRESS and AUTHKEY attributes for Listener object in the run_simulation method.
         self.ADDRESS = (hostname, port)
         self.AUTHKEY = authkey
+        self.BATCH = batch
+        self.cache = MetricCache(cache_size, cache_quantum)
+
+        # The pool of worker processes is only started when the SimulationPotential starts running.
+        self.WORKERS = workers if workers is not None else multiprocessing.cpu_count()
+        self.pool = None
+        self.buffers = {}
+        self.scratch = None
 
     def run_potential_server(self, small_number=1e-12):
         """Start the instance of SimulationPotential ready to receive requests for metric values.
@@ -80,63 +124,437 @@ class SimulationPotential:
 
         """
 
-        # Extract the ASE atoms object for molecule and set the calculator to the pure Python EMT implementation
-        molecule = self.CONFIGURATION['molecule']
-        molecule.set_calculator(EMT())
+        # Prepare the calculators used to evaluate the potential in this process.
+        molecule, batch_calculator = self.prepare_calculators()
 
-        # Set up the listener for communication at ADDRESS. This doesn't queue connections as it is **assumed** that
-        # each SimulationClient has it's own pool of SimulationPotential servers.
+        # Start the worker processes, each of which prepares its own calculators once.
+        if self.WORKERS > 1:
+            logging.info('Starting %d worker processes.', self.WORKERS)
+            self.pool = multiprocessing.Pool(self.WORKERS, initialise_worker, (self,))
+
+        # Set up the listener for communication at ADDRESS. A SimulationClient holds a single session open with each of
+        # its SimulationPotential servers, and the SessionListener also accepts the short-lived connections used to
+        # send the shut-down signal.
         logging.info('Starting Potential Server on %s', str(self.ADDRESS))
-        server = Listener(self.ADDRESS, authkey=self.AUTHKEY)
+        server = SessionListener(self.ADDRESS, authkey=self.AUTHKEY)
+
+        # Initialise the memory for values computed for clients that collect them with a separate request.
+        server_response = None
+
+        # Initialise the record of how long the SimulationPotential has spent computing values, as opposed to waiting
+        # for requests.
+        start = time.time()
+        busy_time = 0.0
+
+        running = True
+
+        while running:
+
+            # The SimulationPotential only receives requests from running instances of SimulationClient objects. The
+            # SimulationPotential waits for messages on any of the open sessions and is blocked until it receives one.
+            logging.debug('Listening for messages from SimulationClient instances...')
+            for client, client_response in server.poll():
+
+                # This is the main decision logic for handling a message from a client server.
+                # If the SimulationClient indicates it is providing points to evaluate the metric on then compute those
+                # values and prepare a response.
+                if client_response['status_code'] == comm_code('CLIENT_PROVIDES_POINT'):
+                    logging.debug('Client provides point data to evaluate.')
+                    computing = time.time()
+
+                    # Points in the shared memory buffer of the session have their values written back to it, so only
+                    # their indices are returned. A session without a buffer can't be answered, but must not stop the
+                    # SimulationPotential serving the other sessions.
+                    if 'indices' in client_response and client not in self.buffers:
+                        logging.warning('Client sent the indices of points without a shared memory buffer.')
+                        server_response = {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                           'error': 'No shared memory buffer is attached to this session.'}
+                    elif 'indices' in client_response:
+                        server_response = {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                           'indices': self.compute_shared_values(molecule, self.buffers[client],
+                                                                                 client_response['indices'],
+                                                                                 small_number, batch_calculator)}
+                    else:
+                        server_response = {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                           'values': self.compute_values(molecule, client_response['points'],
+                                                                         small_number, batch_calculator)}
+                    busy_time += time.time() - computing
+
+                    # If the request is labelled then send the values straight back along the same session, along with
+                    # the label so the SimulationClient can match them to its request. Otherwise keep the response
+                    # until the client asks for it.
+                    if 'request_id' in client_response:
+                        server_response['request_id'] = client_response['request_id']
+                        server.send(client, server_response)
+
+                elif client_response['status_code'] == comm_code('CLIENT_OFFERS_SHARED_MEMORY'):
+
+                    # Map the buffer if this process is on the same host as the SimulationClient.
+                    logging.debug('Client offers a shared memory buffer.')
+                    server.send(client, {'status_code': comm_code('SERVER_ACCEPTS_SHARED_MEMORY'),
+                                         'accepted': self.attach_shared_buffer(client, client_response,
+                                                                               server.SESSIONS)})
+
+                elif client_response['status_code'] == comm_code('CLIENT_ASKS_FOR_VALUES'):
+
+                    # Send computed potential energies and forces to client.
+                    logging.debug('Client requests result from computation.')
+                    server.send(client, server_response)
+
+                elif client_response['status_code'] == comm_code('KILL'):
+
+                    # Break main loop of SimulationPotential and subsequently close the server.
+                    logging.debug('Shut-down signal received.')
+                    running = False
+                    break
 
-        while True:
+        # Close the SimulationPotential
+        if self.cache.CAPACITY > 0:
+            logging.info('Metric cache: %s', self.cache.statistics())
+        running_time = time.time() - start
+        logging.info('SimulationPotential busy for %.2f s of %.2f s (%.1f%%).', busy_time, running_time,
+                     100.0 * busy_time / max(running_time, 1e-12))
+        logging.info('Shutting down SimulationPotential.')
+        server.close()
+        for buffer in self.buffers.values():
+            buffer.close()
+        self.buffers = {}
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.scratch is not None:
+            self.scratch.close()
+            self.scratch = None
+
+    def prepare_calculators(self):
+        """Attach a calculator to the molecule and prepare the vectorized calculator used for whole chunks of points.
+
+        Returns:
+          (ase.atoms, BatchEMT): The molecule, with the EMT implementation that evaluates all of the pair interactions
+          as NumPy arrays attached, and the BatchEMT calculator for the molecule, or None if points must be evaluated
+          one at a time.
 
-            # The Simulation server only receives requests from running instances of SimulationServer objects. The
-            # SimulationServer waits for an incoming connection and is blocked until it receives one.
-            logging.debug('Listening for connection from SimulationClient instance...')
-            client = server.accept()
+        """
+        molecule = self.CONFIGURATION['molecule']
+        molecule.set_calculator(VectorizedEMT())
 
-            # Receive request from a SimulationClient. Request is in form of dictionary that is stored in
-            # client_response
-            logging.debug('Connection to SimulationClient received from %s.', server.last_accepted)
-            client_response = client.recv()
+        # BatchEMT is only available for non-periodic systems.
+        if self.BATCH and not molecule.get_pbc().any():
+            batch_calculator = BatchEMT(molecule)
+        else:
+            batch_calculator = None
 
-            # Prepare/reset list container for server response
-            values = []
+        return molecule, batch_calculator
 
-            # This is the main decision logic for handling a connection from a client server.
-            # If the SimulationClient indicates it is providing points to evaluate the metric on then compute those
-            # values and prepare a response.
-            if client_response['status_code'] == comm_code('CLIENT_PROVIDES_POINT'):
-                logging.debug('Client provides point data to evaluate.')
+    def attach_shared_buffer(self, client, offer, sessions):
+        """Map the shared memory buffer offered by a SimulationClient, in place of any it offered before.
 
-                # Close connection before computing metric values. To free up network traffic.
-                client.close()
+        Args:
+          client (Connection) :
+              The session the offer arrived on.
+          offer (dict) :
+              The message containing the path, number of points and dimension of the buffer.
+          sessions (list) :
+              The open sessions. Buffers belonging to sessions that have closed are released.
 
-                # For each point received in client request, update the positions in our ASE atoms object and then
-                # compute the potential energy and forces.
-                for point in client_response['points']:
-                    molecule.set_positions(Configuration_Processing.convert_vector_to_atoms(point[0]))
-                    values.append([[math.sqrt(max([self.CONFIGURATION['metric_parameters'][0] -
-                                                   molecule.get_potential_energy(), small_number])),
-                                   Configuration_Processing.convert_atoms_to_vector(molecule.get_forces())], point[1]])
+        Returns:
+          bool: True if the buffer was mapped, or False if it couldn't be, for example because the SimulationClient is
+          on a different host.
 
-                # Compile response ready for when client asks for it.
-                server_response = {'status_code': comm_code('SERVER_PROVIDES_VALUES'), 'values': values}
+        """
+        for session in self.buffers.keys():
+            if session is client or session not in sessions:
+                self.buffers.pop(session).close()
+        try:
+            self.buffers[client] = SharedMetricBuffer(offer['path'], offer['number_of_points'], offer['dimension'])
+        except (IOError, OSError, ValueError):
+            return False
+        return True
+
+    def compute_shared_values(self, molecule, buffer, indices, small_number, batch_calculator=None):
+        """Compute the metric values, and the forces used to compute their gradients, at points in a shared memory
+        buffer, writing them back to the buffer.
 
-            elif client_response['status_code'] == comm_code('CLIENT_ASKS_FOR_VALUES'):
+        Args:
+          molecule (ase.atoms) :
+              The ASE atoms object, with its calculator attached, used to evaluate the potential.
+          buffer (SharedMetricBuffer) :
+              The buffer holding the points.
+          indices (list) :
+              The indices, along the curve and in the buffer, of the points.
+          small_number (float) :
+              A small number used to represent the zero metric value.
+          batch_calculator (BatchEMT, optional) :
+              If given then every point is evaluated in a single vectorized call rather than one at a time.
+
+        Returns:
+          list: The indices of the points, whose values are now in the buffer.
 
-                # Send computed potential energies and forces to client.
-                logging.debug('Client requests result from computation.')
-                client.send(server_response)
-                client.close()
+        """
+        if self.pool is None or len(indices) < 2:
+            for value in self.compute_values(molecule, [[buffer.points[i], i] for i in indices], small_number,
+                                             batch_calculator):
+                buffer.metric[value[1]] = value[0][0]
+                buffer.forces[value[1]] = value[0][1]
+            return indices
+
+        # Take the values at recently visited points from the cache, and have the worker processes write the rest
+        # straight into the buffer, so no points or values are pickled.
+        misses = []
+        for i in indices:
+            cached = self.cache.get(buffer.points[i]) if self.cache.CAPACITY > 0 else None
+            if cached is None:
+                misses.append(i)
+            else:
+                buffer.metric[i] = cached[0]
+                buffer.forces[i] = cached[1]
+        if misses:
+            self.evaluate_buffer_in_pool(buffer, misses, small_number)
+        for i in misses:
+            self.cache.put(buffer.points[i], [float(buffer.metric[i]), np.copy(buffer.forces[i])])
+        return indices
+
+    def compute_values(self, molecule, points, small_number, batch_calculator=None):
+        """Compute the metric values, and the forces used to compute their gradients, at a collection of points, taking
+        the values at recently visited points from the cache.
 
-            elif client_response['status_code'] == comm_code('KILL'):
+        Args:
+          molecule (ase.atoms) :
+              The ASE atoms object, with its calculator attached, used to evaluate the potential.
+          points :
+              A list of [numpy.array, int] pairs containing the points, along with their indices along the curve.
+          small_number (float) :
+              A small number used to represent the zero metric value.
+          batch_calculator (BatchEMT, optional) :
+              If given then every point missing from the cache is evaluated in a single vectorized call.
+
+        Returns:
+          list: A list of [[float, numpy.array], int] entries containing the metric value and the forces at each point,
+          along with the index of the point along the curve.
 
-                # Break main loop of SimulationPotential and subsequently close the server.
-                logging.debug('Shut-down signal received.')
-                break
+        """
+        if self.cache.CAPACITY <= 0:
+            return self.evaluate_values(molecule, points, small_number, batch_calculator)
+
+        # Separate the points visited recently from those that need the potential to be evaluated.
+        values = []
+        misses = []
+        for point in points:
+            cached = self.cache.get(point[0])
+            if cached is None:
+                misses.append(point)
+            else:
+                values.append([cached, point[1]])
+
+        # Evaluate the remaining points and remember their values.
+        for point, value in zip(misses, self.evaluate_values(molecule, misses, small_number, batch_calculator)):
+            self.cache.put(point[0], value[0])
+            values.append(value)
+
+        return values
+
+    def evaluate_values(self, molecule, points, small_number, batch_calculator=None):
+        """Evaluate the potential to compute the metric values, and the forces used to compute their gradients, at a
+        collection of points.
 
-        # Close the SimulationPotential
-        logging.info('Shutting down SimulationPotential.')
-        server.close()
\ No newline at end of file
+        Args:
+          molecule (ase.atoms) :
+              The ASE atoms object, with its calculator attached, used to evaluate the potential.
+          points :
+              A list of [numpy.array, int] pairs containing the points, along with their indices along the curve.
+          small_number (float) :
+              A small number used to represent the zero metric value.
+          batch_calculator (BatchEMT, optional) :
+              If given then every point is evaluated in a single vectorized call rather than one at a time.
+
+        Returns:
+          list: A list of [[float, numpy.array], int] entries containing the metric value and the forces at each point,
+          along with the index of the point along the curve.
+
+        """
+        # Share the points between the worker processes if there are any, and more than one point.
+        if self.pool is not None and len(points) > 1:
+            return self.evaluate_in_pool(points, small_number)
+
+        values = []
+
+        # Evaluate the potential energy and forces for the whole chunk of points at once if possible.
+        if batch_calculator is not None and len(points) > 0:
+            energies, forces = batch_calculator.calculate(
+                np.asarray([Configuration_Processing.convert_vector_to_atoms(point[0]) for point in points]))
+            for point, energy, force in zip(points, energies, forces):
+                values.append([[math.sqrt(max([self.CONFIGURATION['metric_parameters'][0] - energy, small_number])),
+                                force.flatten()], point[1]])
+            return values
+
+        # For each point received in client request, update the positions in our ASE atoms object and then compute the
+        # potential energy and forces.
+        for point in points:
+            molecule.set_positions(Configuration_Processing.convert_vector_to_atoms(point[0]))
+            values.append([[math.sqrt(max([self.CONFIGURATION['metric_parameters'][0] -
+                                           molecule.get_potential_energy(), small_number])),
+                           Configuration_Processing.convert_atoms_to_vector(molecule.get_forces())], point[1]])
+
+        return values
+
+    def evaluate_in_pool(self, points, small_number):
+        """Share the evaluation of the metric values at a collection of points evenly between the worker processes.
+
+        Note:
+          The points are copied into a shared memory buffer, which the worker processes map themselves and write the
+          values back to, so only the indices of the points are sent to them. The points and values are only pickled
+          if shared memory is unavailable.
+
+        Args:
+          points :
+              A list of [numpy.array, int] pairs containing the points, along with their indices along the curve.
+          small_number (float) :
+              A small number used to represent the zero metric value.
+
+        Returns:
+          list: A list of [[float, numpy.array], int] entries containing the metric value and the forces at each point,
+          along with the index of the point along the curve.
+
+        """
+        buffer = self.scratch_buffer(len(points), len(points[0][0]))
+        if buffer is None:
+            return [value for values in self.pool.map(evaluate_in_worker, [(piece, small_number) for piece in
+                                                                           split_evenly(points, self.WORKERS)])
+                    for value in values]
+
+        for i, point in enumerate(points):
+            buffer.points[i] = point[0]
+        self.evaluate_buffer_in_pool(buffer, range(len(points)), small_number)
+        return [[[float(buffer.metric[i]), np.copy(buffer.forces[i])], point[1]] for i, point in enumerate(points)]
+
+    def evaluate_buffer_in_pool(self, buffer, indices, small_number):
+        """Share the evaluation of the metric values at points in a shared memory buffer evenly between the worker
+        processes, which write the values back to the buffer.
+
+        Args:
+          buffer (SharedMetricBuffer) :
+              The buffer holding the points.
+          indices (list) :
+              The indices in the buffer of the points.
+          small_number (float) :
+              A small number used to represent the zero metric value.
+
+        """
+        description = buffer.description()
+        self.pool.map(evaluate_shared_in_worker, [(description, piece, small_number)
+                                                  for piece in split_evenly(indices, self.WORKERS)])
+
+    def scratch_buffer(self, number_of_points, dimension):
+        """Return a buffer created by this instance with room for at least number_of_points points, replacing the
+        current one if it is too small.
+
+        Args:
+          number_of_points (int) :
+              The number of points the buffer needs room for.
+          dimension (int) :
+              The dimension of the configuration space.
+
+        Returns:
+          SharedMetricBuffer: The buffer, or None if shared memory is unavailable.
+
+        """
+        if self.scratch is not None and (self.scratch.NUMBER_OF_POINTS < number_of_points or
+                                         self.scratch.DIMENSION != dimension):
+            number_of_points = max(number_of_points, 2 * self.scratch.NUMBER_OF_POINTS)
+            self.scratch.close()
+            self.scratch = None
+        if self.scratch is None:
+            self.scratch = SharedMetricBuffer.create(number_of_points, dimension)
+        return self.scratch
+
+
+def split_evenly(items, number_of_pieces):
+    """ Split a list into at most number_of_pieces contiguous pieces of nearly equal length, so that each piece is still
+    evaluated in a single vectorized call.
+
+    Args:
+      items (list): The list to split.
+      number_of_pieces (int): The largest number of pieces.
+
+    Returns:
+      list: The non-empty pieces, in order.
+
+    """
+    number_of_pieces = min(number_of_pieces, len(items))
+    if number_of_pieces == 0:
+        return []
+    bounds = [len(items) * piece // number_of_pieces for piece in xrange(number_of_pieces + 1)]
+    return [items[bounds[piece]:bounds[piece + 1]] for piece in xrange(number_of_pieces)]
+
+
+# The SimulationPotential, molecule and BatchEMT calculator of a worker process, set up once by initialise_worker, and
+# the shared memory buffers it has mapped, by path.
+worker_state = {}
+
+
+def initialise_worker(potential):
+    """ Prepare a worker process in the pool of a SimulationPotential by attaching its own calculators.
+
+    Args:
+      potential (SimulationPotential) :
+          The SimulationPotential the worker belongs to.
+
+    """
+
+    # Leave keyboard interrupts to the SimulationPotential, which shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # The worker evaluates every point it is given itself.
+    potential.pool = None
+    worker_state['potential'] = potential
+    worker_state['molecule'], worker_state['batch_calculator'] = potential.prepare_calculators()
+    worker_state['buffers'] = {}
+
+
+def evaluate_in_worker(arguments):
+    """ Evaluate the metric values at a piece of the points received by a SimulationPotential in a worker process.
+
+    Args:
+      arguments :
+          A tuple containing the list of [numpy.array, int] pairs to evaluate and the small number used to represent the
+          zero metric value.
+
+    Returns:
+      list: A list of [[float, numpy.array], int] entries as returned by SimulationPotential.evaluate_values.
+
+    """
+    points, small_number = arguments
+    return worker_state['potential'].evaluate_values(worker_state['molecule'], points, small_number,
+                                                     worker_state['batch_calculator'])
+
+
+def evaluate_shared_in_worker(arguments):
+    """ Evaluate the metric values at a piece of the points in a shared memory buffer in a worker process, writing them
+    back to the buffer.
+
+    Note:
+      The worker maps each buffer the first time it is used and keeps it mapped, releasing buffers whose files have
+      since been removed.
+
+    Args:
+      arguments :
+          A tuple containing the description of the buffer, as returned by SharedMetricBuffer.description, the indices
+          of the points in the buffer and the small number used to represent the zero metric value.
+
+    """
+    description, indices, small_number = arguments
+    buffers = worker_state['buffers']
+    buffer = buffers.get(description['path'])
+    if buffer is None or buffer.description() != description:
+        for path in buffers.keys():
+            if path == description['path'] or not os.path.exists(path):
+                buffers.pop(path).close()
+        buffer = buffers[description['path']] = SharedMetricBuffer(description['path'], description['number_of_points'],
+                                                                   description['dimension'])
+
+    for value in worker_state['potential'].evaluate_values(worker_state['molecule'],
+                                                           [[buffer.points[i], i] for i in indices], small_number,
+                                                           worker_state['batch_calculator']):
+        buffer.metric[value[1]] = value[0][0]
+        buffer.forces[value[1]] = value[0][1]
@@ -1,10 +1,13 @@
-from multiprocessing.connection import Listener
+from collections import deque
 import pickle
 import logging
 import time
 
+import numpy as np
+
 from SimulationUtilities.Configuration_Processing import read_configuration_file
 from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities.Session_Handling import SessionListener
 from SimulationUtilities.Curve import Curve
 from SimulationUtilities.Visualize import write_xyz_animation
 
@@ -13,9 +16,26 @@ class SimulationServer:
     """
 
     The purpose of this object is to manage the positions of the global nodes. The object determines the next node
-    to be sent using the next() method of the Curve class. The node is then sent using TCP via the Listener object
-    provided by the multiprocessing package. When the curve movement drops below a tolerance specified in the
-    configuration file the server will stop.
+    to be sent using the next() method of the Curve class. The node is then sent using TCP along the session each
+    SimulationClient holds open with the SessionListener. When the curve movement drops below a tolerance specified in
+    the configuration file the server will stop.
+
+    With the 'callback' scheduling mode a SimulationClient asking for work when no node is movable is told to try again
+    later, and sleeps before doing so. With the 'push' mode the request is instead held until a node becomes movable,
+    and the task is pushed along the session straight away. In the 'push' mode the server may also hand out speculative
+    tasks for nodes still waiting on their neighbours, computed against the neighbours' current positions. A speculative
+    result is only kept if neither neighbour has since moved by more than SPECULATION_TOLERANCE.
+
+    If the configuration file lists coarse levels then the curve is first converged with the fewest global and local
+    nodes to the loosest tolerance. Each converged curve is then interpolated onto the next level, until the curve
+    described by gn, ln and to has converged. Tasks carry the local number of nodes and the tolerance of their level,
+    and results of tasks handed out before a level was converged are ignored.
+
+    Every task is handed out under a lease, identified by a lease ID sent with the task, which lasts TIMEOUT seconds.
+    A SimulationClient renews its lease by sending CLIENT_HEARTBEAT messages while it computes, and the lease ends when
+    the result is returned. The server wakes up when the earliest lease is due to expire, whether or not any messages
+    arrive, and the node of an expired lease is reissued to the next client asking for work. Results are only accepted
+    under a lease that is still held, so a late result from a client whose lease expired is rejected.
 
     Attributes:
       CONFIGURATION (dict) :
@@ -31,10 +51,42 @@ class SimulationServer:
           A curve object that contains the result of the curve shortening procedure.
       FINISHED (bool) :
           To indicate whether run_simulation has completed.
+      TIMEOUT (float) :
+          The length of time in seconds a lease lasts without being renewed, after which the SimulationClient holding
+          it is presumed dead.
+      BACKLOG (int) :
+          The number of SimulationClient connections that may be waiting to be accepted at once.
+      SCHEDULING (str) :
+          Either 'callback' or 'push', as described above.
+      SPECULATIVE (bool) :
+          Whether speculative tasks are handed out when no node is movable. Only used with 'push' scheduling.
+      SPECULATION_TOLERANCE (float) :
+          The largest movement, in the infinity norm, of the neighbours of a node for a speculative result to be kept.
+      speculative_tasks (dict) :
+          The node number and neighbouring positions of each speculative task, indexed by lease ID. The node is
+          reserved in the scheduler of the CURVE, so that it isn't also issued normally, until the result arrives or
+          the lease expires.
+      speculation_statistics (dict) :
+          The numbers of speculative tasks issued, kept and discarded.
+      LEVELS (list) :
+          The (global number of nodes, local number of nodes, tolerance) of each level, coarsest first.
+      level (int) :
+          The index in LEVELS of the level being converged.
+      warm_starts (dict) :
+          The state of the last local geodesic computed for each node, indexed by node number, as sent by the
+          SimulationClient instances that ask for it to be kept. It is shipped with the next task for the node so that
+          whichever client computes it can start from the previous local geodesic.
+      leases (dict) :
+          The expiry time, node number and client name of each lease held, indexed by lease ID.
+      next_lease_id (int) :
+          The lease ID to use for the next task.
+      reissue (deque) :
+          The nodes of expired leases, waiting to be handed out again.
 
     """
     def __init__(self, configuration_file, output_filename, logfile=None,
-                 hostname='localhost', port=5000, authkey=None, log_level=logging.DEBUG, timeout=5000):
+                 hostname='localhost', port=5000, authkey=None, log_level=logging.DEBUG, timeout=5000, backlog=128,
+                 scheduling='callback', speculative=False, speculation_tolerance=None):
         """The constructor for the SimulationServer class.
 
         Note:
@@ -58,6 +110,22 @@ class SimulationServer:
               increase speed.
           log_level (int, optional) :
               Specify level of logging required as described in the logging package documentation.
+          timeout (float, optional) :
+              The length of time in seconds after which a lease that hasn't been renewed by a heartbeat expires, the
+              SimulationClient holding it is presumed dead and its node is reissued. This should be several times the
+              heartbeat interval of the clients. The default is long enough for clients that send no heartbeats, and
+              should be shortened when every client sends them so that dead clients are noticed quickly.
+          backlog (int, optional) :
+              The number of SimulationClient connections that may be waiting to be accepted at once. Only relevant
+              whilst clients are starting up, as each client then holds its session open.
+          scheduling (str, optional) :
+              'callback' to ask idle SimulationClient instances to try again later, or 'push' to hold their requests
+              until a node becomes movable.
+          speculative (bool, optional) :
+              If True, and scheduling is 'push', then speculative tasks are handed out when no node is movable.
+          speculation_tolerance (float, optional) :
+              The largest movement of the neighbours of a node for a speculative result to be kept. Defaults to the
+              tolerance in configuration_file.
         """
 
         # Set the SimulationServer log output to write to logfile at prescribed log level if specified. Otherwise write
@@ -82,10 +150,15 @@ class SimulationServer:
         # Set OUTPUT_FILENAME attribute for save_simulation method.
         self.OUTPUT_FILENAME = output_filename
 
+        # Set the levels of the multilevel scheme, the last of which is the curve described by the configuration file.
+        self.LEVELS = self.CONFIGURATION['coarse_levels'] + [(self.CONFIGURATION['global_number_of_nodes'],
+                                                              self.CONFIGURATION['local_number_of_nodes'],
+                                                              self.CONFIGURATION['tolerance'])]
+        self.level = 0
+
         # Create a new Curve object, default state is a straight line joining the start point to the end point
-        self.CURVE = Curve(self.CONFIGURATION['start_point'], self.CONFIGURATION['end_point'],
-                                 self.CONFIGURATION['global_number_of_nodes'],
-                                 self.CONFIGURATION['total_number_of_nodes'])
+        self.CURVE = Curve(self.CONFIGURATION['start_point'], self.CONFIGURATION['end_point'], self.LEVELS[0][0],
+                           self.LEVELS[0][0] * (self.LEVELS[0][1] - 1) + 1, self.CONFIGURATION['scheduler'])
 
         # Add configuration from configuration_file to the CURVE attribute. This is so that researchers can share
         # the results from the save_simulation method and determine for what parameters the simulation was run under.
@@ -95,6 +168,27 @@ class SimulationServer:
         self.FINISHED = False
 
         self.TIMEOUT = timeout
+        self.BACKLOG = backlog
+
+        # Set the scheduling mode.
+        if scheduling not in ('callback', 'push'):
+            raise ValueError('Unknown scheduling mode ' + str(scheduling) + '.')
+        self.SCHEDULING = scheduling
+        self.SPECULATIVE = speculative and scheduling == 'push'
+        if speculation_tolerance is None:
+            speculation_tolerance = self.CONFIGURATION['tolerance']
+        self.SPECULATION_TOLERANCE = speculation_tolerance
+        self.speculative_tasks = {}
+        self.speculation_statistics = {'issued': 0, 'kept': 0, 'discarded': 0}
+
+        # Initialise the memory for the local geodesic state shipped with each node's tasks.
+        self.warm_starts = {}
+
+        # Initialise the record of the leases held on the nodes that have been handed out, and the queue of nodes whose
+        # leases have expired.
+        self.leases = {}
+        self.next_lease_id = 1
+        self.reissue = deque()
 
     def run_simulation(self):
         """Start the SimulationServer listener and start the Birkhoff curve shortening procedure.
@@ -104,89 +198,268 @@ class SimulationServer:
           pointing to ADDRESS, otherwise this process will remain indefinitely blocked.
         """
 
-        # Set up the listener for communication at ADDRESS. Backlog is set to 5 to allow maximum concurrent connections.
-        # If a larger scale project is needed then the SimulationServer will need to run a separate communication
-        # handling process.
+        # Set up the listener for communication at ADDRESS. Each SimulationClient keeps a single session open for its
+        # whole lifetime and the SessionListener multiplexes the messages arriving on all of them, so the backlog only
+        # matters whilst clients are starting up.
         logging.info('Starting Server on %s', str(self.ADDRESS))
-        server = Listener(self.ADDRESS, authkey=self.AUTHKEY, backlog=5)
+        server = SessionListener(self.ADDRESS, authkey=self.AUTHKEY, backlog=self.BACKLOG)
 
-        client_monitor = {}
+        converged = False
 
-        while True:
+        # Initialise the queue of SimulationClient instances waiting for a task, in the order they asked for one.
+        waiting = deque()
 
-            # The Simulation server only receives requests from running instances of SimulationServer objects. The
-            # SimulationServer waits for an incoming connection and is blocked until it receives one.
-            logging.debug('Listening for connection from Client instance...')
-            client = server.accept()
+        while not converged:
 
-            # Receive request from a SimulationClient. Request is in form of dictionary that is stored in
-            # client_response
-            logging.debug('Connection to Client received from %s.', server.last_accepted)
-            client_response = client.recv()
+            # The Simulation server only receives requests from running instances of SimulationClient objects. The
+            # SimulationServer waits for messages on any of the open sessions and is blocked until it receives one, or
+            # until the earliest lease is due to expire. Any leases that have expired are then ended.
+            logging.debug('Listening for messages from Client instances...')
+            messages = server.poll(self.time_until_expiry())
+            self.expire_leases()
 
-            # If the SimulationClient identifies that it contains a new midpoint position then extract it and update
-            # the CURVE attribute.
-            if client_response['status_code'] == comm_code('CLIENT_HAS_MIDPOINT_DATA'):
-                logging.debug('Client response contains new midpoint.')
-                # If the client hasn't already been presumed dead then update node position, otherwise ignore.
-                if client_monitor[client_response['client_name']] is not None:
-                    self.CURVE.set_node_position(client_response['node_number'], client_response['new_node_position'])
-                else:
-                    logging.debug('Client took too long to respond. Was presumed dead.')
-            elif client_response['status_code'] == comm_code('CLIENT_FIRST_CONTACT'):
-                logging.debug('First contact from Client:' + str(client_response['client_name']))
-                client_monitor[client_response['client_name']] = None
-
-            # Check whether each node in the global curve has now been repositioned. If so, check the total movement
-            # of the curve, if this is smaller than the tolerance set in configuration_file then exit the main loop.
-            # Otherwise, set all of the nodes in the global curve as movable again. For more information see the Curve
-            # class.
-            if self.CURVE.all_nodes_moved():
-                logging.info('Total curve movement: %s', self.CURVE.movement)
-                if self.CURVE.movement < self.CONFIGURATION['tolerance']:
+            # Process every midpoint received in this batch before handing out any tasks, so that nodes released by
+            # one client's result are available to every client waiting in the same batch.
+            messages.sort(key=lambda message: message[1]['status_code'] != comm_code('CLIENT_HAS_MIDPOINT_DATA'))
+
+            for client, client_response in messages:
+                if self.process_client_response(client_response):
+                    converged = True
                     break
 
+            # Reply to each client along its session, with either a new task or a request to try again later. In the
+            # 'push' mode clients are instead kept waiting, in order, until there is a task for them. Heartbeats aren't
+            # answered.
+            if not converged:
+                for client, client_response in messages:
+                    if client_response['status_code'] != comm_code('CLIENT_HEARTBEAT'):
+                        waiting.append((client, client_response['client_name']))
+                while waiting:
+                    client, client_name = waiting[0]
+                    if client not in server.SESSIONS:
+                        waiting.popleft()
+                        continue
+                    task = self.assign_task(client_name)
+                    if self.SCHEDULING == 'push' and task['status_code'] == comm_code('SERVER_REQUEST_CALLBACK'):
+                        break
+                    waiting.popleft()
+                    server.send(client, task)
+
+        # The computation has now been completed and the listener, along with every open session, is shut down.
+        if self.SPECULATIVE:
+            logging.info('Speculative tasks: %d issued, %d kept, %d discarded.', self.speculation_statistics['issued'],
+                         self.speculation_statistics['kept'], self.speculation_statistics['discarded'])
+        logging.info('Shutting down Server.')
+        server.close()
+
+        self.FINISHED = True
+
+    def process_client_response(self, client_response):
+        """ Update the CURVE with the contents of a message received from a SimulationClient.
+
+        Args:
+          client_response (dict) :
+              The message received from the SimulationClient.
+
+        Returns:
+          bool: True if the curve movement has dropped below the tolerance and the simulation should stop.
+
+        """
+
+        # If the SimulationClient identifies that it contains a new midpoint position then extract it and update the
+        # CURVE attribute.
+        if client_response['status_code'] == comm_code('CLIENT_HAS_MIDPOINT_DATA'):
+            logging.debug('Client response contains new midpoint.')
+            # If the lease the task was handed out under is still held then update node position, otherwise ignore.
+            # Speculative results are only kept if they are still valid, and a node is never moved twice in a sweep.
+            lease_id = client_response.get('lease_id')
+            node_number = client_response['node_number']
+            accepted = False
+            speculative_task = None
+            if self.leases.pop(lease_id, None) is None:
+                logging.debug('Client took too long to respond. Its lease had expired.')
+            elif lease_id in self.speculative_tasks:
+                speculative_task = self.speculative_tasks.pop(lease_id)
+                if self.speculation_valid(speculative_task):
+                    self.speculation_statistics['kept'] += 1
+                    accepted = True
+                else:
+                    self.speculation_statistics['discarded'] += 1
+            elif self.CURVE.node_moved(node_number):
+                logging.debug('Node %d has already moved in this sweep. Result ignored.', node_number)
+            else:
+                accepted = True
+            if accepted:
+                self.CURVE.set_node_position(node_number, client_response['new_node_position'])
+
+                # Keep the state of the local geodesic, if the client sent it, to ship with the node's next task.
+                if 'warm_start' in client_response:
+                    self.warm_starts[node_number] = client_response['warm_start']
+
+            # The node of a speculative task is free to be issued again, unless its result has just moved it.
+            if speculative_task is not None:
+                self.CURVE.release_node(speculative_task[0])
+        elif client_response['status_code'] == comm_code('CLIENT_HEARTBEAT'):
+            # Renew the lease, unless it has already expired.
+            lease = self.leases.get(client_response.get('lease_id'))
+            if lease is not None:
+                lease[0] = time.time() + self.TIMEOUT
+        elif client_response['status_code'] == comm_code('CLIENT_FIRST_CONTACT'):
+            logging.debug('First contact from Client:' + str(client_response['client_name']))
+
+        # Check whether each node in the global curve has now been repositioned. If so, check the total movement of the
+        # curve, if this is smaller than the tolerance of the level then the level is converged, and the simulation is
+        # finished once the last level is. Otherwise, set all of the nodes in the global curve as movable again. For
+        # more information see the Curve class.
+        if self.CURVE.all_nodes_moved():
+            logging.info('Total curve movement: %s', self.CURVE.movement)
+            if self.CURVE.movement < self.LEVELS[self.level][2]:
+                if self.level == len(self.LEVELS) - 1:
+                    return True
+                self.refine_curve()
+            else:
                 self.CURVE.set_node_movable()
 
-            # If the code has reached this point then there are still nodes to move, and the desired solution hasn't
-            # yet been attained. Use the next_movable_node method of the CURVE to get the index of the next movable
-            # node.
-            next_node_number = None
-            for client_info in client_monitor:
-                if client_monitor[client_info] is not None:
-                    time_elapsed_since_sent = time.time() - client_monitor[client_info][0]
-                    if (time_elapsed_since_sent) > self.TIMEOUT:
-                        next_node_number = client_monitor[client_info][1]
-                        client_monitor[client_info] = None
-            if next_node_number is None:
-                next_node_number = self.CURVE.next_movable_node()
-
-            logging.debug('Next movable node: %s', next_node_number)
-
-            # Even if there are nodes that need to be tested, it may not be possible if it's neighbours are currently
-            # being tested, in which case the SimulationServer tells the client to try again later. Otherwise a new
-            # node is obtained and sent back to the server.
+        return False
+
+    def assign_task(self, client_name):
+        """ Determine the next task for a SimulationClient.
+
+        Args:
+          client_name (str) :
+              The unique identifier of the SimulationClient asking for a task.
+
+        Returns:
+          dict: The response to send to the SimulationClient, either a new task or a request to try again later.
+
+        """
+
+        # If the code has reached this point then there are still nodes to move, and the desired solution hasn't yet
+        # been attained. Nodes whose leases have expired are reissued first, otherwise use the next_movable_node method
+        # of the CURVE to get the index of the next movable node.
+        lease_id = self.next_lease_id
+        if self.reissue:
+            next_node_number = self.reissue.popleft()
+        else:
+            next_node_number = self.CURVE.next_movable_node()
+
+        # Otherwise, if allowed, speculate on the node closest to being movable.
+        if next_node_number is None and self.SPECULATIVE:
+            next_node_number = self.speculative_node()
             if next_node_number is not None:
-                logging.debug('Sending new node to Client.')
-                server_response = {'status_code': comm_code('SERVER_GIVES_NEW_TASK'),
-                                   'node_number': next_node_number,
-                                   'left_end_point': self.CURVE.get_points()[next_node_number - 1],
-                                   'right_end_point': self.CURVE.get_points()[next_node_number + 1]
-                                   }
-                client.send(server_response)
-                client_monitor[str(client_response['client_name'])] = [time.time(), next_node_number]
-            else:
-                logging.debug('No node available to move. Requesting callback.')
-                client.send({'status_code': comm_code('SERVER_REQUEST_CALLBACK')})
+                self.speculation_statistics['issued'] += 1
+                self.CURVE.reserve_node(next_node_number)
+                self.speculative_tasks[lease_id] = (next_node_number,
+                                                    np.copy(self.CURVE.get_points()[next_node_number - 1]),
+                                                    np.copy(self.CURVE.get_points()[next_node_number + 1]))
+
+        logging.debug('Next movable node: %s', next_node_number)
+
+        # Even if there are nodes that need to be tested, it may not be possible if it's neighbours are currently being
+        # tested, in which case the SimulationServer tells the client to try again later. Otherwise a new node is
+        # obtained and sent back to the client.
+        if next_node_number is not None:
+            logging.debug('Sending new node to Client.')
+            self.leases[lease_id] = [time.time() + self.TIMEOUT, next_node_number, str(client_name)]
+            self.next_lease_id += 1
+            task = {'status_code': comm_code('SERVER_GIVES_NEW_TASK'),
+                    'lease_id': lease_id,
+                    'node_number': next_node_number,
+                    'left_end_point': self.CURVE.get_points()[next_node_number - 1],
+                    'right_end_point': self.CURVE.get_points()[next_node_number + 1]
+                    }
+            if next_node_number in self.warm_starts:
+                task['warm_start'] = self.warm_starts[next_node_number]
+            if len(self.LEVELS) > 1:
+                task['level'] = self.level
+                task['local_number_of_nodes'] = self.LEVELS[self.level][1]
+                task['tolerance'] = self.LEVELS[self.level][2]
+            return task
+        else:
+            logging.debug('No node available to move. Requesting callback.')
+            return {'status_code': comm_code('SERVER_REQUEST_CALLBACK')}
 
-            # Close connection to client
-            client.close()
+    def refine_curve(self):
+        """ Move on to the next level of the multilevel scheme, interpolating the converged curve onto it.
 
-        # The computation has now been completed and the Listener is shut down.
-        logging.info('Shutting down Server.')
-        server.close()
+        """
+        self.level += 1
+        global_number_of_nodes, local_number_of_nodes, tolerance = self.LEVELS[self.level]
+        logging.info('Refining to level %d: %d global nodes, %d local nodes, tolerance %s.', self.level,
+                     global_number_of_nodes, local_number_of_nodes, tolerance)
+        self.CURVE = self.CURVE.interpolate(global_number_of_nodes,
+                                            global_number_of_nodes * (local_number_of_nodes - 1) + 1,
+                                            self.CONFIGURATION['scheduler'])
+        self.CURVE.configuration = self.CONFIGURATION
 
-        self.FINISHED = True
+        # Tasks still held by clients are for nodes of the previous curve, so their leases are ended and their results
+        # will be ignored, and the state kept for the previous nodes no longer applies.
+        self.leases.clear()
+        self.reissue.clear()
+        self.speculative_tasks.clear()
+        self.warm_starts.clear()
+
+    def speculative_node(self):
+        """ Choose a node to hand out speculatively.
+
+        Returns:
+          int: The node number of a node that hasn't moved since the nodes were last made movable and isn't held by
+          any SimulationClient, preferring nodes with a neighbour that has moved. None if there is no such node.
+
+        """
+        held = set(lease[1] for lease in self.leases.values()) | set(self.reissue)
+        candidates = [node for node in xrange(1, self.CURVE.number_of_nodes - 1)
+                      if not self.CURVE.node_moved(node) and node not in held]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda node: self.CURVE.node_moved(node - 1) + self.CURVE.node_moved(node + 1))
+
+    def speculation_valid(self, speculative_task):
+        """ Decide whether the result of a speculative task can be kept.
+
+        Args:
+          speculative_task (tuple) :
+              The node number, and the positions of its neighbours, when the task was handed out.
+
+        Returns:
+          bool: True if the node hasn't been moved since, and neither neighbour has moved by more than
+          SPECULATION_TOLERANCE.
+
+        """
+        node_number, left_end_point, right_end_point = speculative_task
+        points = self.CURVE.get_points()
+        return (not self.CURVE.node_moved(node_number) and
+                np.linalg.norm(points[node_number - 1] - left_end_point, ord=np.inf) <= self.SPECULATION_TOLERANCE and
+                np.linalg.norm(points[node_number + 1] - right_end_point, ord=np.inf) <= self.SPECULATION_TOLERANCE)
+
+    def time_until_expiry(self):
+        """ Compute how long until the earliest lease expires.
+
+        Returns:
+          float: The length of time in seconds, or None if no lease is held.
+
+        """
+        if not self.leases:
+            return None
+        return max(0.0, min(lease[0] for lease in self.leases.values()) - time.time())
+
+    def expire_leases(self):
+        """ End every lease that has expired, presuming the SimulationClient holding it dead, and queue its node to be
+        reissued.
+
+        """
+        now = time.time()
+        for lease_id, (expiry, node_number, client_name) in list(self.leases.items()):
+            if expiry <= now:
+                logging.warning('Lease %d on node %d held by %s has expired. Client presumed dead.', lease_id,
+                                node_number, client_name)
+                del self.leases[lease_id]
+
+                # Speculative tasks are simply dropped, as their nodes weren't movable, and their nodes released.
+                if self.speculative_tasks.pop(lease_id, None) is None:
+                    self.reissue.append(node_number)
+                else:
+                    self.CURVE.release_node(node_number)
 
     def save_simulation(self):
         """ Save the results of the simulation to a pickle file and XYZ animation.
@@ -23,7 +23,11 @@ def comm_code(label):
             'CLIENT_ASKS_FOR_VALUES': 6,
             'CLIENT_HEARTBEAT': 7,
             'KILL': 8,
-            'CLIENT_FIRST_CONTACT': 9
+            'CLIENT_FIRST_CONTACT': 9,
+            'CLIENT_OFFERS_SHARED_MEMORY': 10,
+            'SERVER_ACCEPTS_SHARED_MEMORY': 11,
+            'CLIENT_OFFERS_WIRE_FORMAT': 12,
+            'SERVER_ACCEPTS_WIRE_FORMAT': 13
     }
 
     # Try sending back the numeric value for the label inputted
@@ -51,6 +51,14 @@ def read_configuration_file(configuration_file):
 
     """
 
+    # Set the default values of the optional parameters.
+    optimiser = 'bfgs'
+    lbfgs_memory = 10
+    line_search = 'dcsrch'
+    line_search_steps = 4
+    scheduler = 'counter'
+    coarse_levels = []
+
     # Open the configuration_file in read mode.
     f = open(configuration_file, 'r')
 
@@ -97,6 +105,42 @@ def read_configuration_file(configuration_file):
             # The tolerance after which we stop running the global algorithm.
             tol = float(value)
 
+        elif command == 'op':
+            # The optimiser used to compute local geodesics, either 'bfgs' or the limited-memory 'lbfgs'.
+            optimiser = value.strip().lower()
+            if optimiser not in ('bfgs', 'lbfgs'):
+                raise ValueError('Unknown optimiser ' + optimiser + ' in ' + configuration_file + '.')
+
+        elif command == 'lm':
+            # The number of updates remembered by the limited-memory BFGS optimiser.
+            lbfgs_memory = int(value)
+
+        elif command == 'ls':
+            # The line search used by the optimiser, either 'dcsrch', which tries one step length at a time, or
+            # 'batched', which tries several at once.
+            line_search = value.strip().lower()
+            if line_search not in ('dcsrch', 'batched'):
+                raise ValueError('Unknown line search ' + line_search + ' in ' + configuration_file + '.')
+
+        elif command == 'lc':
+            # The number of step lengths tried at once by the batched line search.
+            line_search_steps = int(value)
+
+        elif command == 'sc':
+            # The strategy deciding the order in which the global nodes are moved.
+            scheduler = value.strip().lower()
+            if scheduler not in ('counter', 'red-black', 'priority'):
+                raise ValueError('Unknown scheduler ' + scheduler + ' in ' + configuration_file + '.')
+
+        elif command == 'ml':
+            # A coarse level of the multilevel scheme, given as the global number of nodes, the local number of nodes
+            # and the tolerance. The levels are converged in the order they are given, before the curve described by
+            # gn, ln and to.
+            level = value.strip().split(',')
+            if len(level) != 3:
+                raise ValueError('Levels in ' + configuration_file + ' must be given as gn, ln, to.')
+            coarse_levels.append((int(level[0]), int(level[1]), float(level[2])))
+
     # Return the dictionary.
     return {
         'start_point': start_point,
@@ -107,5 +151,11 @@ def read_configuration_file(configuration_file):
         'global_number_of_nodes': global_num_nodes,
         'metric_parameters': metric_parameters,
         'tolerance': tol,
+        'optimiser': optimiser,
+        'lbfgs_memory': lbfgs_memory,
+        'line_search': line_search,
+        'line_search_steps': line_search_steps,
+        'scheduler': scheduler,
+        'coarse_levels': coarse_levels,
         'molecule': molecule
     }
@@ -1,6 +1,8 @@
 import numpy as np
 from numpy import linalg as la
 
+from SimulationUtilities.Node_Scheduling import make_scheduler
+
 
 class Curve:
     """
@@ -14,15 +16,20 @@ class Curve:
       total_number_of_nodes (int): The total number of nodes in the curve, including local_nodes - only used to compute the correct scaling of the tangent vector.
       tangent (numpy.array): The tangent of the straight line segment joining the start_point to the end_point, rescaled according to [Sutton2013]_.
       points (numpy.array): An NumPy array containing all the points of the curve.
-      default_initial_state (numpy.array): A NumPy array consisting of flags that indicate which nodes are movable initially.
       movement (float): A variable which records the total movement of the curve as calculated in [Sutton2013]_.
-      nodes_moved (numpy.array): A binary NumPy array indicating whether a node has been moved. Used to determine when all the nodes in the curve have been moved.
-      node_movable (numpy.array): A binary NumPy array indicating whether a node is movable.
-      number_of_distinct_nodes_moved (int): A counter recording the total number of nodes that have moved.
+      scheduler: The object deciding the order in which the nodes are moved. See the Node_Scheduling module.
+      default_initial_state (numpy.array): Read only. Flags that indicate which nodes are movable initially, copied from
+        the scheduler.
+      nodes_moved (numpy.array): Read only. A binary NumPy array, one for each node that hasn't moved in the current
+        sweep and zero otherwise.
+      node_movable (numpy.array): Read only. An integer NumPy array, greater than one for each node that is movable,
+        copied from the scheduler.
+      number_of_distinct_nodes_moved (int): Read only. The sum of nodes_moved, that is the number of nodes, including
+        the start and end points, yet to move in the current sweep.
       configuration (dict): A dictionary containing the information from the configuration file.
 
     """
-    def __init__(self, start_point, end_point, number_of_nodes, total_number_of_nodes):
+    def __init__(self, start_point, end_point, number_of_nodes, total_number_of_nodes, scheduler='counter'):
         """The constructor for the Curve class.
 
         Note:
@@ -33,6 +40,7 @@ class Curve:
           end_point (numpy.array): A NumPy array describing the last point in the curve.
           number_of_nodes (int): The total number of nodes that the curve is to consist of, including the start and end points.
           total_number_of_nodes (int): The total number of nodes in the curve, including local_nodes - only used to compute the correct scaling of the tangent vector.
+          scheduler (str, optional): The name of the strategy deciding the order in which the nodes are moved, one of 'counter', 'red-black' or 'priority'.
         """
 
         # Pass the initialiser arguments directly into the class attributes
@@ -50,33 +58,48 @@ class Curve:
             self.points = np.concatenate((self.points, [np.add(self.points[i], self.tangent)]), axis=0)
         np.concatenate((self.points, [self.end_point]), axis=0)
 
-        # Create and definite initial node_movable configuration. In this case even numbered nodes first.
-        self.default_initial_state = np.zeros(self.number_of_nodes, dtype='int')
-        for i in xrange(self.number_of_nodes-1):
-            if i % 2 != 0:
-                self.default_initial_state[i] = 2
-
-        # Create all of the flags in the curve to indicate that the nodes in default_initial_state are movable.
+        # Create the scheduler, which starts with the first sweep of the nodes.
         self.movement = 0.0
-        self.nodes_moved = np.ones(self.number_of_nodes, dtype='int')
-        self.node_movable = np.copy(self.default_initial_state)
-        self.number_of_distinct_nodes_moved = 0
+        self.scheduler = make_scheduler(scheduler, self.number_of_nodes)
 
         # Create the attribute to store the simulation configuration.
         self.configuration = {}
 
-    def set_node_movable(self):
-        """ Resets all of the flags in the curve to indicate that the nodes in default_initial_state are movable.
+    @property
+    def default_initial_state(self):
+        """ The flags indicating which nodes are movable at the start of a sweep.
 
-        Arguments:
-            node_number (int): The node number of the node whose position is to be updated.
-            new_position (numpy.array): The new position of the node.
+        """
+        return np.copy(self.scheduler.default_initial_state)
+
+    @property
+    def nodes_moved(self):
+        """ One for each node that hasn't moved in the current sweep, zero otherwise.
+
+        """
+        return np.array([not self.scheduler.is_moved(node_number) for node_number in xrange(self.number_of_nodes)],
+                        dtype='int')
+
+    @property
+    def node_movable(self):
+        """ The counters of the scheduler, greater than one for each movable node.
+
+        """
+        return np.copy(self.scheduler.node_movable)
+
+    @property
+    def number_of_distinct_nodes_moved(self):
+        """ The number of nodes, including the start and end points, yet to move in the current sweep.
+
+        """
+        return int(np.sum(self.nodes_moved))
+
+    def set_node_movable(self):
+        """ Start a new sweep of the curve, in which every node is to be moved once.
 
         """
         self.movement = 0.0
-        self.nodes_moved = np.ones(self.number_of_nodes, dtype='int')
-        self.node_movable = np.copy(self.default_initial_state)
-        self.number_of_distinct_nodes_moved = 0
+        self.scheduler.reset()
 
     def set_node_position(self, node_number, new_position):
         """ Update the position of the node at node_number to new_position. This processes the logic for releasing
@@ -89,26 +112,13 @@ class Curve:
         """
 
         # Arithmetic to measure the total movement of a curve
-        self.movement += float(1/float(self.number_of_nodes)) * \
-            np.linalg.norm(np.subtract(new_position, self.points[node_number]), ord=np.inf)
+        displacement = np.linalg.norm(np.subtract(new_position, self.points[node_number]), ord=np.inf)
+        self.movement += float(1/float(self.number_of_nodes)) * displacement
         # Update position of node with new position assumes new_position is float64 numpy array
         self.points[node_number] = new_position
 
-        # Arithmetic for determining if an existing nodes neighbours have been moved
-        self.node_movable[node_number-1] += 1
-        self.node_movable[node_number+1] += 1
-        self.node_movable[0] = 0
-        self.node_movable[-1] = 0
-        if node_number == 2:
-            self.node_movable[1] += 1
-            self.node_movable[0] = 0
-        if node_number == self.number_of_nodes-3:
-            self.node_movable[-2] += 1
-            self.node_movable[-1] = 0
-
-        # Arithmetic to keep track of how many nodes have been moved distinctly
-        self.nodes_moved[node_number] = 0
-        self.number_of_distinct_nodes_moved = sum(self.nodes_moved)
+        # Let the scheduler release any nodes that were waiting on this one.
+        self.scheduler.node_moved(node_number, displacement)
 
     def next_movable_node(self):
         """ Determine next movable node, given existing information about previously distributed nodes.
@@ -117,36 +127,64 @@ class Curve:
             int: The node number of the next movable node. If no such node exists then it returns None.
 
         """
+        return self.scheduler.next_node()
 
-        # This will get quicker with NumPy 2.0.0 - https://github.com/numpy/numpy/issues/2269
-        try:
-            # Determine the node number of the next movable node in the next_movable_node array. This particular test
-            # attempts to find a node that has not been previously moved.
-            next_movable_node = np.where(np.multiply(self.node_movable, self.nodes_moved) > 1)[0][0]
+    def node_moved(self, node_number):
+        """ Determine whether a node has been moved in the current sweep.
 
-            # If there is no node available that hasn't been previously moved then...
-            if next_movable_node is None:
+        Arguments:
+            node_number (int): The node number of the node.
 
-                # Simply find a node that is movable. This time we include previously moved nodes in our search
-                next_movable_node = np.where(self.node_movable > 1)[0][0]
+        Returns:
+            bool: True if the node has been moved, False otherwise.
+
+        """
+        return self.scheduler.is_moved(node_number)
+
+    def reserve_node(self, node_number):
+        """ Prevent a node being issued by next_movable_node while it is moved speculatively.
+
+        Arguments:
+            node_number (int): The node number of the node.
+
+        """
+        self.scheduler.reserve(node_number)
+
+    def release_node(self, node_number):
+        """ End the reservation of a node, allowing it to be issued again if it hasn't moved.
 
-            # If we still couldn't find a node...
-            if next_movable_node is None:
+        Arguments:
+            node_number (int): The node number of the node.
 
-                # Return None
-                return None
+        """
+        self.scheduler.release(node_number)
 
-            # Otherwise...
-            else:
+    def interpolate(self, number_of_nodes, total_number_of_nodes, scheduler='counter'):
+        """ Create a new curve with a different number of nodes, lying along this one.
 
-                # Mark the node as no longer movable to prevent it being re-issued.
-                self.node_movable[next_movable_node] = 0
+        Note:
+          Each node of the new curve is placed at the same fraction of the way along the nodes of this curve, by linear
+          interpolation between the two nodes either side of it. The start and end points are unchanged.
+
+        Arguments:
+            number_of_nodes (int): The total number of nodes of the new curve, including the start and end points.
+            total_number_of_nodes (int): The total number of nodes in the new curve, including local_nodes.
+            scheduler (str, optional): The name of the strategy deciding the order in which the nodes of the new curve
+              are moved.
+
+        Returns:
+            Curve: The new curve, whose first sweep is yet to start.
+
+        """
+        curve = Curve(self.start_point, self.end_point, number_of_nodes, total_number_of_nodes, scheduler)
 
-                # Return the node number
-                return next_movable_node
+        # Find, for each new node, the position along this curve measured in nodes.
+        positions = np.linspace(0.0, self.number_of_nodes - 1, curve.number_of_nodes)
+        lower = np.minimum(np.floor(positions).astype(int), self.number_of_nodes - 2)
+        fractions = (positions - lower)[:, np.newaxis]
+        curve.points = (1 - fractions) * self.points[lower] + fractions * self.points[lower + 1]
 
-        except IndexError:
-            return None
+        return curve
 
     def get_points(self):
         """ Accessor method for the points attribute.
@@ -164,7 +202,4 @@ class Curve:
           bool: True if all of the nodes have been tested, False otherwise.
 
         """
-        if self.number_of_distinct_nodes_moved == 2:
-            return True
-        else:
-            return False
\ No newline at end of file
+        return self.scheduler.all_nodes_moved()
\ No newline at end of file
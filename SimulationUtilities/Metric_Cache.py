@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+
+
+class MetricCache:
+    """
+
+    The purpose of this object is to remember the metric values, and the forces used to compute their gradients, at
+    recently visited configurations so that they are not computed again. The end points of a local geodesic are
+    evaluated on every iteration of the BFGS method, and the global nodes are the end points of neighbouring local
+    geodesics, so the same configurations are requested many times.
+
+    Configurations are identified by a hash of their co-ordinates rounded to a multiple of QUANTUM, and at most CAPACITY
+    configurations are remembered, the least recently used being forgotten first.
+
+    Attributes:
+      CAPACITY (int) :
+          The largest number of configurations remembered.
+      QUANTUM (float) :
+          Configurations whose co-ordinates all round to the same multiple of QUANTUM share their values.
+      hits (int) :
+          The number of lookups that found a remembered configuration.
+      misses (int) :
+          The number of lookups that did not.
+      evictions (int) :
+          The number of configurations forgotten to make room for others.
+
+    """
+    def __init__(self, capacity=1024, quantum=1e-9):
+        """The constructor for the MetricCache class.
+
+        Args:
+          capacity (int, optional) :
+              The largest number of configurations remembered.
+          quantum (float, optional) :
+              The precision to which configurations are compared.
+
+        """
+        self.CAPACITY = capacity
+        self.QUANTUM = quantum
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, point):
+        """ Compute the key identifying a configuration.
+
+        Args:
+          point (numpy.array): The configuration.
+
+        Returns:
+          str: A hash of the quantized co-ordinates of point.
+
+        """
+        quantized = np.round(np.asarray(point, dtype='float64') / self.QUANTUM).astype(np.int64)
+        return hashlib.sha1(quantized.tostring()).digest()
+
+    def get(self, point):
+        """ Look up the values remembered for a configuration, marking it as recently used.
+
+        Args:
+          point (numpy.array): The configuration.
+
+        Returns:
+          The values stored for the configuration, or None if it isn't remembered.
+
+        """
+        key = self.key(point)
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = value
+        return value
+
+    def put(self, point, value):
+        """ Remember the values at a configuration, forgetting the least recently used configuration if full.
+
+        Args:
+          point (numpy.array): The configuration.
+          value: The values to remember, which must not be None.
+
+        """
+        if self.CAPACITY <= 0:
+            return
+        key = self.key(point)
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.CAPACITY:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def statistics(self):
+        """ Summarise the use of the cache for the log.
+
+        Returns:
+          str: The numbers of hits, misses and evictions and the hit rate.
+
+        """
+        lookups = self.hits + self.misses
+        return '%d hits, %d misses (%.1f%% hit rate), %d evictions' % (self.hits, self.misses,
+                                                                      100.0 * self.hits / max(lookups, 1),
+                                                                      self.evictions)
@@ -0,0 +1,404 @@
+from collections import deque
+import heapq
+
+import numpy as np
+
+
+class CounterScheduler:
+    """
+
+    The purpose of this object is to decide the order in which the nodes of a Curve are moved, using the scheme
+    described in [Sutton2013]_. Initially the odd numbered nodes are movable, and every node that moves increments a
+    counter on each of its neighbours. A node becomes movable once its counter reaches two, that is once both of its
+    neighbours have moved, and each node is moved at most once per sweep. Of the movable nodes the lowest numbered is
+    issued first.
+
+    The movable nodes are kept in a heap, so the next node is found in O(log n) time rather than by a search of every
+    node.
+
+    Attributes:
+      number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+      default_initial_state (numpy.array): The counters at the start of a sweep.
+      node_movable (numpy.array): The counter of each node.
+      nodes_moved (numpy.array): One for each node that hasn't moved in the current sweep, zero otherwise.
+      number_of_unmoved_nodes (int): The number of nodes, including the start and end points, yet to move this sweep.
+      movable (list): A heap of nodes that were movable when they were added. Nodes that have since been issued, moved
+        or reserved are discarded when they reach the top.
+      reserved (set): The nodes being moved speculatively, which mustn't be issued.
+
+    """
+    def __init__(self, number_of_nodes):
+        """The constructor for the CounterScheduler class.
+
+        Args:
+          number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+
+        """
+        self.number_of_nodes = number_of_nodes
+
+        # Even numbered nodes first, which in the numbering of the curve are the odd node numbers.
+        self.default_initial_state = np.zeros(number_of_nodes, dtype='int')
+        for i in xrange(number_of_nodes - 1):
+            if i % 2 != 0:
+                self.default_initial_state[i] = 2
+
+        self.reserved = set()
+        self.reset()
+
+    def reset(self):
+        """ Start a new sweep, in which every node is to be moved once.
+
+        """
+        self.node_movable = np.copy(self.default_initial_state)
+        self.nodes_moved = np.ones(self.number_of_nodes, dtype='int')
+        self.number_of_unmoved_nodes = self.number_of_nodes
+        self.movable = [node for node in xrange(self.number_of_nodes) if self.is_movable(node)]
+
+    def is_movable(self, node_number):
+        """ Determine whether a node may be issued.
+
+        """
+        return self.node_movable[node_number] * self.nodes_moved[node_number] > 1
+
+    def next_node(self):
+        """ Issue the next movable node.
+
+        Returns:
+          int: The node number of the next movable node, or None if no node is movable.
+
+        """
+        while self.movable:
+            node_number = heapq.heappop(self.movable)
+            if self.is_movable(node_number) and node_number not in self.reserved:
+                # Mark the node as no longer movable to prevent it being re-issued.
+                self.node_movable[node_number] = 0
+                return node_number
+        return None
+
+    def node_moved(self, node_number, displacement):
+        """ Record that a node has moved, releasing its neighbours where they are now movable.
+
+        Args:
+          node_number (int): The node number of the node that has moved.
+          displacement (float): The distance the node moved.
+
+        """
+        # A node only counts towards its neighbours the first time it moves in a sweep.
+        if not self.nodes_moved[node_number]:
+            return
+
+        neighbours = [node_number - 1, node_number + 1]
+
+        # The nodes next to the start and end points only have one neighbour that moves, so count it twice.
+        if node_number == 2:
+            neighbours.append(1)
+        if node_number == self.number_of_nodes - 3:
+            neighbours.append(self.number_of_nodes - 2)
+
+        for neighbour in neighbours:
+            self.node_movable[neighbour] += 1
+        self.node_movable[0] = 0
+        self.node_movable[-1] = 0
+
+        self.nodes_moved[node_number] = 0
+        self.number_of_unmoved_nodes -= 1
+
+        for neighbour in neighbours:
+            if self.is_movable(neighbour):
+                heapq.heappush(self.movable, neighbour)
+
+    def reserve(self, node_number):
+        """ Prevent a node being issued while it is moved speculatively.
+
+        """
+        self.reserved.add(node_number)
+
+    def release(self, node_number):
+        """ Allow a reserved node to be issued again, if it is movable.
+
+        """
+        self.reserved.discard(node_number)
+        if self.is_movable(node_number):
+            heapq.heappush(self.movable, node_number)
+
+    def is_moved(self, node_number):
+        """ Determine whether a node has moved in the current sweep.
+
+        """
+        return not self.nodes_moved[node_number]
+
+    def all_nodes_moved(self):
+        """ Determine whether every node, other than the start and end points, has moved in the current sweep.
+
+        """
+        return self.number_of_unmoved_nodes == 2
+
+
+class RedBlackScheduler:
+    """
+
+    The purpose of this object is to move the nodes of a Curve in a strict red-black order. Every sweep the odd numbered
+    (red) nodes are issued first, and the even numbered (black) nodes are only issued once every red node has moved.
+    No two neighbouring nodes are ever moved at the same time, and each colour is moved against the same positions of
+    the other colour whatever order the results arrive in.
+
+    Attributes:
+      number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+      default_initial_state (numpy.array): Two for each node that may be issued at the start of a sweep, that is each
+        red node, and zero otherwise.
+      colours (list): The node numbers of the red nodes and of the black nodes.
+      colour (int): The index in colours of the colour being issued.
+      queue (deque): The nodes of the current colour that are yet to be issued.
+      outstanding (set): The nodes of the current colour that have been issued but haven't moved.
+      reserved (set): The nodes being moved speculatively, which mustn't be issued. The black nodes aren't issued while
+        a red node is reserved.
+      moved (numpy.array): Whether each node has moved in the current sweep.
+      number_of_moved_nodes (int): The number of nodes that have moved in the current sweep.
+
+    """
+    def __init__(self, number_of_nodes):
+        """The constructor for the RedBlackScheduler class.
+
+        Args:
+          number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+
+        """
+        self.number_of_nodes = number_of_nodes
+        self.colours = [range(1, number_of_nodes - 1, 2), range(2, number_of_nodes - 1, 2)]
+        self.default_initial_state = np.zeros(number_of_nodes, dtype='int')
+        self.default_initial_state[self.colours[0]] = 2
+        self.reserved = set()
+        self.reset()
+
+    def reset(self):
+        """ Start a new sweep, in which every node is to be moved once.
+
+        """
+        self.colour = 0
+        self.queue = deque(self.colours[0])
+        self.outstanding = set()
+        self.moved = np.zeros(self.number_of_nodes, dtype='bool')
+        self.number_of_moved_nodes = 0
+
+    def next_node(self):
+        """ Issue the next node of the current colour, moving on to the black nodes once every red node has moved.
+
+        Returns:
+          int: The node number of the next node, or None if no node can be issued yet.
+
+        """
+        if (self.colour == 0 and not self.queue and not self.outstanding and
+                not any(node_number % 2 for node_number in self.reserved)):
+            self.colour = 1
+            self.queue = deque(self.colours[1])
+
+        # Skip any nodes that have already been moved, for example by the result of a speculative task, or have already
+        # been issued. Reserved nodes are put back in the queue when they are released.
+        while self.queue:
+            node_number = self.queue.popleft()
+            if not (self.moved[node_number] or node_number in self.outstanding or node_number in self.reserved):
+                self.outstanding.add(node_number)
+                return node_number
+        return None
+
+    def node_moved(self, node_number, displacement):
+        """ Record that a node has moved.
+
+        Args:
+          node_number (int): The node number of the node that has moved.
+          displacement (float): The distance the node moved.
+
+        """
+        self.outstanding.discard(node_number)
+        if not self.moved[node_number]:
+            self.moved[node_number] = True
+            self.number_of_moved_nodes += 1
+
+    @property
+    def node_movable(self):
+        """ Two for each node of the current colour that may be issued, and zero otherwise, in the form of the counters
+        of a CounterScheduler.
+
+        """
+        node_movable = np.zeros(self.number_of_nodes, dtype='int')
+        for node_number in self.queue:
+            if not (self.moved[node_number] or node_number in self.outstanding or node_number in self.reserved):
+                node_movable[node_number] = 2
+        return node_movable
+
+    def reserve(self, node_number):
+        """ Prevent a node being issued while it is moved speculatively.
+
+        """
+        self.reserved.add(node_number)
+
+    def release(self, node_number):
+        """ Allow a reserved node to be issued again, if it hasn't moved. Black nodes released while the red nodes are
+        being issued wait for the black nodes to be queued.
+
+        """
+        self.reserved.discard(node_number)
+        if not self.moved[node_number] and (self.colour == 1 or node_number % 2):
+            self.queue.append(node_number)
+
+    def is_moved(self, node_number):
+        """ Determine whether a node has moved in the current sweep.
+
+        """
+        return bool(self.moved[node_number])
+
+    def all_nodes_moved(self):
+        """ Determine whether every node, other than the start and end points, has moved in the current sweep.
+
+        """
+        return self.number_of_moved_nodes == self.number_of_nodes - 2
+
+
+class PriorityScheduler:
+    """
+
+    The purpose of this object is to move the nodes of a Curve that moved furthest last time first, as those are where
+    the curve is furthest from a geodesic. Every node is moved once per sweep, before the first sweep the nodes are
+    taken in order, and a node is never issued while one of its neighbours is being moved.
+
+    The nodes are kept in a heap ordered by their last displacement. A node found to have a neighbour being moved is
+    put aside until that neighbour moves, so the next node is found in O(log n) amortised time.
+
+    Attributes:
+      number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+      default_initial_state (numpy.array): Two for each node that may be issued at the start of a sweep, that is every
+        node other than the start and end points, and zero otherwise.
+      displacement (numpy.array): The distance each node moved the last time it was moved.
+      heap (list): A heap of (-displacement, node number) pairs for the nodes yet to be issued.
+      blocked (dict): The nodes put aside, indexed by the neighbour they are waiting on.
+      issued (set): The nodes that have been issued but haven't moved.
+      reserved (set): The nodes being moved speculatively, which mustn't be issued.
+      moved (numpy.array): Whether each node has moved in the current sweep.
+      number_of_moved_nodes (int): The number of nodes that have moved in the current sweep.
+
+    """
+    def __init__(self, number_of_nodes):
+        """The constructor for the PriorityScheduler class.
+
+        Args:
+          number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+
+        """
+        self.number_of_nodes = number_of_nodes
+        self.displacement = np.empty(number_of_nodes)
+        self.displacement.fill(np.inf)
+        self.default_initial_state = np.zeros(number_of_nodes, dtype='int')
+        self.default_initial_state[1:-1] = 2
+        self.reserved = set()
+        self.reset()
+
+    def reset(self):
+        """ Start a new sweep, in which every node is to be moved once.
+
+        """
+        self.heap = [(-self.displacement[node_number], node_number)
+                     for node_number in xrange(1, self.number_of_nodes - 1)]
+        heapq.heapify(self.heap)
+        self.blocked = {}
+        self.issued = set()
+        self.moved = np.zeros(self.number_of_nodes, dtype='bool')
+        self.number_of_moved_nodes = 0
+
+    def next_node(self):
+        """ Issue the node with the largest last displacement that has no neighbour being moved.
+
+        Returns:
+          int: The node number of the next node, or None if no node can be issued yet.
+
+        """
+        while self.heap:
+            node_number = heapq.heappop(self.heap)[1]
+            if self.moved[node_number] or node_number in self.issued or node_number in self.reserved:
+                continue
+            if node_number - 1 in self.issued:
+                self.blocked.setdefault(node_number - 1, []).append(node_number)
+            elif node_number + 1 in self.issued:
+                self.blocked.setdefault(node_number + 1, []).append(node_number)
+            else:
+                self.issued.add(node_number)
+                return node_number
+        return None
+
+    def node_moved(self, node_number, displacement):
+        """ Record that a node has moved, returning any nodes waiting on it to the heap.
+
+        Args:
+          node_number (int): The node number of the node that has moved.
+          displacement (float): The distance the node moved.
+
+        """
+        self.displacement[node_number] = displacement
+        self.issued.discard(node_number)
+        if not self.moved[node_number]:
+            self.moved[node_number] = True
+            self.number_of_moved_nodes += 1
+        for waiting in self.blocked.pop(node_number, []):
+            heapq.heappush(self.heap, (-self.displacement[waiting], waiting))
+
+    @property
+    def node_movable(self):
+        """ Two for each node that may be issued, that is each node yet to move that isn't being moved, reserved or next
+        to a node being moved, and zero otherwise, in the form of the counters of a CounterScheduler.
+
+        """
+        node_movable = np.copy(self.default_initial_state)
+        node_movable[self.moved] = 0
+        for node_number in self.issued:
+            node_movable[node_number - 1:node_number + 2] = 0
+        for node_number in self.reserved:
+            node_movable[node_number] = 0
+        return node_movable
+
+    def reserve(self, node_number):
+        """ Prevent a node being issued while it is moved speculatively.
+
+        """
+        self.reserved.add(node_number)
+
+    def release(self, node_number):
+        """ Allow a reserved node to be issued again, if it hasn't moved.
+
+        """
+        self.reserved.discard(node_number)
+        if not self.moved[node_number]:
+            heapq.heappush(self.heap, (-self.displacement[node_number], node_number))
+
+    def is_moved(self, node_number):
+        """ Determine whether a node has moved in the current sweep.
+
+        """
+        return bool(self.moved[node_number])
+
+    def all_nodes_moved(self):
+        """ Determine whether every node, other than the start and end points, has moved in the current sweep.
+
+        """
+        return self.number_of_moved_nodes == self.number_of_nodes - 2
+
+
+# The scheduling strategies, by the name used in configuration files.
+SCHEDULERS = {'counter': CounterScheduler,
+              'red-black': RedBlackScheduler,
+              'priority': PriorityScheduler}
+
+
+def make_scheduler(name, number_of_nodes):
+    """ Create the scheduler for a curve.
+
+    Args:
+      name (str): The name of the scheduling strategy, one of the keys of SCHEDULERS.
+      number_of_nodes (int): The total number of nodes in the curve, including the start and end points.
+
+    Returns:
+      The scheduler.
+
+    """
+    try:
+        return SCHEDULERS[name](number_of_nodes)
+    except KeyError:
+        raise ValueError('Unknown scheduler ' + str(name) + '.')
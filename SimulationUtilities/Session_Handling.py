@@ -0,0 +1,356 @@
+from multiprocessing.connection import Listener, address_type
+from collections import deque
+import threading
+import logging
+import select
+import socket
+import struct
+import errno
+import os
+
+# The non-blocking flag is set directly where fcntl is available, otherwise through a duplicate of the socket.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from SimulationUtilities import Wire_Format
+from SimulationUtilities.Communication_Codes import comm_code
+
+
+class SessionListener:
+    """
+
+    The purpose of this object is to hold many long-lived connections open at the same time and to multiplex the
+    messages arriving on them. Incoming connections, including the authentication handshake, are accepted on a
+    background thread so that the owner of the object only ever deals with established sessions.
+
+    Once a session is established its socket is switched to non-blocking mode and all further traffic is handled by an
+    event loop built on select.poll. Messages use the same framing as the Connection objects provided by the
+    multiprocessing package (a four byte length followed by a pickle) so that clients are unaffected, but partially
+    received messages are buffered rather than waited for and replies to slow readers are queued rather than blocking.
+    One slow session therefore never holds up any of the others. The event loop reads and writes the sockets through
+    their file descriptors and is woken up through a pipe, so it needs a POSIX platform.
+
+    A client may offer to use the binary message format of the Wire_Format module as soon as it connects. The offer is
+    answered by the SessionListener itself, and replies on the session are then sent in the agreed format.
+
+    Attributes:
+      ADDRESS (str, int) :
+          A tuple containing a string representing the hostname/IP and an integer for the service port.
+      SESSIONS (list) :
+          A list containing the Connection objects of every open session.
+      WIRE_FORMATS :
+          The versions of the binary message format the SessionListener will agree to.
+
+    """
+    def __init__(self, address, authkey=None, backlog=5, wire_formats=Wire_Format.SUPPORTED_VERSIONS):
+        """The constructor for the SessionListener class.
+
+        Args:
+          address (str, int) :
+              A tuple containing a string representing the hostname/IP and an integer for the service port.
+          authkey (str, optional) :
+              Authentication key used to secure process communications.
+          backlog (int, optional) :
+              The number of connections that may wait to be accepted. As sessions are long-lived this is only relevant
+              while clients are starting up.
+          wire_formats (optional) :
+              The versions of the binary message format to agree to. If empty then replies are always pickled.
+
+        """
+
+        # Set up the listener for communication at address.
+        self.ADDRESS = address
+        self.LISTENER = Listener(address, authkey=authkey, backlog=backlog)
+
+        # Initialise the list of established sessions and a thread-safe queue of freshly accepted sessions.
+        self.SESSIONS = []
+        self.accepted_sessions = deque()
+
+        # Initialise the maps between sessions and their file descriptors, along with the per-session buffers, indexed
+        # by file descriptor, for partially received and unsent data.
+        self.session_of = {}
+        self.descriptor_of = {}
+        self.inbound = {}
+        self.outbound = {}
+
+        # Initialise the map between sessions and the version of the binary message format agreed for them.
+        self.WIRE_FORMATS = wire_formats
+        self.wire_format = {}
+
+        # Create a pipe the accepting thread uses to wake up a poll that is blocked waiting for messages.
+        self.wakeup_read, self.wakeup_write = os.pipe()
+
+        # Use poll where it is available as, unlike select, its cost does not depend on the largest file descriptor
+        # and it has no limit on the number of sessions.
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+            self.poller.register(self.wakeup_read, select.POLLIN)
+        else:
+            self.poller = None
+
+        # Start accepting connections in the background.
+        self.accepting = True
+        self.accept_thread = threading.Thread(target=self.accept_sessions)
+        self.accept_thread.daemon = True
+        self.accept_thread.start()
+
+    def accept_sessions(self):
+        """ Accept incoming connections until the SessionListener is closed. This runs on a background thread.
+
+        """
+        while self.accepting:
+            try:
+                session = self.LISTENER.accept()
+            # A client that fails the handshake is simply ignored.
+            except Exception:
+                if self.accepting:
+                    logging.warning('Failed to establish session on %s.', str(self.ADDRESS))
+                continue
+
+            # If the SessionListener was closed whilst waiting then throw the connection away.
+            if not self.accepting:
+                session.close()
+                break
+
+            logging.debug('Session established from %s.', self.LISTENER.last_accepted)
+
+            # Hand the session over to the polling thread and wake it up.
+            self.accepted_sessions.append(session)
+            try:
+                os.write(self.wakeup_write, b'.')
+            except OSError:
+                break
+
+    def open_session(self, session):
+        """ Start handling traffic for a freshly accepted session.
+
+        Args:
+          session (Connection) :
+              The session returned by the listener after a successful handshake.
+
+        """
+        fd = session.fileno()
+
+        # From now on the socket is only read and written by the event loop, never by the Connection object itself.
+        # Without fcntl a duplicate socket, of the same family as the listener, shares the non-blocking flag with the
+        # session's own descriptor.
+        if fcntl is not None:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        else:
+            duplicate = socket.fromfd(fd, getattr(socket, address_type(self.ADDRESS)), socket.SOCK_STREAM)
+            duplicate.setblocking(False)
+            duplicate.close()
+
+        self.SESSIONS.append(session)
+        self.session_of[fd] = session
+        self.descriptor_of[session] = fd
+        self.inbound[fd] = bytearray()
+        self.outbound[fd] = bytearray()
+
+        if self.poller is not None:
+            self.poller.register(fd, select.POLLIN)
+
+    def wait(self, timeout):
+        """ Wait until a session can be read from or written to.
+
+        Args:
+          timeout (float) :
+              The maximum length of time in seconds to wait. If None then wait indefinitely.
+
+        Returns:
+          (list, list): The file descriptors that are ready to be read and those that are ready to be written.
+
+        """
+        if self.poller is not None:
+            try:
+                events = self.poller.poll(None if timeout is None else int(1000 * timeout))
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                return [], []
+            readable = [fd for fd, event in events if event & (select.POLLIN | select.POLLHUP | select.POLLERR)]
+            writable = [fd for fd, event in events if event & select.POLLOUT]
+            return readable, writable
+
+        pending = [fd for fd in self.outbound if self.outbound[fd]]
+        readable, writable = select.select(list(self.session_of) + [self.wakeup_read], pending, [], timeout)[:2]
+        return readable, writable
+
+    def poll(self, timeout=None):
+        """ Wait for messages to arrive on any of the open sessions.
+
+        Args:
+          timeout (float, optional) :
+              The maximum length of time in seconds to wait for a message. If None then wait indefinitely.
+
+        Returns:
+          list: A list of (Connection, message) tuples, one for each complete message received. Sessions closed by the
+          client are removed from SESSIONS and do not appear in the list.
+
+        """
+        readable, writable = self.wait(timeout)
+
+        # Continue sending any replies that did not fit in the socket buffer.
+        for fd in writable:
+            if fd in self.session_of:
+                self.flush(fd)
+
+        # Move freshly accepted sessions into the list of established sessions.
+        if self.wakeup_read in readable:
+            os.read(self.wakeup_read, 4096)
+            readable.remove(self.wakeup_read)
+            while self.accepted_sessions:
+                self.open_session(self.accepted_sessions.popleft())
+
+        # Read whatever has arrived on each readable session and extract every complete message.
+        messages = []
+        for fd in readable:
+            if fd not in self.session_of:
+                continue
+            session = self.session_of[fd]
+            session_open = self.fill(fd)
+            buffer = self.inbound[fd]
+            while len(buffer) >= 4:
+                length = struct.unpack('!i', bytes(buffer[:4]))[0]
+                if len(buffer) < 4 + length:
+                    break
+                message = Wire_Format.loads(bytes(buffer[4:4 + length]))
+                del buffer[:4 + length]
+
+                # Offers of the binary message format are answered here rather than passed on.
+                if message['status_code'] == comm_code('CLIENT_OFFERS_WIRE_FORMAT'):
+                    reply = Wire_Format.choose_version(message, self.WIRE_FORMATS)
+                    self.send(session, reply)
+                    self.wire_format[session] = reply['version']
+                else:
+                    messages.append((session, message))
+
+            # Messages sent just before the client closed the session are still delivered.
+            if not session_open:
+                self.close_session(session)
+
+        return messages
+
+    def fill(self, fd):
+        """ Read everything currently available on a session into its inbound buffer.
+
+        Args:
+          fd (int) :
+              The file descriptor of the session.
+
+        Returns:
+          bool: False if the client has closed the session, True otherwise.
+
+        """
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return True
+                return False
+            if not data:
+                return False
+            self.inbound[fd].extend(data)
+            if len(data) < 65536:
+                return True
+
+    def flush(self, fd):
+        """ Write as much of a session's outbound buffer as the socket will accept without blocking.
+
+        Args:
+          fd (int) :
+              The file descriptor of the session.
+
+        Returns:
+          bool: False if the client has gone away, True otherwise.
+
+        """
+        buffer = self.outbound[fd]
+        while buffer:
+            try:
+                sent = os.write(fd, bytes(buffer[:1048576]))
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                self.close_session(self.session_of[fd])
+                return False
+            del buffer[:sent]
+
+        # Only ask to be told about writability while there is something left to write.
+        if self.poller is not None:
+            self.poller.modify(fd, select.POLLIN | select.POLLOUT if buffer else select.POLLIN)
+        return True
+
+    def send(self, session, message):
+        """ Send a message back along a session. The message is queued if it cannot be sent immediately, and if the
+        client has gone away then the session is closed.
+
+        Args:
+          session (Connection) :
+              The session, as returned by poll, to reply on.
+          message :
+              A picklable object to send. It is sent in the binary message format if one has been agreed for the session
+              and the message can be represented in it.
+
+        Returns:
+          bool: True if the message was sent or queued, False otherwise.
+
+        """
+        # Sessions that have already been closed are identified by the object rather than by its file descriptor, as the
+        # descriptor may since have been reused by a newer session.
+        fd = self.descriptor_of.get(session)
+        if fd is None:
+            return False
+        data = Wire_Format.dumps(message, self.wire_format.get(session))
+        self.outbound[fd].extend(struct.pack('!i', len(data)) + data)
+        return self.flush(fd)
+
+    def close_session(self, session):
+        """ Close a session and stop listening to it.
+
+        Args:
+          session (Connection) :
+              The session to close.
+
+        """
+        fd = self.descriptor_of.pop(session, None)
+        if fd is not None:
+            if self.poller is not None:
+                self.poller.unregister(fd)
+            del self.session_of[fd]
+            del self.inbound[fd]
+            del self.outbound[fd]
+            self.wire_format.pop(session, None)
+            self.SESSIONS.remove(session)
+        session.close()
+
+    def close(self):
+        """ Close every session and stop accepting new connections.
+
+        """
+
+        # Stop the accepting thread, connecting to the listener to release it from a blocking accept. The address the
+        # listener is bound to is used, as it differs from ADDRESS if port 0 was asked for. The thread is waited for so
+        # that it isn't left handling the connection when the interpreter exits.
+        self.accepting = False
+        try:
+            wakeup = socket.socket(getattr(socket, address_type(self.LISTENER.address)), socket.SOCK_STREAM)
+            wakeup.settimeout(1.0)
+            wakeup.connect(self.LISTENER.address)
+            wakeup.close()
+        except (IOError, socket.error):
+            pass
+        self.accept_thread.join(1.0)
+        self.LISTENER.close()
+
+        # Close every open session, including any that were accepted but never polled.
+        while self.accepted_sessions:
+            self.accepted_sessions.popleft().close()
+        for session in list(self.SESSIONS):
+            self.close_session(session)
+
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_write)
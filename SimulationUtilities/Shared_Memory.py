@@ -0,0 +1,152 @@
+import tempfile
+import stat
+import mmap
+import os
+
+import numpy as np
+
+# The directory holding memory-backed files. Shared memory is only used where it exists, since an ordinary file on a
+# network file system could appear to be shared between hosts without being coherent.
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+
+# The prefix of the names of the files created for buffers. Only such files are mapped, so that a message naming some
+# other file can't have it overwritten.
+SHARED_MEMORY_PREFIX = 'modoi-'
+
+
+def is_shared_memory_file(path):
+    """ Determine whether a path names a file that SharedMetricBuffer.create could have made.
+
+    Args:
+      path (str): The location of the file.
+
+    Returns:
+      bool: True if the file is directly inside SHARED_MEMORY_DIRECTORY and its name starts with SHARED_MEMORY_PREFIX.
+
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    return (os.path.realpath(directory) == os.path.realpath(SHARED_MEMORY_DIRECTORY) and
+            name.startswith(SHARED_MEMORY_PREFIX))
+
+
+class SharedMetricBuffer:
+    """
+
+    The purpose of this object is to hold the points sent by a SimulationClient to a SimulationPotential running on the
+    same host, and the metric values and forces computed at them, in memory mapped by both processes. The points and
+    values are then read and written in place, and the messages exchanged over the session only carry the request ID and
+    the indices of the points, rather than pickled arrays.
+
+    The buffer has room for every point along a curve, so that the chunks of points handed out to a SimulationPotential
+    never overlap however many of them are in flight.
+
+    Attributes:
+      PATH (str) :
+          The location of the memory-backed file holding the buffer.
+      NUMBER_OF_POINTS (int) :
+          The number of points the buffer has room for.
+      DIMENSION (int) :
+          The dimension of the configuration space.
+      OWNER (bool) :
+          Whether this process created the buffer, and so removes the file when it is closed.
+      points (numpy.array) :
+          An (NUMBER_OF_POINTS, DIMENSION) array of the points written by the SimulationClient.
+      metric (numpy.array) :
+          An array of the NUMBER_OF_POINTS metric values written by the SimulationPotential.
+      forces (numpy.array) :
+          An (NUMBER_OF_POINTS, DIMENSION) array of the forces written by the SimulationPotential.
+
+    """
+    def __init__(self, path, number_of_points, dimension, owner=False):
+        """The constructor for the SharedMetricBuffer class, which maps an existing buffer. Use create for a new one.
+
+        Args:
+          path (str) :
+              The location of the memory-backed file holding the buffer.
+          number_of_points (int) :
+              The number of points the buffer has room for.
+          dimension (int) :
+              The dimension of the configuration space.
+          owner (bool, optional) :
+              If True then the file is removed when the buffer is closed.
+
+        Raises:
+          IOError, OSError: If the file cannot be opened, for example because it was created on a different host, or is
+            a symbolic link.
+          ValueError: If the file wasn't made by create, or is too small to hold the buffer.
+
+        """
+        if not is_shared_memory_file(path):
+            raise ValueError('Shared memory buffer ' + path + ' is not in ' + SHARED_MEMORY_DIRECTORY + '.')
+
+        self.PATH = path
+        self.NUMBER_OF_POINTS = number_of_points
+        self.DIMENSION = dimension
+        self.OWNER = owner
+
+        # Map the file, which no longer needs to be open once it is mapped.
+        size = 8 * number_of_points * (2 * dimension + 1)
+        descriptor = os.open(path, os.O_RDWR | getattr(os, 'O_NOFOLLOW', 0))
+        try:
+            if not stat.S_ISREG(os.fstat(descriptor).st_mode):
+                raise ValueError('Shared memory buffer ' + path + ' is not a file.')
+            if os.fstat(descriptor).st_size < size:
+                raise ValueError('Shared memory buffer ' + path + ' is too small.')
+            self.memory = mmap.mmap(descriptor, size)
+        finally:
+            os.close(descriptor)
+
+        # Lay the points, metric values and forces out one after another.
+        block = 8 * number_of_points * dimension
+        self.points = np.ndarray((number_of_points, dimension), dtype='float64', buffer=self.memory)
+        self.metric = np.ndarray(number_of_points, dtype='float64', buffer=self.memory, offset=block)
+        self.forces = np.ndarray((number_of_points, dimension), dtype='float64', buffer=self.memory,
+                                 offset=block + 8 * number_of_points)
+
+    @classmethod
+    def create(cls, number_of_points, dimension):
+        """ Create a new buffer in a memory-backed file.
+
+        Args:
+          number_of_points (int) :
+              The number of points the buffer has room for.
+          dimension (int) :
+              The dimension of the configuration space.
+
+        Returns:
+          SharedMetricBuffer: The buffer, which removes the file when it is closed, or None if shared memory is
+          unavailable.
+
+        """
+        if not os.path.isdir(SHARED_MEMORY_DIRECTORY):
+            return None
+        descriptor, path = tempfile.mkstemp(prefix=SHARED_MEMORY_PREFIX, dir=SHARED_MEMORY_DIRECTORY)
+        try:
+            os.ftruncate(descriptor, 8 * number_of_points * (2 * dimension + 1))
+        finally:
+            os.close(descriptor)
+        return cls(path, number_of_points, dimension, owner=True)
+
+    def description(self):
+        """ Describe the buffer so that another process on the same host can map it.
+
+        Returns:
+          dict: The path, number of points and dimension of the buffer.
+
+        """
+        return {'path': self.PATH, 'number_of_points': self.NUMBER_OF_POINTS, 'dimension': self.DIMENSION}
+
+    def close(self):
+        """ Unmap the buffer, removing the file if this process created it.
+
+        Note:
+          The arrays point into the mapped memory, so they are released first and must not be used afterwards.
+
+        """
+        self.points = self.metric = self.forces = None
+        self.memory.close()
+        if self.OWNER:
+            try:
+                os.unlink(self.PATH)
+            except OSError:
+                pass
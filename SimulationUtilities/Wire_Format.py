@@ -0,0 +1,342 @@
+import cPickle as pickle
+import struct
+
+import numpy as np
+from multiprocessing.connection import Client
+
+from SimulationUtilities.Communication_Codes import comm_code
+
+# The versions of the binary message format understood by this implementation.
+SUPPORTED_VERSIONS = (1, 2)
+
+# Binary messages start with these two bytes. Pickles sent by multiprocessing.connection always start with the PROTO
+# opcode '\x80', so the two formats are told apart by the first byte.
+MAGIC = 'MW'
+
+# Every binary message starts with the magic bytes, the format version, the status code and the number of fields. Each
+# field is then a one byte field number followed by its value.
+HEADER = struct.Struct('<2sBBH')
+FIELD = struct.Struct('<B')
+INTEGER = struct.Struct('<q')
+BOOLEAN = struct.Struct('<?')
+LENGTH = struct.Struct('<I')
+SHAPE = struct.Struct('<II')
+
+# The fields that may appear in a binary message, numbered by their position in the list, along with the type of their
+# values. Messages containing any other field are sent as pickles.
+FIELDS = [('request_id', 'integer'),
+          ('client_name', 'string'),
+          ('node_number', 'integer'),
+          ('new_node_position', 'vector'),
+          ('left_end_point', 'vector'),
+          ('right_end_point', 'vector'),
+          ('points', 'points'),
+          ('values', 'values'),
+          ('indices', 'indices'),
+          ('accepted', 'boolean'),
+          ('path', 'string'),
+          ('number_of_points', 'integer'),
+          ('dimension', 'integer'),
+          ('lease_id', 'integer')]
+FIELD_NUMBERS = dict((FIELDS[number][0], number) for number in xrange(len(FIELDS)))
+
+# The version of the format in which each field added after the first version was introduced. Messages containing a
+# field the agreed version doesn't have are sent as pickles.
+FIELD_VERSIONS = {'lease_id': 2}
+
+
+def encode(message, version=1):
+    """ Encode a message in the binary format.
+
+    Note:
+      Vectors are sent as raw little-endian float64 values. Lists of points are sent as a single (n_points, dim) block
+      of co-ordinates followed by their indices, and lists of metric values as a block of n_points metric values, a
+      block of forces and the indices.
+
+    Args:
+      message (dict) :
+          The message, containing a status_code along with any of the fields listed in FIELDS.
+      version (int, optional) :
+          The version of the binary format to use.
+
+    Returns:
+      str: The encoded message, or None if the message can't be represented in the binary format.
+
+    """
+    if version not in SUPPORTED_VERSIONS:
+        return None
+
+    parts = [HEADER.pack(MAGIC, version, message['status_code'], len(message) - 1)]
+    try:
+        for name, value in message.iteritems():
+            if name == 'status_code':
+                continue
+            if name not in FIELD_NUMBERS or FIELD_VERSIONS.get(name, 1) > version:
+                return None
+            number = FIELD_NUMBERS[name]
+            parts.append(FIELD.pack(number))
+            parts.append(encode_value(FIELDS[number][1], value))
+    except (TypeError, ValueError, IndexError, struct.error):
+        return None
+
+    return ''.join(parts)
+
+
+def encode_value(value_type, value):
+    """ Encode the value of a single field.
+
+    Args:
+      value_type (str) :
+          The type of the field, as listed in FIELDS.
+      value :
+          The value of the field.
+
+    Returns:
+      str: The encoded value.
+
+    Raises:
+      TypeError, ValueError: If the value is not of the type of the field.
+
+    """
+    if value_type == 'integer':
+        return INTEGER.pack(value)
+    elif value_type == 'boolean':
+        return BOOLEAN.pack(value)
+    elif value_type == 'string':
+        if not isinstance(value, str):
+            raise TypeError('Only byte strings are sent in binary messages.')
+        return LENGTH.pack(len(value)) + value
+    elif value_type == 'vector':
+        vector = np.ascontiguousarray(value, dtype='<f8')
+        if vector.ndim != 1:
+            raise ValueError('Vectors must be one dimensional.')
+        return LENGTH.pack(len(vector)) + vector.tostring()
+    elif value_type == 'indices':
+        return LENGTH.pack(len(value)) + np.asarray(value, dtype='<i8').tostring()
+    elif value_type == 'points':
+        dimension = len(value[0][0]) if value else 0
+        return (SHAPE.pack(len(value), dimension) +
+                np.array([point[0] for point in value], dtype='<f8').reshape((len(value), dimension)).tostring() +
+                np.array([point[1] for point in value], dtype='<i8').tostring())
+    elif value_type == 'values':
+        dimension = len(value[0][0][1]) if value else 0
+        return (SHAPE.pack(len(value), dimension) +
+                np.array([point[0][0] for point in value], dtype='<f8').tostring() +
+                np.array([point[0][1] for point in value], dtype='<f8').reshape((len(value), dimension)).tostring() +
+                np.array([point[1] for point in value], dtype='<i8').tostring())
+    raise ValueError('Unknown field type ' + value_type + '.')
+
+
+def decode(data):
+    """ Decode a message in the binary format.
+
+    Note:
+      The arrays in the decoded message are read-only views of data rather than copies. Lists of points and metric
+      values are returned in the same nested form as the pickled messages, so the receiver needn't know which format
+      was used.
+
+    Args:
+      data (str) :
+          The encoded message.
+
+    Returns:
+      dict: The message.
+
+    Raises:
+      ValueError: If the message is in an unsupported version of the format.
+
+    """
+    magic, version, status_code, number_of_fields = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in SUPPORTED_VERSIONS:
+        raise ValueError('Unsupported binary message format.')
+
+    message = {'status_code': status_code}
+    offset = HEADER.size
+    for field in xrange(number_of_fields):
+        number = FIELD.unpack_from(data, offset)[0]
+        name, value_type = FIELDS[number]
+        message[name], offset = decode_value(value_type, data, offset + FIELD.size)
+    return message
+
+
+def decode_value(value_type, data, offset):
+    """ Decode the value of a single field.
+
+    Args:
+      value_type (str) :
+          The type of the field, as listed in FIELDS.
+      data (str) :
+          The encoded message.
+      offset (int) :
+          The position in data at which the value starts.
+
+    Returns:
+      (value, int): The value and the position in data at which it ends.
+
+    """
+    if value_type == 'integer':
+        return int(INTEGER.unpack_from(data, offset)[0]), offset + INTEGER.size
+    elif value_type == 'boolean':
+        return BOOLEAN.unpack_from(data, offset)[0], offset + BOOLEAN.size
+    elif value_type == 'string':
+        length = LENGTH.unpack_from(data, offset)[0]
+        offset += LENGTH.size
+        return data[offset:offset + length], offset + length
+    elif value_type == 'vector':
+        length = LENGTH.unpack_from(data, offset)[0]
+        offset += LENGTH.size
+        return np.frombuffer(data, '<f8', length, offset), offset + 8 * length
+    elif value_type == 'indices':
+        length = LENGTH.unpack_from(data, offset)[0]
+        offset += LENGTH.size
+        return np.frombuffer(data, '<i8', length, offset).tolist(), offset + 8 * length
+
+    number_of_points, dimension = SHAPE.unpack_from(data, offset)
+    offset += SHAPE.size
+    if value_type == 'points':
+        points = np.frombuffer(data, '<f8', number_of_points * dimension, offset).reshape((number_of_points, dimension))
+        offset += 8 * number_of_points * dimension
+        indices = np.frombuffer(data, '<i8', number_of_points, offset).tolist()
+        return [[points[i], indices[i]] for i in xrange(number_of_points)], offset + 8 * number_of_points
+    elif value_type == 'values':
+        metric = np.frombuffer(data, '<f8', number_of_points, offset).tolist()
+        offset += 8 * number_of_points
+        forces = np.frombuffer(data, '<f8', number_of_points * dimension, offset).reshape((number_of_points, dimension))
+        offset += 8 * number_of_points * dimension
+        indices = np.frombuffer(data, '<i8', number_of_points, offset).tolist()
+        return [[[metric[i], forces[i]], indices[i]] for i in xrange(number_of_points)], offset + 8 * number_of_points
+    raise ValueError('Unknown field type ' + value_type + '.')
+
+
+def dumps(message, version=None):
+    """ Encode a message in the binary format if a version has been agreed and the message can be, otherwise pickle it.
+
+    Args:
+      message (dict) :
+          The message.
+      version (int, optional) :
+          The version of the binary format agreed for the session, or None if messages are pickled.
+
+    Returns:
+      str: The encoded message.
+
+    """
+    data = encode(message, version) if version is not None else None
+    if data is None:
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return data
+
+
+def loads(data):
+    """ Decode a message in either format.
+
+    Args:
+      data (str) :
+          The encoded message.
+
+    Returns:
+      The message.
+
+    """
+    if data[:len(MAGIC)] == MAGIC:
+        return decode(data)
+    return pickle.loads(data)
+
+
+def choose_version(offer, versions=SUPPORTED_VERSIONS):
+    """ Choose the version of the binary format to use for a session from those offered by the client.
+
+    Args:
+      offer (dict) :
+          The CLIENT_OFFERS_WIRE_FORMAT message.
+      versions (optional) :
+          The versions the receiver is willing to use.
+
+    Returns:
+      dict: The SERVER_ACCEPTS_WIRE_FORMAT reply, whose version is None if messages are to stay pickled.
+
+    """
+    common = set(offer.get('versions', ())) & set(versions)
+    return {'status_code': comm_code('SERVER_ACCEPTS_WIRE_FORMAT'), 'version': max(common) if common else None}
+
+
+class WireConnection:
+    """
+
+    The purpose of this object is to wrap a Connection from the multiprocessing package so that messages are sent in the
+    binary format agreed with the other end, and messages in either format are received. It can be used anywhere the
+    Connection could, including in select.
+
+    Attributes:
+      CONNECTION (Connection) :
+          The wrapped connection.
+      VERSION (int) :
+          The version of the binary format agreed for the connection, or None if messages are pickled.
+
+    """
+    def __init__(self, connection, version=None):
+        """The constructor for the WireConnection class.
+
+        Args:
+          connection (Connection) :
+              The connection to wrap.
+          version (int, optional) :
+              The version of the binary format agreed for the connection, or None if messages are pickled.
+
+        """
+        self.CONNECTION = connection
+        self.VERSION = version
+
+    def send(self, message):
+        """ Send a message, in the binary format if possible.
+
+        """
+        self.CONNECTION.send_bytes(dumps(message, self.VERSION))
+
+    def recv(self):
+        """ Wait for a message and return it.
+
+        """
+        return loads(self.CONNECTION.recv_bytes())
+
+    def poll(self, timeout=0.0):
+        """ Return whether there is a message waiting to be received.
+
+        """
+        return self.CONNECTION.poll(timeout)
+
+    def fileno(self):
+        """ Return the file descriptor of the connection.
+
+        """
+        return self.CONNECTION.fileno()
+
+    def close(self):
+        """ Close the connection.
+
+        """
+        self.CONNECTION.close()
+
+
+def connect(address, authkey, versions=SUPPORTED_VERSIONS):
+    """ Connect to a SessionListener and agree the message format to use.
+
+    Args:
+      address (str, int) :
+          A tuple containing the hostname and port number to connect to.
+      authkey (str) :
+          The password used in order to communicate with the listener.
+      versions (optional) :
+          The versions of the binary format to offer. If empty then no offer is made and messages are pickled.
+
+    Returns:
+      WireConnection: The connection.
+
+    """
+    connection = Client(address, authkey=authkey)
+    if not versions:
+        return WireConnection(connection)
+
+    # The offer itself, and the reply to it, are always pickled.
+    connection.send({'status_code': comm_code('CLIENT_OFFERS_WIRE_FORMAT'), 'versions': list(versions)})
+    return WireConnection(connection, connection.recv().get('version'))
@@ -0,0 +1,107 @@
+""" Tests of the warm start of local geodesics from the previous local geodesic computed for the same node, and of the
+batched line search.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_CustomBFGS
+
+"""
+import unittest
+import tempfile
+import shutil
+
+import numpy as np
+
+from SimulationUtilities.Curve import Curve
+from SimulationClient.CustomBFGS import find_geodesic_midpoint, warm_start_is_usable
+from SimulationClient.Geometric import Length
+from SimulationClient import LinearAlgebra as la
+from Benchmarks.Local_Geodesic import LocalMetric
+from Benchmarks.Curve_Scheduling import write_configuration_file
+from Benchmarks.Warm_Start import converge
+
+
+class WarmStartIsUsableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.start_point = np.zeros(6)
+        self.end_point = np.ones(6)
+        self.warm_start = {'shifts': np.zeros((3, 6)), 'left_end_point': np.copy(self.start_point),
+                           'right_end_point': np.copy(self.end_point)}
+
+    def test_unchanged_end_points(self):
+        self.assertTrue(warm_start_is_usable(self.warm_start, self.start_point, self.end_point, 3, 6, 0.0))
+
+    def test_end_points_moved(self):
+        moved = np.copy(self.end_point)
+        moved[4] += 0.1
+        self.assertTrue(warm_start_is_usable(self.warm_start, self.start_point, moved, 3, 6, 0.2))
+        self.assertFalse(warm_start_is_usable(self.warm_start, self.start_point, moved, 3, 6, 0.05))
+        self.assertFalse(warm_start_is_usable(self.warm_start, moved, self.end_point, 3, 6, 0.05))
+
+    def test_missing_or_mismatched_state(self):
+        self.assertFalse(warm_start_is_usable(None, self.start_point, self.end_point, 3, 6, np.inf))
+        self.assertFalse(warm_start_is_usable({}, self.start_point, self.end_point, 3, 6, np.inf))
+        self.assertFalse(warm_start_is_usable(self.warm_start, self.start_point, self.end_point, 5, 6, np.inf))
+        del self.warm_start['left_end_point']
+        self.assertFalse(warm_start_is_usable(self.warm_start, self.start_point, self.end_point, 3, 6, np.inf))
+
+
+class WarmStartConvergenceTest(unittest.TestCase):
+    """ Converge Butane with the global and local numbers of nodes used by Local_Simulation, to a tolerance loose
+    enough for the test to be quick.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metric = LocalMetric(write_configuration_file(self.directory, 10, 5, 0.02))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_warm_start_takes_no_more_sweeps(self):
+        for optimiser in ['bfgs', 'lbfgs']:
+            cold_sweeps = converge(self.metric, optimiser, False, 100)[0]
+            warm_sweeps = converge(self.metric, optimiser, True, 100)[0]
+            self.assertLess(cold_sweeps, 100)
+            self.assertLessEqual(warm_sweeps, cold_sweeps, optimiser)
+
+
+class BatchedLineSearchTest(unittest.TestCase):
+    """ Compute the local geodesic for the first inner node of the straight line joining the end points of Butane, as
+    Benchmarks.Line_Search does.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metric = LocalMetric(write_configuration_file(self.directory, 8, 5, 0.01))
+        configuration = self.metric.POTENTIAL.CONFIGURATION
+        curve = Curve(configuration['start_point'], configuration['end_point'], 8, 8 * 4 + 1)
+        self.start_point, self.end_point = curve.get_points()[0], curve.get_points()[2]
+        self.tangent_direction = (self.end_point - self.start_point) / 6.0
+        self.codimension = configuration['codimension']
+        self.mass_metric = la.DiagonalMassMetric(configuration['molecule'].get_masses(), configuration['dimension'])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def length(self, midpoint):
+        """ Return the length of the curve through midpoint with straight line segments either side of it. """
+        curve = np.array([self.start_point, midpoint, self.end_point])
+        return Length(curve, self.metric.get_metric(curve, 1), 1, self.mass_metric)
+
+    def test_batched_steps_are_taken(self):
+        for line_search_steps in [4, 8]:
+            statistics = {}
+            midpoint = find_geodesic_midpoint(self.start_point, self.end_point, 5,
+                                              la.HouseholderTangentBasis(self.tangent_direction),
+                                              self.tangent_direction, self.codimension, self.metric, self.mass_metric,
+                                              line_search='batched', line_search_steps=line_search_steps,
+                                              statistics=statistics)
+            self.assertGreater(statistics['batched_steps_taken'], 0)
+            self.assertLessEqual(statistics['batched_steps_taken'], statistics['batched_searches'])
+            self.assertLess(self.length(midpoint), self.length((self.start_point + self.end_point) / 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
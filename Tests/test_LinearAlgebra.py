@@ -0,0 +1,125 @@
+""" Tests of the HouseholderTangentBasis, which represents an orthonormal basis without forming it as a matrix, and of
+the mass metrics, which the functions computing norms and lengths accept in place of a dense mass matrix.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_LinearAlgebra
+
+"""
+import unittest
+
+import numpy as np
+
+from SimulationClient import LinearAlgebra as la
+from SimulationClient import Geometric
+
+
+class HouseholderTangentBasisTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.dimension = 12
+
+        # Include tangents whose first co-ordinate is positive, negative and zero, since each uses a different sign.
+        self.tangents = [random.randn(self.dimension) for i in xrange(3)]
+        self.tangents[0][0] = abs(self.tangents[0][0])
+        self.tangents[1][0] = -abs(self.tangents[1][0])
+        self.tangents[2][0] = 0.0
+        self.tangents.append(np.eye(self.dimension)[0] * 3.0)
+        self.tangents.append(-np.eye(self.dimension)[0])
+        self.vectors = random.randn(5, self.dimension)
+
+    def test_rotate_maps_first_basis_vector_to_unit_tangent(self):
+        for tangent in self.tangents:
+            basis = la.HouseholderTangentBasis(tangent)
+            np.testing.assert_allclose(basis.rotate(np.eye(self.dimension)[0]), tangent / np.linalg.norm(tangent),
+                                       atol=1e-12)
+
+    def test_rotation_is_orthogonal(self):
+        for tangent in self.tangents:
+            basis = la.HouseholderTangentBasis(tangent)
+            matrix = basis.rotate(np.eye(self.dimension))
+            np.testing.assert_allclose(matrix.dot(matrix.T), np.eye(self.dimension), atol=1e-12)
+
+    def test_rotate_back_inverts_rotate(self):
+        for tangent in self.tangents:
+            basis = la.HouseholderTangentBasis(tangent)
+            np.testing.assert_allclose(basis.rotate_back(basis.rotate(self.vectors)), self.vectors, atol=1e-12)
+            np.testing.assert_allclose(basis.rotate(basis.rotate_back(self.vectors)), self.vectors, atol=1e-12)
+
+            # Rotating the rows of the identity gives the basis vectors as rows, so rotate multiplies each row by this
+            # matrix and rotate_back, its transpose, by the transposed matrix. A single vector is converted as a row of
+            # an array would be.
+            matrix = basis.rotate(np.eye(self.dimension))
+            np.testing.assert_allclose(basis.rotate(self.vectors), self.vectors.dot(matrix), atol=1e-12)
+            np.testing.assert_allclose(basis.rotate_back(self.vectors), self.vectors.dot(matrix.T), atol=1e-12)
+            np.testing.assert_allclose(basis.rotate(self.vectors[0]), basis.rotate(self.vectors)[0], atol=1e-12)
+
+    def test_rotate_does_not_modify_its_argument(self):
+        basis = la.HouseholderTangentBasis(self.tangents[1])
+        vectors = np.copy(self.vectors)
+        basis.rotate(vectors)
+        basis.rotate_back(vectors)
+        np.testing.assert_array_equal(vectors, self.vectors)
+
+
+
+class MassMetricTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.masses = np.array([12.0, 1.0, 1.0, 16.0])
+        self.diagonal = la.DiagonalMassMetric(self.masses, 12)
+        self.dimension = 12
+        self.vectors = random.randn(5, self.dimension)
+
+        # A curve with three inner nodes, and made up metric values and gradients along it.
+        self.curve = random.randn(5, self.dimension)
+        self.metric = [(1.0 + random.rand(), random.randn(self.dimension)) for point in self.curve]
+        self.tangent_basis = la.HouseholderTangentBasis(self.curve[-1] - self.curve[0])
+
+    def test_dense_matrix_agrees_with_diagonal_mass_metric(self):
+        matrix = np.diag(self.diagonal.MASSES)
+        for mass_metric in (matrix, la.DenseMassMetric(matrix)):
+            self.assertAlmostEqual(la.mass_norm(self.vectors[0], mass_metric), self.diagonal.norm(self.vectors[0]))
+            self.assertAlmostEqual(Geometric.norm(self.vectors[0], mass_metric), self.diagonal.norm(self.vectors[0]))
+            np.testing.assert_allclose(Geometric.norm_gradient(self.vectors[0], mass_metric),
+                                       self.diagonal.norm_gradient(self.vectors[0]))
+            self.assertAlmostEqual(Geometric.Length(self.curve, self.metric, 3, mass_metric),
+                                   Geometric.Length(self.curve, self.metric, 3, self.diagonal))
+            np.testing.assert_allclose(Geometric.GradLength(self.curve, self.metric, 3, mass_metric,
+                                                            self.tangent_basis),
+                                       Geometric.GradLength(self.curve, self.metric, 3, self.diagonal,
+                                                            self.tangent_basis))
+
+    def test_batched_norms_agree_with_single_norms(self):
+        # A matrix that is neither diagonal nor symmetric, but whose symmetric part is positive definite.
+        random = np.random.RandomState(1)
+        matrix = np.diag(self.diagonal.MASSES) + 0.1 * random.randn(self.dimension, self.dimension)
+        for mass_metric in (self.diagonal, la.DenseMassMetric(matrix)):
+            norms = mass_metric.norms(self.vectors)
+            np.testing.assert_allclose(norms, [mass_metric.norm(vector) for vector in self.vectors])
+            np.testing.assert_allclose(mass_metric.norm_gradients(self.vectors),
+                                       [mass_metric.norm_gradient(vector) for vector in self.vectors])
+            np.testing.assert_allclose(mass_metric.norm_gradients(self.vectors, norms),
+                                       mass_metric.norm_gradients(self.vectors))
+
+    def test_norm_gradient_matches_finite_differences(self):
+        random = np.random.RandomState(2)
+        matrix = np.diag(self.diagonal.MASSES) + 0.1 * random.randn(self.dimension, self.dimension)
+        for mass_metric in (self.diagonal, la.DenseMassMetric(matrix)):
+            vector = self.vectors[0]
+            step = 1e-6
+            differences = [(mass_metric.norm(vector + step * e) - mass_metric.norm(vector - step * e)) / (2 * step)
+                           for e in np.eye(self.dimension)]
+            np.testing.assert_allclose(mass_metric.norm_gradient(vector), differences, rtol=1e-6, atol=1e-8)
+
+    def test_as_mass_metric_wraps_only_matrices(self):
+        self.assertIs(la.as_mass_metric(self.diagonal), self.diagonal)
+        dense = la.DenseMassMetric(np.eye(self.dimension))
+        self.assertIs(la.as_mass_metric(dense), dense)
+        self.assertIsInstance(la.as_mass_metric(np.eye(self.dimension)), la.DenseMassMetric)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+""" Tests of the matching of replies to requests by the MetricServerPool, and of its handling of SimulationPotential
+instances that fail.
+
+Stand-in SimulationPotential instances run on threads, listening with a SessionListener on Unix domain sockets. They
+evaluate nothing: the metric value at a point is its first co-ordinate and the forces are the negated point.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_MetricValues
+
+"""
+import threading
+import unittest
+import tempfile
+import logging
+import shutil
+import os
+
+import numpy as np
+
+from SimulationClient.MetricValues import MetricServerPool
+from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities.Session_Handling import SessionListener
+from SimulationUtilities.Shared_Memory import SharedMetricBuffer
+
+AUTHKEY = 'password'
+
+
+class FakePotential:
+    """
+
+    A stand-in SimulationPotential, answering requests on a thread until it is stopped.
+
+    Attributes:
+      request_ids (list): The request IDs received, in order.
+      behaviour (str): 'answer' to answer every request, 'stale' to send a reply to some other request before each
+        answer, 'error' to refuse every request, or 'close' to close the session on the first request.
+      share (bool): Whether shared memory buffers are accepted.
+
+    """
+    def __init__(self, address, behaviour='answer', share=False):
+        self.request_ids = []
+        self.behaviour = behaviour
+        self.share = share
+        self.listener = SessionListener(address, AUTHKEY)
+        self.buffers = {}
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            for session, message in self.listener.poll(0.05):
+                if message['status_code'] == comm_code('CLIENT_OFFERS_SHARED_MEMORY'):
+                    if self.share:
+                        self.buffers[session] = SharedMetricBuffer(message['path'], message['number_of_points'],
+                                                                   message['dimension'])
+                    self.listener.send(session, {'status_code': comm_code('SERVER_ACCEPTS_SHARED_MEMORY'),
+                                                 'accepted': self.share})
+                elif message['status_code'] == comm_code('CLIENT_PROVIDES_POINT'):
+                    self.answer(session, message)
+
+    def answer(self, session, message):
+        self.request_ids.append(message['request_id'])
+        reply = {'status_code': comm_code('SERVER_PROVIDES_VALUES'), 'request_id': message['request_id']}
+        if self.behaviour == 'close':
+            self.listener.close_session(session)
+            return
+        if self.behaviour == 'error':
+            reply['error'] = 'Refused.'
+            self.listener.send(session, reply)
+            return
+        if self.behaviour == 'stale':
+            self.listener.send(session, {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                         'request_id': message['request_id'] - 1000,
+                                         'values': [[[-1.0, np.zeros(3)], 0]]})
+            self.listener.send(session, {'status_code': comm_code('SERVER_PROVIDES_VALUES'),
+                                         'values': [[[-1.0, np.zeros(3)], 0]]})
+        if 'indices' in message:
+            buffer = self.buffers[session]
+            for i in message['indices']:
+                buffer.metric[i] = buffer.points[i, 0]
+                buffer.forces[i] = -buffer.points[i]
+            reply['indices'] = message['indices']
+        else:
+            reply['values'] = [[[float(point[0][0]), -point[0]], point[1]] for point in message['points']]
+        self.listener.send(session, reply)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        for buffer in self.buffers.values():
+            buffer.close()
+        self.listener.close()
+
+
+class MetricServerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.directory = tempfile.mkdtemp()
+        self.addresses = [os.path.join(self.directory, 'potential-%d' % i) for i in xrange(2)]
+        self.potentials = []
+        self.curve = np.arange(24.0).reshape((8, 3))
+
+    def tearDown(self):
+        for potential in self.potentials:
+            potential.stop()
+        shutil.rmtree(self.directory)
+        logging.disable(logging.NOTSET)
+
+    def start(self, behaviours=('answer', 'answer'), share=False):
+        for address, behaviour in zip(self.addresses, behaviours):
+            self.potentials.append(FakePotential(address, behaviour, share))
+        return MetricServerPool(self.addresses, AUTHKEY, cache_size=0, shared_memory=share)
+
+    def assert_metric_correct(self, metric):
+        self.assertEqual(len(metric), len(self.curve))
+        for point, value in zip(self.curve, metric):
+            self.assertEqual(value[0], point[0])
+            np.testing.assert_array_equal(value[1], -point)
+
+    def test_request_ids(self):
+        for share in (False, True):
+            pool = self.start(share=share)
+            self.assert_metric_correct(pool.get_metric(self.curve, len(self.curve) - 2))
+            self.assert_metric_correct(pool.get_metric(self.curve, len(self.curve) - 2))
+            pool.close()
+
+            # Every request, to whichever instance, has its own ID, and each instance receives them in order.
+            request_ids = [request_id for potential in self.potentials for request_id in potential.request_ids]
+            self.assertEqual(sorted(request_ids), range(1, pool.request_id + 1))
+            for potential in self.potentials:
+                self.assertTrue(potential.request_ids)
+                self.assertEqual(potential.request_ids, sorted(potential.request_ids))
+            self.assertEqual(sum(pool.points_evaluated), 2 * len(self.curve))
+            for potential in self.potentials:
+                potential.stop()
+            self.potentials = []
+
+    def test_stale_replies_are_dropped(self):
+        for share in (False, True):
+            pool = self.start(('stale', 'answer'), share)
+            self.assert_metric_correct(pool.get_metric(self.curve, len(self.curve) - 2))
+            pool.close()
+            for potential in self.potentials:
+                potential.stop()
+            self.potentials = []
+
+    def test_refused_request_fails(self):
+        pool = self.start(('answer', 'error'))
+        self.assertIsNone(pool.get_metric(self.curve, len(self.curve) - 2))
+        self.assertEqual(pool.connections, [None, None])
+
+    def test_closed_session_fails(self):
+        pool = self.start(('close', 'answer'))
+        self.assertIsNone(pool.get_metric(self.curve, len(self.curve) - 2))
+        self.assertEqual(pool.connections, [None, None])
+
+    def test_missing_instance_fails(self):
+        for share in (False, True):
+            self.potentials.append(FakePotential(self.addresses[0], share=share))
+            pool = MetricServerPool(self.addresses, AUTHKEY, cache_size=0, shared_memory=share)
+            self.assertIsNone(pool.get_metric(self.curve, len(self.curve) - 2))
+            self.assertEqual(pool.connections, [None, None])
+            self.assertEqual(pool.buffers, [None, None])
+            self.potentials.pop().stop()
+
+    def test_connection_failed_closes_everything(self):
+        pool = self.start(share=True)
+        self.assert_metric_correct(pool.get_metric(self.curve, len(self.curve) - 2))
+        self.assertNotIn(None, pool.connections)
+        paths = [buffer.PATH for buffer in pool.buffers]
+        self.assertIsNone(pool.connection_failed(1))
+        self.assertEqual(pool.connections, [None, None])
+        self.assertEqual(pool.buffers, [None, None])
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
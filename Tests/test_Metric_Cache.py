@@ -0,0 +1,90 @@
+""" Tests of the least recently used cache of metric values, and of the quantization of the configurations it stores.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_Metric_Cache
+
+"""
+import unittest
+
+import numpy as np
+
+from SimulationUtilities.Metric_Cache import MetricCache
+
+
+class MetricCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.points = [np.arange(6.0) + i for i in xrange(4)]
+        self.values = [[float(i), -self.points[i]] for i in xrange(4)]
+
+    def test_hits_and_misses(self):
+        cache = MetricCache(capacity=4)
+        self.assertIsNone(cache.get(self.points[0]))
+        cache.put(self.points[0], self.values[0])
+        self.assertIs(cache.get(self.points[0]), self.values[0])
+        self.assertIs(cache.get(np.copy(self.points[0])), self.values[0])
+        self.assertIsNone(cache.get(self.points[1]))
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 2, 0))
+        self.assertEqual(cache.statistics(), '2 hits, 2 misses (50.0% hit rate), 0 evictions')
+
+    def test_least_recently_used_is_evicted(self):
+        cache = MetricCache(capacity=3)
+        for point, value in zip(self.points[:3], self.values[:3]):
+            cache.put(point, value)
+
+        # Looking up the oldest configuration makes the second the least recently used.
+        cache.get(self.points[0])
+        cache.put(self.points[3], self.values[3])
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache.entries), 3)
+        self.assertIsNone(cache.get(self.points[1]))
+        for i in (0, 2, 3):
+            self.assertIs(cache.get(self.points[i]), self.values[i])
+
+    def test_put_replaces_and_refreshes(self):
+        cache = MetricCache(capacity=2)
+        cache.put(self.points[0], self.values[0])
+        cache.put(self.points[1], self.values[1])
+        cache.put(self.points[0], self.values[2])
+        self.assertEqual(cache.evictions, 0)
+        cache.put(self.points[3], self.values[3])
+        self.assertEqual(cache.evictions, 1)
+        self.assertIs(cache.get(self.points[0]), self.values[2])
+        self.assertIsNone(cache.get(self.points[1]))
+
+    def test_zero_capacity_remembers_nothing(self):
+        cache = MetricCache(capacity=0)
+        cache.put(self.points[0], self.values[0])
+        self.assertIsNone(cache.get(self.points[0]))
+        self.assertEqual(len(cache.entries), 0)
+        self.assertEqual(cache.statistics(), '0 hits, 1 misses (0.0% hit rate), 0 evictions')
+
+    def test_quantization_collisions(self):
+        cache = MetricCache(capacity=4, quantum=1e-3)
+        cache.put(self.points[0], self.values[0])
+
+        # Configurations rounding to the same multiple of the quantum in every co-ordinate share their values.
+        self.assertIs(cache.get(self.points[0] + 4e-4), self.values[0])
+        self.assertIs(cache.get(self.points[0] - 4e-4), self.values[0])
+        self.assertEqual(cache.key(self.points[0] + 4e-4), cache.key(self.points[0]))
+
+        # Those that round differently in any one co-ordinate don't, even though they are closer than the quantum.
+        shifted = np.copy(self.points[0])
+        shifted[2] += 6e-4
+        self.assertIsNone(cache.get(shifted))
+
+        # A value stored for a colliding configuration replaces the one stored before.
+        cache.put(self.points[0] + 4e-4, self.values[1])
+        self.assertIs(cache.get(self.points[0]), self.values[1])
+        self.assertEqual(len(cache.entries), 1)
+
+    def test_keys_depend_on_values_and_length(self):
+        cache = MetricCache()
+        self.assertEqual(cache.key([1.0, 2.0, 3.0]), cache.key(np.array([1, 2, 3], dtype='int')))
+        self.assertNotEqual(cache.key([1.0, 2.0, 3.0]), cache.key([1.0, 3.0, 2.0]))
+        self.assertNotEqual(cache.key([0.0, 0.0]), cache.key([0.0, 0.0, 0.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
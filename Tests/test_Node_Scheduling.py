@@ -0,0 +1,165 @@
+""" Tests of the order in which the schedulers issue the nodes of a Curve.
+
+The CounterScheduler is compared against the algorithm the Curve used before the schedulers were introduced, and every
+scheduler is checked against the invariants of a sweep while results arrive in a random order.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_Node_Scheduling
+
+"""
+import unittest
+
+import numpy as np
+
+from SimulationUtilities.Curve import Curve
+from SimulationUtilities.Node_Scheduling import SCHEDULERS
+
+
+class BaselineSchedule:
+    """
+
+    The node counters, as kept by the Curve before the schedulers were introduced.
+
+    """
+    def __init__(self, number_of_nodes):
+        self.number_of_nodes = number_of_nodes
+        self.default_initial_state = np.zeros(number_of_nodes, dtype='int')
+        for i in xrange(number_of_nodes - 1):
+            if i % 2 != 0:
+                self.default_initial_state[i] = 2
+        self.set_node_movable()
+
+    def set_node_movable(self):
+        self.nodes_moved = np.ones(self.number_of_nodes, dtype='int')
+        self.node_movable = np.copy(self.default_initial_state)
+        self.number_of_distinct_nodes_moved = 0
+
+    def set_node_position(self, node_number):
+        self.node_movable[node_number - 1] += 1
+        self.node_movable[node_number + 1] += 1
+        self.node_movable[0] = 0
+        self.node_movable[-1] = 0
+        if node_number == 2:
+            self.node_movable[1] += 1
+            self.node_movable[0] = 0
+        if node_number == self.number_of_nodes - 3:
+            self.node_movable[-2] += 1
+            self.node_movable[-1] = 0
+        self.nodes_moved[node_number] = 0
+        self.number_of_distinct_nodes_moved = sum(self.nodes_moved)
+
+    def next_movable_node(self):
+        try:
+            next_movable_node = np.where(np.multiply(self.node_movable, self.nodes_moved) > 1)[0][0]
+            self.node_movable[next_movable_node] = 0
+            return next_movable_node
+        except IndexError:
+            return None
+
+    def all_nodes_moved(self):
+        return self.number_of_distinct_nodes_moved == 2
+
+
+def make_curve(number_of_nodes, scheduler):
+    return Curve(np.zeros(3), np.ones(3), number_of_nodes, number_of_nodes, scheduler)
+
+
+def run_sweeps(curve, random, number_of_sweeps, baseline=None, test=None):
+    """ Issue and move the nodes of curve for a number of sweeps, with up to four nodes being moved at once and the
+    results arriving in a random order. When baseline is given, it is sent the same moves and test checks that the two
+    issue the same nodes and agree on the state of the curve.
+
+    Returns:
+      list: For each sweep, the nodes in the order they were issued, and the nodes being moved when each was issued.
+
+    """
+    sweeps = []
+    for sweep in xrange(number_of_sweeps):
+        issued = []
+        in_flight = []
+        while not curve.all_nodes_moved():
+            node_number = None
+            if not in_flight or (len(in_flight) < 4 and random.rand() < 0.6):
+                node_number = curve.next_movable_node()
+                if baseline is not None:
+                    test.assertEqual(node_number, baseline.next_movable_node())
+            if node_number is not None:
+                issued.append((node_number, list(in_flight)))
+                in_flight.append(node_number)
+            elif in_flight:
+                node_number = in_flight.pop(random.randint(len(in_flight)))
+                curve.set_node_position(node_number, curve.get_points()[node_number] + random.rand())
+                if baseline is not None:
+                    baseline.set_node_position(node_number)
+                    np.testing.assert_array_equal(curve.node_movable, baseline.node_movable)
+                    np.testing.assert_array_equal(curve.nodes_moved, baseline.nodes_moved)
+                    test.assertEqual(curve.number_of_distinct_nodes_moved, baseline.number_of_distinct_nodes_moved)
+                    test.assertEqual(curve.all_nodes_moved(), baseline.all_nodes_moved())
+            else:
+                raise AssertionError('No node was issued although none are being moved.')
+        sweeps.append(issued)
+        curve.set_node_movable()
+        if baseline is not None:
+            baseline.set_node_movable()
+    return sweeps
+
+
+class CounterSchedulerTest(unittest.TestCase):
+
+    def test_matches_baseline_algorithm(self):
+        for number_of_nodes in (5, 6, 7, 12, 13):
+            for seed in xrange(5):
+                curve = make_curve(number_of_nodes, 'counter')
+                baseline = BaselineSchedule(number_of_nodes)
+                np.testing.assert_array_equal(curve.default_initial_state, baseline.default_initial_state)
+                np.testing.assert_array_equal(curve.node_movable, baseline.node_movable)
+                np.testing.assert_array_equal(curve.nodes_moved, baseline.nodes_moved)
+                run_sweeps(curve, np.random.RandomState(seed), 3, baseline, self)
+
+    def test_curve_properties_are_read_only_copies(self):
+        curve = make_curve(7, 'counter')
+        curve.node_movable[1] = 0
+        curve.default_initial_state[1] = 0
+        self.assertEqual(curve.next_movable_node(), 1)
+        curve.set_node_movable()
+        self.assertEqual(curve.next_movable_node(), 1)
+
+
+class SchedulerInvariantTest(unittest.TestCase):
+
+    def test_no_node_issued_next_to_one_being_moved(self):
+        for name in SCHEDULERS:
+            for number_of_nodes in (5, 8, 13):
+                for seed in xrange(5):
+                    curve = make_curve(number_of_nodes, name)
+                    for sweep in run_sweeps(curve, np.random.RandomState(seed), 3):
+                        for node_number, in_flight in sweep:
+                            self.assertNotIn(node_number - 1, in_flight, name)
+                            self.assertNotIn(node_number + 1, in_flight, name)
+                            self.assertNotIn(node_number, in_flight, name)
+
+    def test_every_node_moved_once_per_sweep(self):
+        for name in SCHEDULERS:
+            for number_of_nodes in (5, 8, 13):
+                for seed in xrange(5):
+                    curve = make_curve(number_of_nodes, name)
+                    for sweep in run_sweeps(curve, np.random.RandomState(seed), 3):
+                        self.assertEqual(sorted(node_number for node_number, in_flight in sweep),
+                                         range(1, number_of_nodes - 1), name)
+
+    def test_node_movable_matches_next_node(self):
+        for name in SCHEDULERS:
+            curve = make_curve(9, name)
+            np.testing.assert_array_equal(curve.node_movable > 1, curve.default_initial_state > 1)
+            self.assertEqual(curve.number_of_distinct_nodes_moved, 9)
+            node_number = curve.next_movable_node()
+            self.assertEqual(curve.default_initial_state[node_number], 2, name)
+            self.assertLessEqual(curve.node_movable[node_number], 1, name)
+            curve.set_node_position(node_number, curve.get_points()[node_number])
+            self.assertEqual(curve.nodes_moved[node_number], 0, name)
+            self.assertEqual(curve.number_of_distinct_nodes_moved, 8, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+""" Tests of the buffering of partially received messages and of queued replies by the SessionListener.
+
+Clients connect with the Connection objects of the multiprocessing package, which perform the authentication
+handshake, and then write raw bytes to their sockets where a message is to arrive in pieces.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_Session_Handling
+
+"""
+import cPickle as pickle
+from multiprocessing.connection import Client
+import threading
+import unittest
+import tempfile
+import logging
+import shutil
+import struct
+import time
+import os
+
+from SimulationUtilities.Session_Handling import SessionListener
+
+AUTHKEY = 'password'
+
+
+def frame(message):
+    """ Return a message framed as a Connection would send it.
+
+    """
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return struct.pack('!i', len(data)) + data
+
+
+class SessionListenerTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.directory = tempfile.mkdtemp()
+        self.listener = SessionListener(os.path.join(self.directory, 'listener'), AUTHKEY, wire_formats=())
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.listener.close()
+        shutil.rmtree(self.directory)
+        logging.disable(logging.NOTSET)
+
+    def connect(self):
+        """ Connect a client and wait for its session to be established.
+
+        """
+        client = Client(self.listener.LISTENER.address, authkey=AUTHKEY)
+        self.clients.append(client)
+        number_of_sessions = len(self.listener.SESSIONS) + 1
+        for attempt in xrange(50):
+            self.assertEqual(self.listener.poll(0.1), [])
+            if len(self.listener.SESSIONS) == number_of_sessions:
+                return client
+        self.fail('Session not established.')
+
+    def receive(self, number_of_messages):
+        """ Poll until number_of_messages messages have arrived, and return them.
+
+        """
+        messages = []
+        for attempt in xrange(50):
+            messages.extend(self.listener.poll(0.1))
+            if len(messages) >= number_of_messages:
+                break
+        self.assertEqual(len(messages), number_of_messages)
+        return messages
+
+    def test_message_in_pieces(self):
+        client = self.connect()
+        first = frame({'status_code': 1, 'points': range(1000)})
+        second = frame({'status_code': 2})
+
+        # Neither part of the length, nor the length and part of the message, is a complete message, and both are kept.
+        fd = self.listener.descriptor_of[self.listener.SESSIONS[0]]
+        for end in (2, 100):
+            os.write(client.fileno(), first[len(self.listener.inbound[fd]):end])
+            self.assertEqual(self.listener.poll(0.2), [])
+            self.assertEqual(len(self.listener.inbound[fd]), end)
+
+        # The rest of the first message arrives along with the start of the second.
+        os.write(client.fileno(), first[100:] + second[:3])
+        session, message = self.receive(1)[0]
+        self.assertEqual(message, {'status_code': 1, 'points': range(1000)})
+        os.write(client.fileno(), second[3:])
+        self.assertEqual(self.receive(1)[0][1], {'status_code': 2})
+        self.assertEqual(len(self.listener.inbound[fd]), 0)
+
+    def test_several_messages_at_once(self):
+        client = self.connect()
+        os.write(client.fileno(), ''.join(frame({'status_code': i}) for i in xrange(5)))
+        self.assertEqual([message['status_code'] for session, message in self.receive(5)], range(5))
+
+    def test_messages_sent_before_close_are_delivered(self):
+        client = self.connect()
+        client.send({'status_code': 7})
+        client.close()
+        self.clients.remove(client)
+        self.assertEqual(self.receive(1)[0][1], {'status_code': 7})
+        for attempt in xrange(10):
+            if not self.listener.SESSIONS:
+                break
+            self.listener.poll(0.1)
+        self.assertEqual(self.listener.SESSIONS, [])
+
+    def test_replies_to_slow_readers_are_queued(self):
+        slow = self.connect()
+        fast = self.connect()
+        slow.send({'status_code': 1})
+        fast.send({'status_code': 2})
+        sessions = dict((message['status_code'], session) for session, message in self.receive(2))
+
+        # A reply far larger than the socket buffer is queued rather than blocking, as is the reply after it.
+        large = {'status_code': 3, 'data': 'x' * (16 * 1024 * 1024)}
+        start = time.time()
+        self.assertTrue(self.listener.send(sessions[1], large))
+        self.assertTrue(self.listener.send(sessions[1], {'status_code': 4}))
+        self.assertLess(time.time() - start, 1.0)
+        self.assertGreater(len(self.listener.outbound[self.listener.descriptor_of[sessions[1]]]), 0)
+
+        # The other session is still served while the reply waits.
+        self.assertTrue(self.listener.send(sessions[2], {'status_code': 5}))
+        self.assertTrue(fast.poll(5.0))
+        self.assertEqual(fast.recv(), {'status_code': 5})
+
+        # Once the slow client reads, polling sends the rest of the queue, in order.
+        received = []
+        reader = threading.Thread(target=lambda: received.extend([slow.recv(), slow.recv()]))
+        reader.start()
+        while reader.is_alive():
+            self.listener.poll(0.1)
+        self.assertEqual(received, [large, {'status_code': 4}])
+        self.assertEqual(len(self.listener.outbound[self.listener.descriptor_of[sessions[1]]]), 0)
+
+    def test_send_to_closed_session(self):
+        client = self.connect()
+        client.send({'status_code': 1})
+        session = self.receive(1)[0][0]
+        self.listener.close_session(session)
+        self.assertFalse(self.listener.send(session, {'status_code': 2}))
+
+    def test_close_stops_accepting(self):
+        self.connect()
+        self.listener.close()
+        self.assertFalse(self.listener.accept_thread.is_alive())
+        self.assertEqual(self.listener.SESSIONS, [])
+
+        # Leave a listener for tearDown to close.
+        self.listener = SessionListener(os.path.join(self.directory, 'second'), AUTHKEY)
+
+
+class InternetSessionListenerTest(unittest.TestCase):
+
+    def test_port_chosen_by_system(self):
+        listener = SessionListener(('localhost', 0), AUTHKEY)
+        try:
+            client = Client(listener.LISTENER.address, authkey=AUTHKEY)
+            client.send({'status_code': 1})
+            messages = []
+            for attempt in xrange(50):
+                messages.extend(listener.poll(0.1))
+                if messages:
+                    break
+            self.assertEqual(messages[0][1], {'status_code': 1})
+            listener.send(messages[0][0], {'status_code': 2})
+            self.assertTrue(client.poll(5.0))
+            self.assertEqual(client.recv(), {'status_code': 2})
+            client.close()
+        finally:
+            listener.close()
+        self.assertFalse(listener.accept_thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+""" Tests of the evaluation of metric values by a pool of worker processes, and of the shared memory buffers a
+SimulationPotential agrees to map.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_SimulationPotential
+
+"""
+import multiprocessing
+import unittest
+import tempfile
+import logging
+import shutil
+import os
+
+import numpy as np
+
+from SimulationPotential.SimulationPotential import SimulationPotential, initialise_worker
+from SimulationUtilities.Shared_Memory import SharedMetricBuffer, SHARED_MEMORY_DIRECTORY, SHARED_MEMORY_PREFIX
+from Tests.test_SimulationServer import write_configuration_file
+
+SMALL_NUMBER = 1e-12
+
+
+@unittest.skipUnless(os.path.isdir(SHARED_MEMORY_DIRECTORY), 'shared memory is unavailable')
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.potential = SimulationPotential(write_configuration_file(self.directory, 6), os.devnull, logging.WARNING,
+                                             cache_size=64, workers=2)
+        self.molecule, self.batch_calculator = self.potential.prepare_calculators()
+
+        # Points near the start of the path, along with their indices along a curve.
+        random = np.random.RandomState(0)
+        start_point = self.potential.CONFIGURATION['start_point']
+        self.points = [[start_point + 0.01 * random.randn(len(start_point)), i] for i in xrange(5)]
+        self.expected = self.potential.evaluate_values(self.molecule, self.points, SMALL_NUMBER,
+                                                       self.batch_calculator)
+        self.potential.pool = multiprocessing.Pool(2, initialise_worker, (self.potential,))
+
+    def tearDown(self):
+        self.potential.pool.close()
+        self.potential.pool.join()
+        if self.potential.scratch is not None:
+            self.potential.scratch.close()
+        shutil.rmtree(self.directory)
+
+    def assert_values_equal(self, values, expected):
+        self.assertEqual([value[1] for value in values], [value[1] for value in expected])
+        for value, expected_value in zip(values, expected):
+            self.assertAlmostEqual(value[0][0], expected_value[0][0])
+            np.testing.assert_allclose(value[0][1], expected_value[0][1])
+
+    def test_points_received_in_messages(self):
+        self.assert_values_equal(self.potential.evaluate_in_pool(self.points, SMALL_NUMBER), self.expected)
+        path = self.potential.scratch.PATH
+
+        # The buffer is reused for as many points, and replaced by a larger one for more.
+        self.assert_values_equal(self.potential.evaluate_in_pool(self.points[:3], SMALL_NUMBER), self.expected[:3])
+        self.assertEqual(self.potential.scratch.PATH, path)
+        self.assert_values_equal(self.potential.evaluate_in_pool(self.points * 2, SMALL_NUMBER), self.expected * 2)
+        self.assertNotEqual(self.potential.scratch.PATH, path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_points_in_client_buffer(self):
+        buffer = SharedMetricBuffer.create(len(self.points), len(self.points[0][0]))
+        try:
+            for point in self.points:
+                buffer.points[point[1]] = point[0]
+            indices = [0, 2, 3, 4]
+            self.assertEqual(self.potential.compute_shared_values(self.molecule, buffer, indices, SMALL_NUMBER,
+                                                                  self.batch_calculator), indices)
+            self.assert_values_equal([[[buffer.metric[i], buffer.forces[i]], i] for i in indices],
+                                     [self.expected[i] for i in indices])
+
+            # The values computed by the workers are remembered, and taken from the cache next time.
+            buffer.metric[:] = 0.0
+            buffer.forces[:] = 0.0
+            self.potential.compute_shared_values(self.molecule, buffer, indices, SMALL_NUMBER, self.batch_calculator)
+            self.assertEqual(self.potential.cache.hits, len(indices))
+            self.assert_values_equal([[[buffer.metric[i], buffer.forces[i]], i] for i in indices],
+                                     [self.expected[i] for i in indices])
+        finally:
+            buffer.close()
+
+
+@unittest.skipUnless(os.path.isdir(SHARED_MEMORY_DIRECTORY), 'shared memory is unavailable')
+class AttachSharedBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.potential = SimulationPotential(write_configuration_file(self.directory, 6), os.devnull, logging.WARNING)
+        self.buffer = SharedMetricBuffer.create(4, 3)
+        self.client = object()
+
+    def tearDown(self):
+        for buffer in self.potential.buffers.values():
+            buffer.close()
+        self.buffer.close()
+        shutil.rmtree(self.directory)
+
+    def offer(self, path):
+        return {'path': path, 'number_of_points': 4, 'dimension': 3}
+
+    def test_buffer_created_by_client_is_mapped(self):
+        self.assertTrue(self.potential.attach_shared_buffer(self.client, self.buffer.description(), [self.client]))
+        self.assertIn(self.client, self.potential.buffers)
+
+    def test_file_outside_shared_memory_is_refused(self):
+        path = os.path.join(self.directory, SHARED_MEMORY_PREFIX + 'buffer')
+        with open(path, 'wb') as f:
+            f.write('\0' * 8 * 4 * 7)
+        self.assertFalse(self.potential.attach_shared_buffer(self.client, self.offer(path), [self.client]))
+        self.assertFalse(self.potential.attach_shared_buffer(
+            self.client, self.offer(os.path.join(SHARED_MEMORY_DIRECTORY, '..', self.directory.lstrip('/'),
+                                                 SHARED_MEMORY_PREFIX + 'buffer')), [self.client]))
+        self.assertNotIn(self.client, self.potential.buffers)
+
+    def test_file_without_prefix_is_refused(self):
+        descriptor, path = tempfile.mkstemp(prefix='other-', dir=SHARED_MEMORY_DIRECTORY)
+        try:
+            os.ftruncate(descriptor, 8 * 4 * 7)
+            self.assertFalse(self.potential.attach_shared_buffer(self.client, self.offer(path), [self.client]))
+        finally:
+            os.close(descriptor)
+            os.unlink(path)
+
+    def test_symbolic_link_is_refused(self):
+        path = tempfile.mktemp(prefix=SHARED_MEMORY_PREFIX, dir=SHARED_MEMORY_DIRECTORY)
+        os.symlink(self.buffer.PATH, path)
+        try:
+            self.assertFalse(self.potential.attach_shared_buffer(self.client, self.offer(path), [self.client]))
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+""" Tests of the handling of leases and speculative tasks by the SimulationServer.
+
+The SimulationServer is driven directly through assign_task and process_client_response, so no sessions are opened.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_SimulationServer
+
+"""
+import unittest
+import tempfile
+import logging
+import shutil
+import time
+import os
+
+import numpy as np
+
+from SimulationServer.SimulationServer import SimulationServer
+from SimulationUtilities.Communication_Codes import comm_code
+
+
+def write_configuration_file(directory, global_number_of_nodes):
+    """ Write a configuration file for Butane.
+
+    Returns:
+      str: The location of the configuration file.
+
+    """
+    butane = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Examples', 'Butane')
+    configuration_file = os.path.join(directory, 'Butane.bkhf')
+    with open(configuration_file, 'w') as f:
+        f.write('st = ' + os.path.join(butane, 'x0.xyz') + '\n')
+        f.write('en = ' + os.path.join(butane, 'xN.xyz') + '\n')
+        f.write('ln = 3\n')
+        f.write('gn = ' + str(global_number_of_nodes) + '\n')
+        f.write('pa = 100\n')
+        f.write('to = 0.01\n')
+    return configuration_file
+
+
+class ServerTest(unittest.TestCase):
+    """ Create a configuration file for each test, and build the messages a SimulationClient would send.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.configuration_file = write_configuration_file(self.directory, 6)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_server(self, **kwargs):
+        return SimulationServer(self.configuration_file, os.path.join(self.directory, 'Trajectory'), os.devnull,
+                                log_level=logging.WARNING, **kwargs)
+
+    def result(self, server, task, shift=0.01):
+        """ Return a result for task, moving its node by shift in every coordinate.
+
+        """
+        node_number = task['node_number']
+        return {'status_code': comm_code('CLIENT_HAS_MIDPOINT_DATA'),
+                'lease_id': task['lease_id'],
+                'node_number': node_number,
+                'new_node_position': server.CURVE.get_points()[node_number] + shift,
+                'client_name': 'Client'}
+
+
+class LeaseTest(ServerTest):
+
+    def test_expired_lease_is_reissued(self):
+        server = self.make_server(timeout=10.0)
+        task = server.assign_task('Client_0')
+        self.assertAlmostEqual(server.time_until_expiry(), 10.0, places=0)
+
+        # Once the lease runs out its node is handed to the next client, under a new lease.
+        server.leases[task['lease_id']][0] = time.time() - 1.0
+        server.expire_leases()
+        self.assertNotIn(task['lease_id'], server.leases)
+        self.assertIsNone(server.time_until_expiry())
+        reissued = server.assign_task('Client_1')
+        self.assertEqual(reissued['node_number'], task['node_number'])
+        self.assertNotEqual(reissued['lease_id'], task['lease_id'])
+
+        # The late result from the first client is rejected, and the result under the new lease is accepted.
+        server.process_client_response(self.result(server, task))
+        self.assertFalse(server.CURVE.node_moved(task['node_number']))
+        server.process_client_response(self.result(server, reissued))
+        self.assertTrue(server.CURVE.node_moved(task['node_number']))
+
+    def test_heartbeat_renews_lease(self):
+        server = self.make_server(timeout=10.0)
+        task = server.assign_task('Client_0')
+        server.leases[task['lease_id']][0] = time.time() + 0.5
+
+        server.process_client_response({'status_code': comm_code('CLIENT_HEARTBEAT'), 'client_name': 'Client_0',
+                                        'lease_id': task['lease_id']})
+        self.assertGreater(server.leases[task['lease_id']][0], time.time() + 5.0)
+        server.expire_leases()
+        self.assertIn(task['lease_id'], server.leases)
+
+        # Heartbeats for leases that aren't held are ignored.
+        server.process_client_response({'status_code': comm_code('CLIENT_HEARTBEAT'), 'client_name': 'Client_0',
+                                        'lease_id': task['lease_id'] + 100})
+        self.assertNotIn(task['lease_id'] + 100, server.leases)
+
+    def test_unknown_lease_is_rejected(self):
+        server = self.make_server()
+        task = server.assign_task('Client_0')
+        for lease_id in (None, task['lease_id'] + 100):
+            server.process_client_response(self.result(server, {'lease_id': lease_id,
+                                                                'node_number': task['node_number']}))
+            self.assertFalse(server.CURVE.node_moved(task['node_number']))
+        self.assertIn(task['lease_id'], server.leases)
+
+    def test_result_ends_lease(self):
+        server = self.make_server()
+        task = server.assign_task('Client_0')
+        server.process_client_response(self.result(server, task))
+        self.assertNotIn(task['lease_id'], server.leases)
+
+        # The same result sent twice is only accepted once.
+        movement = server.CURVE.movement
+        server.process_client_response(self.result(server, task, shift=0.5))
+        self.assertEqual(server.CURVE.movement, movement)
+
+
+class SpeculativeTaskTest(ServerTest):
+
+    def make_speculative_server(self, speculation_tolerance):
+        return self.make_server(scheduling='push', speculative=True, speculation_tolerance=speculation_tolerance)
+
+    def start_speculation(self, server):
+        """ Hand out the two movable nodes, then a speculative task, and return the results of the first two so that
+        the speculative node becomes movable.
+
+        Returns:
+          dict: The speculative task.
+
+        """
+        first = server.assign_task('Client_0')
+        second = server.assign_task('Client_1')
+        speculative = server.assign_task('Client_2')
+        self.assertEqual((first['node_number'], second['node_number']), (1, 3))
+        self.assertIn(speculative['lease_id'], server.speculative_tasks)
+        self.assertEqual(speculative['node_number'], 2)
+
+        server.process_client_response(self.result(server, first))
+        server.process_client_response(self.result(server, second))
+        return speculative
+
+    def test_speculative_node_not_issued_twice(self):
+        server = self.make_speculative_server(np.inf)
+        speculative = self.start_speculation(server)
+
+        # Both neighbours of the speculative node have moved, but it mustn't be issued again while it is held.
+        task = server.assign_task('Client_3')
+        self.assertNotEqual(task.get('node_number'), speculative['node_number'])
+
+    def test_speculative_result_first_then_leased_result(self):
+        server = self.make_speculative_server(np.inf)
+        speculative = self.start_speculation(server)
+        node_number = speculative['node_number']
+        scheduler = server.CURVE.scheduler
+
+        # The speculative result arrives first and is kept.
+        server.process_client_response(self.result(server, speculative))
+        self.assertEqual(server.speculation_statistics['kept'], 1)
+        self.assertTrue(server.CURVE.node_moved(node_number))
+        movement = server.CURVE.movement
+        position = np.copy(server.CURVE.get_points()[node_number])
+        counters = np.copy(scheduler.node_movable)
+
+        # A result for the same node then arrives under a live lease, and must be ignored.
+        lease_id = server.next_lease_id
+        server.next_lease_id += 1
+        server.leases[lease_id] = [time.time() + server.TIMEOUT, node_number, 'Client_3']
+        late = self.result(server, {'lease_id': lease_id, 'node_number': node_number}, shift=0.5)
+        server.process_client_response(late)
+
+        self.assertEqual(server.CURVE.movement, movement)
+        np.testing.assert_array_equal(server.CURVE.get_points()[node_number], position)
+        np.testing.assert_array_equal(scheduler.node_movable, counters)
+
+    def test_discarded_speculation_releases_node(self):
+        server = self.make_speculative_server(0.0)
+        speculative = self.start_speculation(server)
+
+        # The neighbours moved, so the speculative result is discarded and the node can then be issued normally.
+        server.process_client_response(self.result(server, speculative))
+        self.assertEqual(server.speculation_statistics['discarded'], 1)
+        self.assertFalse(server.CURVE.node_moved(speculative['node_number']))
+        issued = [server.assign_task('Client_%d' % client).get('node_number') for client in xrange(2)]
+        self.assertIn(speculative['node_number'], issued)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+""" Tests of the binary message format, the agreement of its version and the fall back to pickled messages.
+
+Run from the root of the repository::
+
+    python -m unittest Tests.test_Wire_Format
+
+"""
+from pickle import PROTO
+import threading
+import unittest
+import tempfile
+import shutil
+import os
+
+import numpy as np
+
+from SimulationUtilities import Wire_Format
+from SimulationUtilities.Communication_Codes import comm_code
+from SimulationUtilities.Session_Handling import SessionListener
+
+AUTHKEY = 'password'
+
+
+def make_message():
+    """ Return a message containing every field of the binary format.
+
+    """
+    random = np.random.RandomState(0)
+    return {'status_code': comm_code('CLIENT_PROVIDES_POINT'),
+            'request_id': 2 ** 40 + 3,
+            'client_name': 'Client_0',
+            'node_number': 7,
+            'new_node_position': random.randn(6),
+            'left_end_point': random.randn(6),
+            'right_end_point': random.randn(6),
+            'points': [[random.randn(6), i] for i in xrange(3)],
+            'values': [[[random.rand(), random.randn(6)], i] for i in xrange(3)],
+            'indices': [0, 5, 2],
+            'accepted': True,
+            'path': '/dev/shm/modoi-test',
+            'number_of_points': 12,
+            'dimension': 6,
+            'lease_id': -1}
+
+
+class WireFormatTest(unittest.TestCase):
+
+    def assert_messages_equal(self, message, expected):
+        self.assertEqual(sorted(message.keys()), sorted(expected.keys()))
+        for name in expected:
+            if name == 'points':
+                for point, expected_point in zip(message[name], expected[name]):
+                    np.testing.assert_array_equal(point[0], expected_point[0])
+                    self.assertEqual(point[1], expected_point[1])
+            elif name == 'values':
+                for value, expected_value in zip(message[name], expected[name]):
+                    self.assertEqual(value[0][0], expected_value[0][0])
+                    np.testing.assert_array_equal(value[0][1], expected_value[0][1])
+                    self.assertEqual(value[1], expected_value[1])
+            elif isinstance(expected[name], np.ndarray):
+                np.testing.assert_array_equal(message[name], expected[name])
+            else:
+                self.assertEqual(message[name], expected[name])
+        self.assertEqual(len(message.get('points', [])), len(expected.get('points', [])))
+        self.assertEqual(len(message.get('values', [])), len(expected.get('values', [])))
+
+
+class RoundTripTest(WireFormatTest):
+
+    def test_every_field(self):
+        message = make_message()
+        data = Wire_Format.encode(message, 2)
+        self.assertEqual(data[:2], Wire_Format.MAGIC)
+        self.assert_messages_equal(Wire_Format.decode(data), message)
+        self.assert_messages_equal(Wire_Format.loads(Wire_Format.dumps(message, 2)), message)
+
+    def test_each_field_alone(self):
+        message = make_message()
+        for name in Wire_Format.FIELD_NUMBERS:
+            single = {'status_code': message['status_code'], name: message[name]}
+            self.assert_messages_equal(Wire_Format.decode(Wire_Format.encode(single, 2)), single)
+
+    def test_empty_lists(self):
+        message = {'status_code': comm_code('SERVER_PROVIDES_VALUES'), 'points': [], 'values': [], 'indices': []}
+        self.assert_messages_equal(Wire_Format.decode(Wire_Format.encode(message, 1)), message)
+
+    def test_decoded_arrays_are_read_only_views(self):
+        data = Wire_Format.encode({'status_code': 0, 'new_node_position': np.arange(4.0)})
+        vector = Wire_Format.decode(data)['new_node_position']
+        self.assertFalse(vector.flags.writeable)
+        self.assertRaises(ValueError, vector.__setitem__, 0, 1.0)
+
+
+class VersionTest(WireFormatTest):
+
+    def test_lease_id_needs_version_two(self):
+        message = {'status_code': comm_code('CLIENT_HAS_MIDPOINT_DATA'), 'node_number': 3, 'lease_id': 11}
+        self.assertIsNone(Wire_Format.encode(message, 1))
+        self.assertEqual(Wire_Format.dumps(message, 1)[0], PROTO)
+        self.assertEqual(Wire_Format.loads(Wire_Format.dumps(message, 1)), message)
+        self.assertEqual(Wire_Format.dumps(message, 2)[:2], Wire_Format.MAGIC)
+        self.assertEqual(Wire_Format.loads(Wire_Format.dumps(message, 2)), message)
+
+        # Without the lease ID the same message is sent in the binary format of either version.
+        del message['lease_id']
+        self.assertEqual(Wire_Format.dumps(message, 1)[:2], Wire_Format.MAGIC)
+
+    def test_unsupported_versions(self):
+        message = {'status_code': 0, 'node_number': 3}
+        self.assertIsNone(Wire_Format.encode(message, 3))
+        self.assertEqual(Wire_Format.loads(Wire_Format.dumps(message, 3)), message)
+        data = Wire_Format.encode(message, 2)
+        self.assertRaises(ValueError, Wire_Format.decode, data[:2] + chr(3) + data[3:])
+
+    def test_choose_version(self):
+        offer = {'status_code': comm_code('CLIENT_OFFERS_WIRE_FORMAT'), 'versions': [1, 2]}
+        self.assertEqual(Wire_Format.choose_version(offer)['version'], 2)
+        self.assertEqual(Wire_Format.choose_version(offer, (1,))['version'], 1)
+        self.assertEqual(Wire_Format.choose_version(offer, ())['version'], None)
+        self.assertEqual(Wire_Format.choose_version({'status_code': offer['status_code'], 'versions': [3]})['version'],
+                         None)
+        self.assertEqual(Wire_Format.choose_version({'status_code': offer['status_code']})['version'], None)
+
+
+class PickleFallbackTest(WireFormatTest):
+
+    def test_unknown_field(self):
+        message = {'status_code': comm_code('CLIENT_PROVIDES_POINT'), 'request_id': 1, 'error': 'message'}
+        self.assertIsNone(Wire_Format.encode(message, 2))
+        self.assertEqual(Wire_Format.dumps(message, 2)[0], PROTO)
+        self.assertEqual(Wire_Format.loads(Wire_Format.dumps(message, 2)), message)
+
+    def test_values_of_the_wrong_type(self):
+        for name, value in [('client_name', u'Client_0'), ('request_id', 'one'), ('new_node_position', np.eye(2)),
+                            ('request_id', None)]:
+            message = {'status_code': 0, name: value}
+            self.assertIsNone(Wire_Format.encode(message, 2), name)
+            self.assert_messages_equal(Wire_Format.loads(Wire_Format.dumps(message, 2)), message)
+
+    def test_no_version_agreed(self):
+        message = {'status_code': 0, 'node_number': 3}
+        self.assertEqual(Wire_Format.dumps(message)[0], PROTO)
+
+
+class NegotiationTest(WireFormatTest):
+    """ Agree the format with a SessionListener listening on a Unix domain socket, and exchange messages with it.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'listener')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def connect(self, listener, versions):
+        """ Connect to listener, polling it while the offer is answered.
+
+        """
+        result = []
+        thread = threading.Thread(target=lambda: result.append(Wire_Format.connect(self.address, AUTHKEY, versions)))
+        thread.start()
+        while thread.is_alive():
+            self.assertEqual(listener.poll(0.1), [])
+        return result[0]
+
+    def receive(self, listener):
+        for attempt in xrange(50):
+            messages = listener.poll(0.1)
+            if messages:
+                self.assertEqual(len(messages), 1)
+                return messages[0]
+        self.fail('No message received.')
+
+    def exchange(self, wire_formats, versions, expected_version):
+        listener = SessionListener(self.address, AUTHKEY, wire_formats=wire_formats)
+        try:
+            connection = self.connect(listener, versions)
+            self.assertEqual(connection.VERSION, expected_version)
+
+            # Messages with a lease ID are only sent in the binary format from version 2, but arrive either way.
+            message = {'status_code': comm_code('CLIENT_HAS_MIDPOINT_DATA'), 'client_name': 'Client_0',
+                       'node_number': 2, 'new_node_position': np.arange(6.0), 'lease_id': 5}
+            connection.send(message)
+            session, received = self.receive(listener)
+            self.assert_messages_equal(received, message)
+
+            reply = {'status_code': comm_code('SERVER_PROVIDES_VALUES'), 'request_id': 4,
+                     'values': [[[1.5, np.ones(6)], 0]], 'lease_id': 6}
+            self.assertTrue(listener.send(session, reply))
+            self.assertTrue(connection.poll(5.0))
+            self.assert_messages_equal(connection.recv(), reply)
+            connection.close()
+        finally:
+            listener.close()
+
+    def test_newest_common_version_is_agreed(self):
+        self.exchange(Wire_Format.SUPPORTED_VERSIONS, (1, 2), 2)
+
+    def test_older_listener(self):
+        self.exchange((1,), (1, 2), 1)
+
+    def test_older_client(self):
+        self.exchange((1, 2), (1,), 1)
+
+    def test_listener_declines(self):
+        self.exchange((), (1, 2), None)
+
+    def test_client_makes_no_offer(self):
+        self.exchange((1, 2), (), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -183,3 +183,172 @@ class EMT(Calculator):
              (y1 + y2) * self.acut * theta * x) * d / r
         self.forces[a1] -= f
         self.forces[a2] += f
+
+
+def emt_pair_terms(par, slot_atoms, a1, a2, s1, s2, d, rc, acut):
+    """Evaluate EMT energies and forces from flat arrays of pairs.
+
+    Every interacting pair is one entry in the arrays a1, a2, s1, s2
+    and d.  Atoms live in "slots": for a single configuration a slot
+    is just an atom, for a batch of configurations there is one slot
+    per atom per configuration.  Each pair contributes to its two
+    slots exactly as in EMT.interact1() and EMT.interact2(), but all
+    pairs are handled at once with array operations and the results
+    are scattered back onto the slots with np.bincount.
+
+    par: dict of ndarray
+        Per-atom EMT parameters ('E0', 's0', 'V0', 'eta2', 'kappa',
+        'lambda', 'n0', 'gamma1', 'gamma2').
+    slot_atoms: ndarray of int
+        The atom occupying each slot.
+    a1, a2: ndarray of int
+        The atoms of each pair.
+    s1, s2: ndarray of int
+        The slots of each pair.
+    d: ndarray, shape (npairs, 3)
+        The vectors from the first to the second atom of each pair.
+
+    Returns the energy of each slot and the forces, shape (nslots, 3).
+    """
+    nslots = len(slot_atoms)
+    r = np.sqrt((d**2).sum(1))
+    x = np.exp(acut * (r - rc))
+    theta = 1.0 / (1.0 + x)
+    ksi = par['n0'][a2] / par['n0'][a1]
+
+    y1 = (0.5 * par['V0'][a1] *
+          np.exp(-par['kappa'][a2] * (r / beta - par['s0'][a2])) *
+          ksi / par['gamma2'][a1] * theta)
+    y2 = (0.5 * par['V0'][a2] *
+          np.exp(-par['kappa'][a1] * (r / beta - par['s0'][a1])) /
+          ksi / par['gamma2'][a2] * theta)
+    energies = -np.bincount(s1, y1 + y2, nslots).astype(float)
+    f = ((y1 * par['kappa'][a2] + y2 * par['kappa'][a1]) / beta +
+         (y1 + y2) * acut * theta * x) / r
+
+    w1 = (np.exp(-par['eta2'][a2] * (r - beta * par['s0'][a2])) *
+          ksi * theta / par['gamma1'][a1])
+    w2 = (np.exp(-par['eta2'][a1] * (r - beta * par['s0'][a1])) /
+          ksi * theta / par['gamma1'][a2])
+    sigma1 = np.bincount(s1, w1, nslots) + np.bincount(s2, w2, nslots)
+
+    # Slots without neighbours have sigma1 = 0, which EMT.calculate()
+    # handles by catching the error from log():
+    p = dict((name, values[slot_atoms]) for name, values in par.items())
+    ok = sigma1 > 0.0
+    sigma1 = np.where(ok, sigma1, 12.0)
+    ds = -np.log(sigma1 / 12) / (beta * p['eta2'])
+    x1 = p['lambda'] * ds
+    y = np.exp(-x1)
+    z = 6 * p['V0'] * np.exp(-p['kappa'] * ds)
+    deds = np.where(ok, ((x1 * y * p['E0'] * p['lambda'] + p['kappa'] * z) /
+                         (sigma1 * beta * p['eta2'])), 0.0)
+    energies += np.where(ok, p['E0'] * ((1 + x1) * y - 1) + z, -p['E0'])
+
+    y1 = w1 * deds[s1]
+    y2 = w2 * deds[s2]
+    f -= ((y1 * par['eta2'][a2] + y2 * par['eta2'][a1]) +
+          (y1 + y2) * acut * theta * x) / r
+
+    forces = np.empty((nslots, 3))
+    for c in range(3):
+        fc = f * d[:, c]
+        forces[:, c] = (np.bincount(s1, fc, nslots) -
+                        np.bincount(s2, fc, nslots))
+    return energies, forces
+
+
+class BatchEMT:
+    """EMT for many configurations of the same atoms at once.
+
+    The pure Python EMT calculator handles one configuration at a time
+    and loops over atom pairs in Python.  BatchEMT takes an array of
+    positions with shape (nconfigs, natoms, 3) and computes energies
+    and forces for all configurations in one vectorized pass over
+    every (configuration, pair) combination inside the cutoff.  It is
+    meant for molecules, so periodic boundary conditions are not
+    supported.
+
+    Example::
+
+      batch = BatchEMT(atoms)
+      energies, forces = batch.calculate(positions)
+    """
+
+    def __init__(self, atoms):
+        if atoms.get_pbc().any():
+            raise NotImplementedError('BatchEMT does not support periodic '
+                                      'boundary conditions')
+        emt = EMT()
+        emt.initialize(atoms)
+        self.rc = emt.rc
+        self.acut = emt.acut
+        self.numbers = atoms.get_atomic_numbers()
+        self.par = dict((name, np.array([emt.par[Z][name]
+                                         for Z in self.numbers]))
+                        for name in ['E0', 's0', 'V0', 'eta2', 'kappa',
+                                     'lambda', 'n0', 'gamma1', 'gamma2'])
+        self.i, self.j = np.triu_indices(len(atoms), 1)
+
+    def calculate(self, positions):
+        """Return energies, shape (nconfigs,), and forces, shape
+        (nconfigs, natoms, 3), for an array of positions with shape
+        (nconfigs, natoms, 3)."""
+        positions = np.asarray(positions, float)
+        nconfigs, natoms = positions.shape[:2]
+        d = positions[:, self.j] - positions[:, self.i]
+        c, p = np.nonzero((d**2).sum(2) < (self.rc + 0.5)**2)
+        a1 = self.i[p]
+        a2 = self.j[p]
+        energies, forces = emt_pair_terms(self.par,
+                                          np.tile(np.arange(natoms), nconfigs),
+                                          a1, a2, c * natoms + a1,
+                                          c * natoms + a2, d[c, p],
+                                          self.rc, self.acut)
+        return (energies.reshape((nconfigs, natoms)).sum(1),
+                forces.reshape((nconfigs, natoms, 3)))
+
+
+class VectorizedEMT(EMT):
+    """EMT with the pair interactions evaluated as NumPy arrays.
+
+    Gives the same results as EMT, but instead of looping over atoms
+    and their neighbors in Python all pairs are taken from the neighbor
+    list at once and handled together by emt_pair_terms()."""
+
+    def initialize(self, atoms):
+        EMT.initialize(self, atoms)
+        self.nl = NeighborList([0.5 * self.rc + 0.25] * len(atoms),
+                               self_interaction=False, method='cells',
+                               partial=True)
+
+        # Per-species parameter tables, indexed by atom:
+        names = ['E0', 's0', 'V0', 'eta2', 'kappa', 'lambda', 'n0',
+                 'gamma1', 'gamma2']
+        table = np.zeros((len(names), self.numbers.max() + 1))
+        for Z, p in self.par.items():
+            table[:, Z] = [p[name] for name in names]
+        self.parameter_arrays = dict(zip(names, table[:, self.numbers]))
+
+    def calculate(self, atoms=None, properties=['energy'],
+                  system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+
+        if 'numbers' in system_changes:
+            self.initialize(self.atoms)
+
+        natoms = len(self.atoms)
+
+        self.nl.update(self.atoms)
+        a1, a2, d, r = self.nl.get_pairs(self.atoms)
+        inside = r < self.rc + 0.5
+        a1 = a1[inside]
+        a2 = a2[inside]
+        energies, self.forces = emt_pair_terms(self.parameter_arrays,
+                                               np.arange(natoms), a1, a2,
+                                               a1, a2, d[inside],
+                                               self.rc, self.acut)
+        self.energy = energies.sum()
+
+        self.results['energy'] = self.energy
+        self.results['forces'] = self.forces
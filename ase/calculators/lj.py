@@ -30,40 +30,27 @@ class LennardJones(Calculator):
             rc = 3 * sigma
         
         if 'numbers' in system_changes:
-            self.nl = NeighborList([rc / 2] * natoms, self_interaction=False)
+            self.nl = NeighborList([rc / 2] * natoms, self_interaction=False,
+                                   method='cells')
 
         self.nl.update(self.atoms)
         
-        positions = self.atoms.positions
-        cell = self.atoms.cell
-        
         e0 = 4 * epsilon * ((sigma / rc)**12 - (sigma / rc)**6)
-        
-        energy = 0.0
+
+        # Handle every pair at once:
+        a1, a2, d = self.nl.get_pairs(self.atoms)[:3]
+        r2 = (d**2).sum(1)
+        c6 = (sigma**2 / r2)**3
+        c6[r2 > rc**2] = 0.0
+        c12 = c6**2
+        energy = 4 * epsilon * (c12 - c6).sum() - e0 * (c6 != 0.0).sum()
+        f = (24 * epsilon * (2 * c12 - c6) / r2)[:, np.newaxis] * d
         forces = np.zeros((natoms, 3))
-        stress = np.zeros((3, 3))
+        for i in range(3):
+            forces[:, i] = (np.bincount(a2, f[:, i], natoms) -
+                            np.bincount(a1, f[:, i], natoms))
+        stress = np.dot(f.T, d)
 
-        for a1 in range(natoms):
-            neighbors, offsets = self.nl.get_neighbors(a1)
-            cells = np.dot(offsets, cell)
-            d = positions[neighbors] + cells - positions[a1]
-            r2 = (d**2).sum(1)
-            c6 = (sigma**2 / r2)**3
-            c6[r2 > rc**2] = 0.0
-            energy -= e0 * (c6 != 0.0).sum()
-            c12 = c6**2
-            energy += 4 * epsilon * (c12 - c6).sum()
-            f = (24 * epsilon * (2 * c12 - c6) / r2)[:, np.newaxis] * d
-            #print d
-            #print r2**.5
-            #print offsets
-            #print f
-            #print neighbors
-            forces[a1] -= f.sum(axis=0)
-            for a2, f2 in zip(neighbors, f):
-                forces[a2] += f2
-            stress += np.dot(f.T, d)
-        
         #stress = np.dot(stress, cell)
         stress += stress.T.copy()
         stress *= -0.5 / self.atoms.get_volume()
@@ -1,8 +1,23 @@
 from math import sqrt
+from itertools import product
+from time import time
 
 import numpy as np
 
 
+def positive(n, include_zero=True):
+    """Which rows of n, an array of cell offsets, are "positive"?
+
+    Of two opposite offsets exactly one is positive, the first non-zero
+    component deciding which."""
+    n1, n2, n3 = n.T
+    if include_zero:
+        n3 = n3 >= 0
+    else:
+        n3 = n3 > 0
+    return (n1 > 0) | (n1 == 0) & ((n2 > 0) | (n2 == 0) & n3)
+
+
 class NeighborList:
     """Neighbor list object.
 
@@ -21,6 +36,24 @@ class NeighborList:
     bothways: bool
         Return all neighbors.  Default is to return only "half" of
         the neighbors.
+    method: str
+        How the list is built.  The default, 'images', compares every
+        atom with every other atom in each periodic image of the cell,
+        which costs O(N^2).  'cells' sorts the atoms into bins at least
+        as wide as the largest cutoff and only compares atoms in
+        neighboring bins, which scales linearly with the number of
+        atoms.  Both give the same neighbors, possibly in a different
+        order.
+    partial: bool
+        When some atoms have moved more than the skin-distance, only
+        find the neighbors of those atoms again instead of rebuilding
+        the whole list.  The list then contains the same neighbors
+        within the cutoffs, but may differ in the extra neighbors
+        inside the skin.
+
+    The number of full builds, partial rebuilds and updates that reused
+    the list, along with the total time spent building, are kept in
+    the nbuilds, npartial, nreuses and build_time attributes.
 
     Example::
 
@@ -31,13 +64,21 @@ class NeighborList:
     """
 
     def __init__(self, cutoffs, skin=0.3, sorted=False, self_interaction=True,
-                 bothways=False):
+                 bothways=False, method='images', partial=False):
+        if method not in ('images', 'cells'):
+            raise ValueError('Unknown neighbor list method: %r' % method)
         self.cutoffs = np.asarray(cutoffs) + skin
         self.skin = skin
         self.sorted = sorted
         self.self_interaction = self_interaction
         self.bothways = bothways
+        self.method = method
+        self.partial = partial
         self.nupdates = 0
+        self.nbuilds = 0
+        self.npartial = 0
+        self.nreuses = 0
+        self.build_time = 0.0
 
     def update(self, atoms):
         """Make sure the list is up to date."""
@@ -46,16 +87,39 @@ class NeighborList:
             return True
 
         if ((self.pbc != atoms.get_pbc()).any() or
-            (self.cell != atoms.get_cell()).any() or
-            ((self.positions - atoms.get_positions())**2).sum(1).max() >
-            self.skin**2):
+            (self.cell != atoms.get_cell()).any()):
             self.build(atoms)
             return True
 
-        return False
+        moved = (((self.positions - atoms.get_positions())**2).sum(1) >
+                 self.skin**2)
+        if not moved.any():
+            self.nreuses += 1
+            return False
+
+        if self.partial:
+            self.rebuild(atoms, moved.nonzero()[0])
+        else:
+            self.build(atoms)
+        return True
 
     def build(self, atoms):
-        """Build the list."""
+        """Build the list.
+
+        The neighbors are stored in compressed sparse row form: those of
+        atom a are indices[indptr[a]:indptr[a + 1]], with the matching
+        rows of offsets."""
+        start = time()
+        if self.method == 'cells':
+            self.build_cells(atoms)
+        else:
+            self.build_images(atoms)
+        self.nbuilds += 1
+        self.nupdates += 1
+        self.build_time += time() - start
+
+    def build_images(self, atoms):
+        """Build the list by looping over every periodic image."""
         self.positions = atoms.get_positions()
         self.pbc = atoms.get_pbc()
         self.cell = atoms.get_cell()
@@ -86,8 +150,8 @@ class NeighborList:
 
         self.nneighbors = 0
         self.npbcneighbors = 0
-        self.neighbors = [np.empty(0, int) for a in range(natoms)]
-        self.displacements = [np.empty((0, 3), int) for a in range(natoms)]
+        neighbors = [np.empty(0, int) for a in range(natoms)]
+        displacements = [np.empty((0, 3), int) for a in range(natoms)]
         for n1 in range(0, N[0] + 1):
             for n2 in range(-N[1], N[1] + 1):
                 for n3 in range(-N[2], N[2] + 1):
@@ -104,45 +168,303 @@ class NeighborList:
                             else:
                                 i = i[i > a]
                         self.nneighbors += len(i)
-                        self.neighbors[a] = np.concatenate(
-                            (self.neighbors[a], i))
+                        neighbors[a] = np.concatenate((neighbors[a], i))
                         disp = np.empty((len(i), 3), int)
                         disp[:] = (n1, n2, n3)
                         disp += offsets[i] - offsets[a]
                         self.npbcneighbors += disp.any(1).sum()
-                        self.displacements[a] = np.concatenate(
-                            (self.displacements[a], disp))
+                        displacements[a] = np.concatenate(
+                            (displacements[a], disp))
 
         if self.bothways:
             neighbors2 = [[] for a in range(natoms)]
             displacements2 = [[] for a in range(natoms)]
             for a in range(natoms):
-                for b, disp in zip(self.neighbors[a], self.displacements[a]):
+                for b, disp in zip(neighbors[a], displacements[a]):
                     neighbors2[b].append(a)
                     displacements2[b].append(-disp)
             for a in range(natoms):
                 # Force neighbors to be integer array
-                self.neighbors[a] = np.array(np.concatenate((self.neighbors[a],
-                                                    neighbors2[a])), int)
-                self.displacements[a] = np.array(list(self.displacements[a]) +
-                                                 displacements2[a])
+                neighbors[a] = np.array(np.concatenate((neighbors[a],
+                                                        neighbors2[a])), int)
+                displacements[a] = np.array(list(displacements[a]) +
+                                            displacements2[a],
+                                            int).reshape((-1, 3))
 
         if self.sorted:
-            for a, i in enumerate(self.neighbors):
+            for a, i in enumerate(neighbors):
                 mask = (i < a)
                 if mask.any():
                     j = i[mask]
-                    offsets = self.displacements[a][mask]
+                    offsets = displacements[a][mask]
                     for b, offset in zip(j, offsets):
-                        self.neighbors[b] = np.concatenate(
-                            (self.neighbors[b], [a]))
-                        self.displacements[b] = np.concatenate(
-                                (self.displacements[b], [-offset]))
+                        neighbors[b] = np.concatenate((neighbors[b], [a]))
+                        displacements[b] = np.concatenate(
+                                (displacements[b], [-offset]))
                     mask = np.logical_not(mask)
-                    self.neighbors[a] = self.neighbors[a][mask]
-                    self.displacements[a] = self.displacements[a][mask]
+                    neighbors[a] = neighbors[a][mask]
+                    displacements[a] = displacements[a][mask]
+
+        self.indptr = np.concatenate(
+            ([0], np.cumsum([len(i) for i in neighbors], dtype=int)))
+        self.indices = np.concatenate(neighbors +
+                                      [np.empty(0, int)]).astype(int)
+        self.offsets = np.concatenate(displacements +
+                                      [np.empty((0, 3), int)]).astype(int)
+
+    def build_cells(self, atoms):
+        """Build the list using a cell list.
+
+        In the half list a pair (a, b) is stored under the smaller
+        index, so the list is always sorted."""
+        self.positions = atoms.get_positions()
+        self.pbc = atoms.get_pbc()
+        self.cell = atoms.get_cell()
+        self.store(*self.search_cells())
+
+    def wrap(self):
+        """Return the positions the list was built from wrapped into the
+        cell along periodic directions, and the cell offsets that were
+        removed."""
+        scaled = np.dot(self.positions, np.linalg.inv(self.cell))
+        scaled0 = scaled.copy()
+        scaled0[:, self.pbc] %= 1.0
+        offsets = (scaled0 - scaled).round().astype(int)
+        return scaled0, np.dot(scaled0, self.cell), offsets
+
+    def search_cells(self, sources=None):
+        """Find pairs using a cell list.
+
+        Only pairs involving at least one of the atoms in sources are
+        returned, or all pairs if sources is None.  The pairs are
+        returned as a half list of flat arrays: first atoms, second
+        atoms and offsets."""
+        natoms = len(self.positions)
+        if len(self.cutoffs) > 0:
+            rcmax = self.cutoffs.max()
+        else:
+            rcmax = 0.0
+
+        icell = np.linalg.inv(self.cell)
+        scaled0, positions0, offsets = self.wrap()
+
+        # Divide each direction of the cell into bins whose faces are at
+        # least 2 * rcmax apart, and find how many bins to either side
+        # must be searched (more than one when a periodic cell is
+        # thinner than the cutoff):
+        lower = np.zeros(3)
+        width = np.ones(3)
+        nbins = np.ones(3, int)
+        nsearch = np.zeros(3, int)
+        for i in range(3):
+            v = icell[:, i]
+            h = 1 / sqrt(np.dot(v, v))
+            if self.pbc[i]:
+                extent = 1.0
+            elif natoms > 0:
+                lower[i] = scaled0[:, i].min()
+                extent = scaled0[:, i].max() - lower[i]
+            else:
+                extent = 0.0
+            if rcmax > 0 and extent * h > 2 * rcmax:
+                nbins[i] = int(extent * h / (2 * rcmax))
+            if extent > 0:
+                width[i] = extent / nbins[i]
+            if self.pbc[i]:
+                nsearch[i] = int(np.ceil(2 * rcmax / (width[i] * h)))
+            else:
+                nsearch[i] = min(1, nbins[i] - 1)
+
+        bins = np.floor((scaled0 - lower) / width).astype(int)
+        bins = np.clip(bins, 0, nbins - 1)
+
+        def label(bins):
+            return (bins[:, 0] * nbins[1] + bins[:, 1]) * nbins[2] + bins[:, 2]
+
+        order = np.argsort(label(bins), kind='mergesort')
+        sorted_labels = label(bins)[order]
+
+        if sources is None:
+            sources = np.arange(natoms)
+            is_source = None
+        else:
+            is_source = np.zeros(natoms, bool)
+            is_source[sources] = True
+
+        first = []
+        second = []
+        displacements = []
+        for shift in product(*[range(-n, n + 1) for n in nsearch]):
+            # A pair found through one bin shift is found again from its
+            # other atom through the opposite shift, so when searching
+            # from every atom only half of the shifts are needed:
+            if is_source is None and not positive(np.array([shift]))[0]:
+                continue
 
+            # Find the bin each atom has to be compared with, and the
+            # periodic image it lies in:
+            neighbor_bins = bins[sources] + shift
+            images = np.where(self.pbc, neighbor_bins // nbins, 0)
+            neighbor_bins -= images * nbins
+            inside = ((neighbor_bins >= 0) & (neighbor_bins < nbins)).all(1)
+            labels = label(neighbor_bins[inside])
+            start = np.searchsorted(sorted_labels, labels, 'left')
+            count = np.searchsorted(sorted_labels, labels, 'right') - start
+
+            # Pair each atom with every atom of its neighboring bin,
+            # dropping the pairs that will also be found the other way
+            # round:
+            index = np.repeat(np.arange(len(labels)), count)
+            a = sources[inside][index]
+            b = order[np.arange(len(index)) +
+                      np.repeat(start - count.cumsum() + count, count)]
+            images = images[inside]
+            if is_source is None:
+                if shift != (0, 0, 0):
+                    mask = None
+                elif self.self_interaction:
+                    mask = a <= b
+                else:
+                    mask = a < b
+            else:
+                mask = ~(is_source[b] & (b < a) |
+                         (a == b) & ~positive(images[index],
+                                              self.self_interaction))
+            if mask is not None:
+                index = index[mask]
+                a = a[mask]
+                b = b[mask]
+
+            shifted = positions0[sources[inside]] - np.dot(images, self.cell)
+            d = positions0[b] - shifted[index]
+            mask = (d**2).sum(1) < (self.cutoffs[a] + self.cutoffs[b])**2
+            a = a[mask]
+            b = b[mask]
+            disp = images[index[mask]] + offsets[b] - offsets[a]
+
+            # Store each pair under the smaller index, and an atom paired
+            # with its own image under the "positive" image:
+            swap = (a > b) | (a == b) & ~positive(disp, self.self_interaction)
+            a[swap], b[swap] = b[swap], a[swap]
+            disp[swap] *= -1
+            first.append(a)
+            second.append(b)
+            displacements.append(disp)
+
+        return (np.concatenate(first), np.concatenate(second),
+                np.concatenate(displacements))
+
+    def search_images(self, sources):
+        """Find the pairs involving the atoms in sources by comparing each
+        of them with every atom in each periodic image of the cell.
+
+        The pairs are returned as a half list of flat arrays: first
+        atoms, second atoms and offsets."""
+        natoms = len(self.positions)
+        if len(self.cutoffs) > 0:
+            rcmax = self.cutoffs.max()
+        else:
+            rcmax = 0.0
+
+        icell = np.linalg.inv(self.cell)
+        scaled0, positions0, offsets = self.wrap()
+
+        N = []
+        for i in range(3):
+            if self.pbc[i]:
+                v = icell[:, i]
+                h = 1 / sqrt(np.dot(v, v))
+                N.append(int(2 * rcmax / h) + 1)
+            else:
+                N.append(0)
+        images = np.array(list(product(*[range(-n, n + 1) for n in N])))
+        cells = np.dot(images, self.cell)
+
+        is_source = np.zeros(natoms, bool)
+        is_source[sources] = True
+
+        first = []
+        second = []
+        displacements = []
+        for a in sources:
+            d = positions0 + cells[:, np.newaxis] - positions0[a]
+            mask = (d**2).sum(2) < (self.cutoffs + self.cutoffs[a])**2
+            n, b = mask.nonzero()
+
+            # Drop the pairs that are also found the other way round:
+            mask = ~(is_source[b] & (b < a) |
+                     (b == a) & ~positive(images[n], self.self_interaction))
+            b = b[mask]
+            disp = images[n[mask]] + offsets[b] - offsets[a]
+
+            # Store each pair under the smaller index:
+            swap = b < a
+            first.append(np.where(swap, b, a))
+            second.append(np.where(swap, a, b))
+            disp[swap] *= -1
+            displacements.append(disp)
+
+        return (np.concatenate(first + [np.empty(0, int)]),
+                np.concatenate(second + [np.empty(0, int)]),
+                np.concatenate(displacements + [np.empty((0, 3), int)]))
+
+    def rebuild(self, atoms, moved):
+        """Rebuild the list for some of the atoms only.
+
+        The neighbors of the atoms in moved are found again from their
+        current positions, while every other atom keeps the neighbors,
+        and the reference position, it had before.  Pairs between the
+        moved atoms and the others are found using the reference
+        positions of the others, so the list stays valid until any atom
+        moves more than the skin-distance from its reference
+        position."""
+        start = time()
+        self.positions[moved] = atoms.get_positions()[moved]
+        if self.method == 'cells':
+            pairs = self.search_cells(moved)
+        else:
+            pairs = self.search_images(moved)
+
+        # Keep the pairs that do not involve any of the moved atoms:
+        is_moved = np.zeros(len(self.positions), bool)
+        is_moved[moved] = True
+        first = np.repeat(np.arange(len(self.indptr) - 1),
+                          np.diff(self.indptr))
+        keep = ~(is_moved[first] | is_moved[self.indices])
+        self.store(*pairs, keep=keep)
+        self.npartial += 1
         self.nupdates += 1
+        self.build_time += time() - start
+
+    def store(self, first, second, displacements, keep=None):
+        """Store a half list of pairs in compressed sparse row form.
+
+        If keep is given the stored pairs it selects are kept alongside
+        the new ones."""
+        if self.bothways:
+            first, second = (np.concatenate((first, second)),
+                             np.concatenate((second, first)))
+            displacements = np.concatenate((displacements, -displacements))
+
+        if keep is not None:
+            old = np.repeat(np.arange(len(self.indptr) - 1),
+                            np.diff(self.indptr))
+            first = np.concatenate((old[keep], first))
+            second = np.concatenate((self.indices[keep], second))
+            displacements = np.concatenate((self.offsets[keep],
+                                            displacements))
+
+        order = np.argsort(first, kind='mergesort')
+        self.indptr = np.concatenate(
+            ([0], np.bincount(first, minlength=len(self.positions)).cumsum()))
+        self.indices = second[order]
+        self.offsets = displacements[order]
+
+        self.nneighbors = len(self.indices)
+        self.npbcneighbors = self.offsets.any(1).sum()
+        if self.bothways:
+            self.nneighbors //= 2
+            self.npbcneighbors //= 2
 
     def get_neighbors(self, a):
         """Return neighbors of atom number a.
@@ -159,4 +481,27 @@ class NeighborList:
         then get_neighbors(b) will not return a as a neighbor - unless
         bothways=True was used."""
 
-        return self.neighbors[a], self.displacements[a]
+        i = slice(self.indptr[a], self.indptr[a + 1])
+        return self.indices[i], self.offsets[i]
+
+    def get_pairs(self, atoms):
+        """Return every pair in the list at once.
+
+        Four arrays are returned: the first and second atom of each
+        pair, the vectors from the first to the second atom, and their
+        lengths.  The vectors are calculated from the current positions
+        of atoms, so this is equivalent to, but much faster than::
+
+          for i in range(len(atoms)):
+              indices, offsets = nl.get_neighbors(i)
+              for j, offset in zip(indices, offsets):
+                  d = (atoms.positions[j] + dot(offset, atoms.get_cell()) -
+                       atoms.positions[i])
+
+        """
+        positions = atoms.get_positions()
+        first = np.repeat(np.arange(len(self.indptr) - 1),
+                          np.diff(self.indptr))
+        d = (positions[self.indices] + np.dot(self.offsets, atoms.get_cell()) -
+             positions[first])
+        return first, self.indices, d, np.sqrt((d**2).sum(1))
@@ -0,0 +1,18 @@
+import numpy as np
+from ase.calculators.emt import EMT, BatchEMT
+from ase.structure import molecule
+
+atoms = molecule('CH3CH2OH')
+atoms.calc = EMT()
+batch = BatchEMT(atoms)
+
+np.random.seed(42)
+positions = atoms.positions + 0.2 * np.random.randn(8, len(atoms), 3)
+positions[3, 0] += 20.0  # an isolated atom
+positions[5] *= 10.0  # no atoms within the cutoff
+energies, forces = batch.calculate(positions)
+for R, e, f in zip(positions, energies, forces):
+    atoms.set_positions(R)
+    print(e, atoms.get_potential_energy())
+    assert abs(e - atoms.get_potential_energy()) < 1e-10
+    assert abs(f - atoms.get_forces()).max() < 1e-10
@@ -0,0 +1,33 @@
+import numpy as np
+from ase.calculators.emt import EMT, VectorizedEMT
+from ase.lattice import bulk
+from ase.structure import molecule
+
+np.random.seed(17)
+
+cu = bulk('Cu', 'fcc', a=3.6).repeat((3, 3, 3))
+del cu[5]
+cu.numbers[[1, 2, 3]] = [79, 47, 28]  # Au, Ag, Ni
+
+slab = cu.copy()
+slab.set_pbc((True, True, False))
+
+skewed = bulk('Cu', 'fcc', a=3.6)
+skewed.set_cell(np.dot(skewed.cell, [[1, 0.1, 0], [0, 1, 0.2], [0, 0, 1]]),
+                scale_atoms=True)
+skewed = skewed.repeat((2, 3, 2))
+
+ethanol = molecule('CH3CH2OH')
+
+for atoms in [cu, slab, skewed, ethanol]:
+    reference = atoms.copy()
+    reference.calc = EMT()
+    atoms.calc = VectorizedEMT()
+    for step in range(3):
+        R = atoms.get_positions() + 0.1 * np.random.randn(len(atoms), 3)
+        atoms.set_positions(R)
+        reference.set_positions(R)
+        e = atoms.get_potential_energy()
+        print(e, reference.get_potential_energy())
+        assert abs(e - reference.get_potential_energy()) < 1e-10
+        assert abs(atoms.get_forces() - reference.get_forces()).max() < 1e-10
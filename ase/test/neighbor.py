@@ -1,3 +1,5 @@
+from itertools import product
+
 import numpy.random as random
 import numpy as np
 from ase import Atoms
@@ -24,19 +26,21 @@ def count(nl, atoms):
         d += (((R[i] + np.dot(offsets, cell) - R[a])**2).sum(1)**0.5).sum()
     return d, c
 
-for sorted in [False, True]:
+for method, sorted in product(['images', 'cells'], [False, True]):
     for p1 in range(2):
         for p2 in range(2):
             for p3 in range(2):
                 print(p1, p2, p3)
                 atoms.set_pbc((p1, p2, p3))
                 nl = NeighborList(atoms.numbers * 0.2 + 0.5,
-                                  skin=0.0, sorted=sorted)
+                                  skin=0.0, sorted=sorted,
+                                  method=method)
                 nl.update(atoms)
                 d, c = count(nl, atoms)
                 atoms2 = atoms.repeat((p1 + 1, p2 + 1, p3 + 1))
                 nl2 = NeighborList(atoms2.numbers * 0.2 + 0.5,
-                                   skin=0.0, sorted=sorted)
+                                   skin=0.0, sorted=sorted,
+                                   method=method)
                 nl2.update(atoms2)
                 d2, c2 = count(nl2, atoms2)
                 c2.shape = (-1, 10)
@@ -46,31 +50,117 @@ for sorted in [False, True]:
                 assert abs(dd) < 1e-10
                 assert not (c2 - c).any()
 
-h2 = Atoms('H2', positions=[(0, 0, 0), (0, 0, 1)])
-nl = NeighborList([0.5, 0.5], skin=0.1, sorted=True, self_interaction=False)
-assert nl.update(h2)
-assert not nl.update(h2)
-assert (nl.get_neighbors(0)[0] == [1]).all()
+for method in ['images', 'cells']:
+    h2 = Atoms('H2', positions=[(0, 0, 0), (0, 0, 1)])
+    nl = NeighborList([0.5, 0.5], skin=0.1, sorted=True,
+                      self_interaction=False, method=method)
+    assert nl.update(h2)
+    assert not nl.update(h2)
+    assert (nl.get_neighbors(0)[0] == [1]).all()
+
+    h2[1].z += 0.09
+    assert not nl.update(h2)
+    assert (nl.get_neighbors(0)[0] == [1]).all()
+
+    h2[1].z += 0.09
+    assert nl.update(h2)
+    assert (nl.get_neighbors(0)[0] == []).all()
+    assert nl.nupdates == 2
+
+    x = bulk('X', 'fcc', a=2**0.5)
+    print(x)
 
-h2[1].z += 0.09
-assert not nl.update(h2)
-assert (nl.get_neighbors(0)[0] == [1]).all()
+    nl = NeighborList([0.5], skin=0.01, bothways=True,
+                      self_interaction=False, method=method)
+    nl.update(x)
+    assert len(nl.get_neighbors(0)[0]) == 12
 
-h2[1].z += 0.09
-assert nl.update(h2)
-assert (nl.get_neighbors(0)[0] == []).all()
-assert nl.nupdates == 2
+    nl = NeighborList([0.5] * 27, skin=0.01, bothways=True,
+                      self_interaction=False, method=method)
+    nl.update(x * (3, 3, 3))
+    for a in range(27):
+        assert len(nl.get_neighbors(a)[0]) == 12
+    assert not np.any(nl.get_neighbors(13)[1])
 
-x = bulk('X', 'fcc', a=2**0.5)
-print(x)
+# The cell list must find exactly the same pairs as the loop over images,
+# including for cells thinner than the cutoff and mixed boundary conditions:
+def pairs(nl, atoms):
+    found = []
+    for a in range(len(atoms)):
+        for b, offset in zip(*nl.get_neighbors(a)):
+            found.append((a, b) + tuple(offset))
+    found.sort()
+    return found
+
+atoms = Atoms(numbers=range(40),
+              cell=[(4.2, 0.3, 0.1),
+                    (1.4, 3.9, 0.6),
+                    (0.3, -1.1, 5.0)])
+atoms.set_scaled_positions(3 * random.random((40, 3)) - 1)
+for pbc in [(1, 1, 1), (1, 0, 1), (0, 0, 0)]:
+    atoms.set_pbc(pbc)
+    for cutoff in [0.1, 0.9, 2.6]:
+        for self_interaction, bothways in product([False, True], repeat=2):
+            nl1 = NeighborList([cutoff] * 40, skin=0.0, sorted=not bothways,
+                               self_interaction=self_interaction,
+                               bothways=bothways)
+            nl2 = NeighborList([cutoff] * 40, skin=0.0,
+                               self_interaction=self_interaction,
+                               bothways=bothways, method='cells')
+            nl1.update(atoms)
+            nl2.update(atoms)
+            assert pairs(nl1, atoms) == pairs(nl2, atoms)
+            assert nl1.nneighbors == nl2.nneighbors
+            assert nl1.npbcneighbors == nl2.npbcneighbors
 
-nl = NeighborList([0.5], skin=0.01, bothways=True, self_interaction=False)
-nl.update(x)
-assert len(nl.get_neighbors(0)[0]) == 12
+# get_pairs() returns the same pairs as get_neighbors(), all at once:
+atoms.set_pbc((1, 0, 1))
+atoms.rattle(0.01)
+for method in ['images', 'cells']:
+    nl = NeighborList([1.3] * 40, bothways=True, method=method)
+    nl.update(atoms)
+    i, j, d, r = nl.get_pairs(atoms)
+    assert len(i) == len(nl.indices) == nl.indptr[-1]
+    R = atoms.get_positions()
+    for a in range(len(atoms)):
+        indices, offsets = nl.get_neighbors(a)
+        assert (i[i == a] == a).all()
+        assert (j[i == a] == indices).all()
+        d2 = R[indices] + np.dot(offsets, atoms.get_cell()) - R[a]
+        assert abs(d[i == a] - d2).max() < 1e-10
+        assert abs(r[i == a] - np.sqrt((d2**2).sum(1))).max() < 1e-10
 
-nl = NeighborList([0.5] * 27, skin=0.01, bothways=True, self_interaction=False)
-nl.update(x * (3, 3, 3))
-for a in range(27):
-    assert len(nl.get_neighbors(a)[0]) == 12
-assert not np.any(nl.get_neighbors(13)[1])
+# Partial rebuilds must give the same neighbors within the cutoffs as a
+# full build, however the atoms wander:
+def close_pairs(nl, atoms, cutoffs):
+    i, j, d, r = nl.get_pairs(atoms)
+    mask = r < cutoffs[i] + cutoffs[j]
+    found = zip(i[mask], j[mask], *nl.offsets[mask].T)
+    found.sort()
+    return found
 
+cutoffs = np.array([1.1] * 20 + [0.7] * 20)
+for method, pbc, bothways in product(['images', 'cells'],
+                                     [(1, 1, 1), (1, 0, 1), (0, 0, 0)],
+                                     [False, True]):
+    atoms.set_pbc(pbc)
+    nl = NeighborList(cutoffs, skin=0.2, sorted=not bothways,
+                      bothways=bothways, method=method, partial=True)
+    positions = atoms.get_positions()
+    for step in range(20):
+        atoms.set_positions(positions)
+        atoms.positions[random.randint(0, 40, 3)] += random.normal(0, 0.3,
+                                                                   (3, 3))
+        positions = atoms.get_positions()
+        nl.update(atoms)
+        nl2 = NeighborList(cutoffs, skin=0.0, sorted=not bothways,
+                           bothways=bothways, method=method)
+        nl2.update(atoms)
+        assert close_pairs(nl, atoms, cutoffs) == close_pairs(nl2, atoms,
+                                                              cutoffs)
+        if not bothways:
+            i = nl.get_pairs(atoms)[0]
+            assert len(set(zip(i, nl.indices, *nl.offsets.T))) == len(i)
+    assert nl.nbuilds == 1
+    assert nl.npartial + nl.nreuses == 19
+    assert nl.nupdates == 1 + nl.npartial